@@ -3,16 +3,20 @@ from transformers import pipeline,AutoModelForQuestionAnswering,AutoTokenizer
 import torch
 # Initialize QA pipeline
 @st.cache_resource
-def load_qa_pipeline():
+def load_qa_pipeline(quantize: bool = False):
     model_id = "deependra-2007/distilbert-qa-finetuned"
     model = AutoModelForQuestionAnswering.from_pretrained(
         model_id,
         torch_dtype=torch.float32,
     )
+    if quantize:
+        # INT8 dynamic quantization of the linear layers (CPU only)
+        model = torch.ao.quantization.quantize_dynamic(model.eval(), {torch.nn.Linear}, dtype=torch.qint8)
     tokenizer = AutoTokenizer.from_pretrained(model_id)
     return pipeline("question-answering", model=model, tokenizer=tokenizer,device=-1)
 def run():
-    qa_pipeline = load_qa_pipeline()
+    quantize = st.checkbox("Use INT8 quantized model (faster on CPU)", value=False)
+    qa_pipeline = load_qa_pipeline(quantize)
     # Streamlit App
     st.title("📚 QA Chatbot with DistilBERT")
     st.write("Ask a question based on the provided context.")
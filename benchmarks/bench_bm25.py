@@ -0,0 +1,94 @@
+"""
+Benchmark InvertedIndexBM25 against rank_bm25.BM25Okapi.
+
+Checks that both engines produce identical top-k rankings (ties broken by doc
+id) with and without MaxScore pruning, and reports stage-1 sparse latency:
+rank_bm25 get_scores + full argsort versus the inverted-index top_k.
+
+    python benchmarks/bench_bm25.py --sizes 1000 10000 100000 --json bm25.json
+"""
+
+import argparse
+import time
+
+import numpy as np
+from rank_bm25 import BM25Okapi
+
+from common import synthetic_financial_corpus, synthetic_queries, time_calls, write_report
+from convai_group_111_rag_vs_ft import InvertedIndexBM25
+
+
+def _reference_top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    return np.lexsort((np.arange(len(scores)), -scores))[:k]
+
+
+def run(sizes, n_queries: int, k: int, repeats: int):
+    results = []
+    queries = [q.lower().split() for q in synthetic_queries(n_queries)]
+
+    for size in sizes:
+        docs = [d.lower().split() for d in synthetic_financial_corpus(size)]
+
+        start = time.perf_counter()
+        reference = BM25Okapi(docs)
+        ref_build = time.perf_counter() - start
+        start = time.perf_counter()
+        engine = InvertedIndexBM25(docs)
+        engine.top_k(queries[0], k)  # include the first postings merge in build time
+        inv_build = time.perf_counter() - start
+
+        mismatches = {'exact': 0, 'pruned': 0}
+        for tokens in queries:
+            ref_scores = reference.get_scores(tokens)
+            expected = _reference_top_k(ref_scores, k)
+            # rank_bm25 ranks every document; the inverted index only those containing a term
+            expected = expected[ref_scores[expected] > 0]
+            for mode, prune in (('exact', False), ('pruned', True)):
+                engine.prune = prune
+                got, _ = engine.top_k(tokens, k)
+                got = got[:len(expected)]
+                if not np.array_equal(got, expected):
+                    mismatches[mode] += 1
+        engine.prune = False
+
+        query_iter = iter(range(10 ** 9))
+
+        def ref_query():
+            tokens = queries[next(query_iter) % len(queries)]
+            np.argsort(reference.get_scores(tokens))[::-1][:k]
+
+        def inv_query(prune=False):
+            engine.prune = prune
+            engine.top_k(queries[next(query_iter) % len(queries)], k)
+
+        row = {
+            'corpus_size': size,
+            'build_s': {'rank_bm25': ref_build, 'inverted': inv_build},
+            'ranking_mismatches': mismatches,
+            'rank_bm25': time_calls(ref_query, repeats),
+            'inverted': time_calls(inv_query, repeats),
+            'inverted_maxscore': time_calls(lambda: inv_query(prune=True), repeats),
+        }
+        results.append(row)
+        print(f"n={size:>7}  rank_bm25 p50={row['rank_bm25']['p50_ms']:8.2f} ms  "
+              f"inverted p50={row['inverted']['p50_ms']:7.2f} ms  "
+              f"maxscore p50={row['inverted_maxscore']['p50_ms']:7.2f} ms  "
+              f"mismatches={mismatches}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=20)
+    parser.add_argument("--repeats", type=int, default=30)
+    parser.add_argument("--json", help="write a machine-readable report to this path")
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.queries, args.k, args.repeats)
+    write_report(args.json, "bm25", results)
+
+
+if __name__ == "__main__":
+    main()
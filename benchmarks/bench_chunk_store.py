@@ -0,0 +1,119 @@
+"""
+Memory and access cost of ChunkStore versus the former per-chunk Python
+objects (one str in a documents list and one metadata dict per chunk).
+
+For each corpus size it reports the Python heap (tracemalloc) held by
+
+    objects    list of str + list of metadata dicts
+    store      ChunkStore built in memory (contiguous buffer + columns)
+    mapped     ChunkStore loaded from a snapshot (memory-mapped files)
+
+plus snapshot save/load time and the latency of reading the text and
+metadata of 20 random chunks (what one query's reranking and prompt read).
+The mapped store's pages live in the OS page cache, not the Python heap.
+Round trips are checked: every text and metadata dict must survive save/load.
+
+    python benchmarks/bench_chunk_store.py --sizes 10000 100000 --json chunk_store.json
+"""
+
+import argparse
+import gc
+import random
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+from common import synthetic_financial_corpus, time_calls, write_report
+from convai_group_111_rag_vs_ft import ChunkStore
+
+
+def chunk_metadata(texts):
+    return [{'id': i, 'type': 'paragraph', 'preview': text[:100], 'source': f"reports/annual_{i % 50}.pdf"}
+            for i, text in enumerate(texts)]
+
+
+def build_store(texts, metadata) -> ChunkStore:
+    store = ChunkStore()
+    store.append(texts, metadata)
+    return store
+
+
+def heap_bytes(build):
+    """Python heap allocated by build() and still held by its result"""
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size
+
+
+def run(sizes, repeats: int):
+    results = []
+    rng = random.Random(0)
+    for size in sizes:
+        texts = synthetic_financial_corpus(size)
+        text_bytes = sum(len(t.encode("utf-8")) for t in texts)
+
+        # Fresh copies, as if the texts had just been read from the files
+        objects, objects_bytes = heap_bytes(lambda: ([t.encode("utf-8").decode("utf-8") for t in texts],
+                                                     chunk_metadata(texts)))
+        metadata = objects[1]
+        store, store_bytes = heap_bytes(lambda: build_store(texts, metadata))
+
+        with tempfile.TemporaryDirectory() as snapshot_dir:
+            path = Path(snapshot_dir)
+            start = time.perf_counter()
+            store.save(path)
+            save_s = time.perf_counter() - start
+            start = time.perf_counter()
+            ChunkStore.load(path)
+            load_s = time.perf_counter() - start
+            mapped, mapped_bytes = heap_bytes(lambda: ChunkStore.load(path))
+
+            sample = rng.sample(range(size), min(size, 1000))
+            round_trip_ok = all(mapped.text(i) == texts[i] and mapped.metadata(i) == metadata[i] for i in sample)
+
+            def read_query(s):
+                for i in rng.sample(range(size), 20):
+                    s.text(i)
+                    s.metadata(i)
+
+            row = {
+                'chunks': size,
+                'text_bytes': text_bytes,
+                'heap_bytes': {'objects': objects_bytes, 'store': store_bytes, 'mapped': mapped_bytes},
+                'save_s': save_s,
+                'load_s': load_s,
+                'read_20': {'objects': time_calls(lambda: [(objects[0][i], dict(objects[1][i]))
+                                                           for i in rng.sample(range(size), 20)], repeats),
+                            'store': time_calls(lambda: read_query(store), repeats),
+                            'mapped': time_calls(lambda: read_query(mapped), repeats)},
+                'round_trip_ok': round_trip_ok,
+            }
+            del mapped
+        results.append(row)
+        heap = row['heap_bytes']
+        print(f"n={size:>7}  text={text_bytes / 2**20:7.1f} MB  objects={heap['objects'] / 2**20:7.1f} MB  "
+              f"store={heap['store'] / 2**20:7.1f} MB  mapped={heap['mapped'] / 2**20:6.2f} MB  "
+              f"save={save_s:5.2f} s  load={load_s:5.3f} s  "
+              f"read 20 p50: objects={row['read_20']['objects']['p50_ms']:.3f} ms "
+              f"store={row['read_20']['store']['p50_ms']:.3f} ms mapped={row['read_20']['mapped']['p50_ms']:.3f} ms  "
+              f"round trip ok={round_trip_ok}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 50000])
+    parser.add_argument("--repeats", type=int, default=200)
+    parser.add_argument("--json", help="write a machine-readable report to this path")
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.repeats)
+    write_report(args.json, "chunk_store", results)
+
+
+if __name__ == "__main__":
+    main()
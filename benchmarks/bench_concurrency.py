@@ -0,0 +1,122 @@
+"""
+Multithreaded stress test for one CompleteRAGPipeline shared by many threads,
+the way rag_ui shares its cached pipeline between browser sessions.
+
+Every thread count runs the same queries through pipeline.query() and checks:
+
+    correct     each answer, method and retrieved chunk list (ids and scores)
+                matches a single-threaded reference run
+    metadata    the chunk metadata in the index was not modified by queries
+    stats       total_queries counted every query exactly once
+
+Throughput is reported per thread count with the speedup over one thread.
+Each query's torch ops use --torch-threads intra-op threads, so scaling should
+be close to linear up to os.cpu_count() / --torch-threads query threads.
+The answer cache, fact lookup and memos are disabled so every query runs
+retrieval, reranking and generation. Exits with status 1 on any mismatch.
+
+    python benchmarks/bench_concurrency.py --threads 1 2 4 8 --json concurrency.json
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import torch
+
+from common import synthetic_financial_corpus, synthetic_queries, write_report
+from tiny_models import build_tiny_models
+from convai_group_111_rag_vs_ft import CompleteRAGPipeline, RAGConfig
+
+
+def fingerprint(result: dict):
+    """The parts of a query() result that must not depend on concurrency"""
+    return (
+        result.get('success'),
+        result.get('answer'),
+        result.get('method'),
+        tuple((doc['metadata'].get('id'), round(doc['score'], 5)) for doc in result.get('retrieval_details', [])),
+    )
+
+
+def run(pipeline: CompleteRAGPipeline, queries, threads: int, reference: dict):
+    before = pipeline.get_statistics()['total_queries']
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(pipeline.query, queries))
+    elapsed = time.perf_counter() - start
+
+    mismatches = sum(fingerprint(r) != reference[q] for q, r in zip(queries, results))
+    counted = pipeline.get_statistics()['total_queries'] - before
+    return {
+        'threads': threads,
+        'queries': len(queries),
+        'throughput_qps': len(queries) / elapsed,
+        'mismatches': mismatches,
+        'stats_consistent': counted == len(queries),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=64, help="distinct queries per run")
+    parser.add_argument("--threads", type=int, nargs="+",
+                        default=sorted({1, 2, 4, os.cpu_count() or 1}))
+    parser.add_argument("--torch-threads", type=int, default=1, help="intra-op threads per torch call")
+    parser.add_argument("--max-new-tokens", type=int, default=16)
+    parser.add_argument("--embedding-model", help="use real models instead of the tiny local ones")
+    parser.add_argument("--cross-encoder-model", default=RAGConfig.cross_encoder_model)
+    parser.add_argument("--generator-model", default=RAGConfig.generator_model)
+    parser.add_argument("--json", help="write a machine-readable report to this path")
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.torch_threads)
+    with tempfile.TemporaryDirectory() as models_dir:
+        if args.embedding_model:
+            models = {
+                'embedding_model': args.embedding_model,
+                'cross_encoder_model': args.cross_encoder_model,
+                'generator_model': args.generator_model,
+            }
+        else:
+            texts = synthetic_financial_corpus(2000, seed=123) + synthetic_queries(200)
+            models = build_tiny_models(Path(models_dir), texts)
+        pipeline = CompleteRAGPipeline(RAGConfig(
+            **models,
+            max_generation_length=args.max_new_tokens,
+            enable_answer_cache=False,
+            enable_fact_index=False,
+            query_memo_max_entries=0,
+            rerank_memo_max_entries=0,
+        ))
+        pipeline.load_documents([{'text': doc} for doc in synthetic_financial_corpus(args.docs)])
+        chunks = pipeline.retriever.chunks
+        metadata_before = [chunks.metadata(i) for i in range(len(chunks))]
+
+        queries = synthetic_queries(args.queries, seed=5)
+        reference = {q: fingerprint(pipeline.query(q)) for q in queries}
+
+        results = []
+        for threads in args.threads:
+            row = run(pipeline, queries, threads, reference)
+            row['speedup'] = row['throughput_qps'] / results[0]['throughput_qps'] if results else 1.0
+            results.append(row)
+            print(f"threads={threads:<3} {row['throughput_qps']:7.2f} queries/s  x{row['speedup']:.2f}  "
+                  f"mismatches={row['mismatches']}  stats consistent={row['stats_consistent']}")
+
+        metadata_intact = [chunks.metadata(i) for i in range(len(chunks))] == metadata_before
+        print(f"Index metadata unchanged by queries: {metadata_intact}")
+
+    write_report(args.json, "concurrency", {'torch_threads': args.torch_threads,
+                                            'metadata_intact': metadata_intact, 'runs': results})
+    if not metadata_intact or any(r['mismatches'] or not r['stats_consistent'] for r in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
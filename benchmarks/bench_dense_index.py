@@ -0,0 +1,108 @@
+"""
+Recall@k versus latency for the dense index types in RAGConfig.
+
+Every approximate index (IVF-Flat, HNSW, IVF-PQ) is built through
+create_dense_index and swept over its query-time knob (nprobe / efSearch).
+Recall@k is measured against the exact flat index on the same vectors, so the
+report shows how much exactness each setting trades for speed.
+
+Vectors are clustered, L2-normalized Gaussians shaped like sentence embeddings
+(dimension 384 by default); no model is needed.
+
+    python benchmarks/bench_dense_index.py --sizes 20000 200000 --json dense.json
+"""
+
+import argparse
+import time
+from dataclasses import replace
+
+import numpy as np
+
+from common import time_calls, write_report
+from convai_group_111_rag_vs_ft import RAGConfig, create_dense_index, dense_search_params
+
+SWEEPS = {
+    "flat": [None],
+    "ivf_flat": [1, 4, 16, 64],
+    "hnsw": [16, 32, 64, 128],
+    "ivf_pq": [1, 4, 16, 64],
+}
+
+
+def synthetic_embeddings(n: int, dim: int, n_clusters: int = 200, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, n_clusters, size=n)
+    vectors = centers[labels] + 0.6 * rng.standard_normal((n, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray) -> float:
+    hits = sum(len(set(f) & set(t)) for f, t in zip(found, truth))
+    return hits / truth.size
+
+
+def run(sizes, dim: int, n_queries: int, k: int, repeats: int, index_types):
+    results = []
+    for size in sizes:
+        vectors = synthetic_embeddings(size + n_queries, dim)
+        corpus, queries = vectors[:size], vectors[size:]
+        ids = np.arange(size, dtype=np.int64)
+
+        truth = None
+        for index_type in index_types:
+            config = replace(RAGConfig(), dense_index_type=index_type)
+            start = time.perf_counter()
+            index, resolved = create_dense_index(corpus, config)
+            index.add_with_ids(corpus, ids)
+            build_s = time.perf_counter() - start
+
+            for knob in SWEEPS[index_type]:
+                params = dense_search_params(resolved, config, k, nprobe=knob, ef_search=knob)
+                _, found = index.search(queries, k, params=params)
+                if index_type == "flat":
+                    truth = found
+                recall = recall_at_k(found, truth) if truth is not None else None
+
+                query_iter = iter(range(10 ** 9))
+
+                def single_query():
+                    i = next(query_iter) % n_queries
+                    index.search(queries[i:i + 1], k, params=params)
+
+                latency = time_calls(single_query, repeats)
+                row = {
+                    'corpus_size': size,
+                    'index_type': resolved,
+                    'knob': knob,
+                    'build_s': build_s,
+                    f'recall_at_{k}': recall,
+                    'latency': latency,
+                }
+                results.append(row)
+                knob_name = {"hnsw": "efSearch", "flat": ""}.get(resolved, "nprobe")
+                print(f"n={size:>8}  {resolved:<8} {knob_name:>8}={str(knob):<4} "
+                      f"recall@{k}={recall if recall is not None else float('nan'):.3f}  "
+                      f"p50={latency['p50_ms']:7.3f} ms  p99={latency['p99_ms']:7.3f} ms  build={build_s:6.1f} s")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[20000, 100000])
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=20)
+    parser.add_argument("--repeats", type=int, default=200)
+    parser.add_argument("--types", nargs="+", default=list(SWEEPS), choices=list(SWEEPS),
+                        help="index types to benchmark; flat is the recall reference and should come first")
+    parser.add_argument("--json", help="write a machine-readable report to this path")
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.dim, args.queries, args.k, args.repeats, args.types)
+    write_report(args.json, "dense_index", results)
+
+
+if __name__ == "__main__":
+    main()
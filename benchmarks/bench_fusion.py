@@ -0,0 +1,111 @@
+"""
+Stage-1 score fusion: the former dict-per-candidate implementation versus
+fuse_scores on NumPy arrays, for growing initial_retrieval_k.
+
+Dense and BM25 hit lists are taken from real searches over the synthetic
+corpus (random embeddings for the dense side, since only the list shapes
+matter here). For each k it checks that the "linear" strategy returns
+exactly the former ranking and scores, and reports per-query fusion latency
+for every strategy plus the overlap of each strategy's top-k with linear's.
+"stage1" is fuse_candidates, which stage 1 calls: it keeps the dict loop for
+"linear" below FUSION_ARRAY_MIN_CANDIDATES hits and uses the arrays above.
+
+    python benchmarks/bench_fusion.py --k 20 100 1000 --json fusion.json
+"""
+
+import argparse
+
+import numpy as np
+
+from common import synthetic_financial_corpus, synthetic_queries, time_calls, write_report
+from convai_group_111_rag_vs_ft import FUSION_STRATEGIES, InvertedIndexBM25, RAGConfig, fuse_candidates, fuse_scores
+
+
+def dict_fusion(dense_scores, dense_ids, sparse_ids, sparse_scores, k: int, alpha: float):
+    """The fusion loop stage 1 used before fuse_scores, kept as the reference"""
+    combined = {}
+    for score, idx in zip(dense_scores[:k], dense_ids[:k]):
+        combined[int(idx)] = {'index': int(idx), 'dense_score': float(score), 'sparse_score': 0.0}
+    for idx, score in zip(sparse_ids.tolist(), sparse_scores.tolist()):
+        if idx in combined:
+            combined[idx]['sparse_score'] = score
+        else:
+            combined[idx] = {'index': idx, 'dense_score': 0.0, 'sparse_score': score}
+    max_sparse = max(float(sparse_scores[0]) if len(sparse_scores) > 0 else 1.0, 1e-8)
+    for r in combined.values():
+        r['hybrid_score'] = alpha * r['dense_score'] + (1 - alpha) * (r['sparse_score'] / max_sparse)
+        r['score'] = r['hybrid_score']
+        r['stage'] = 'broad_retrieval'
+    return sorted(combined.values(), key=lambda x: x['hybrid_score'], reverse=True)[:k]
+
+
+def array_fusion(dense_scores, dense_ids, sparse_ids, sparse_scores, k: int, alpha: float, strategy: str):
+    """fuse_scores plus the top-k dicts _hybrid_fusion builds from its output"""
+    ids, dense, sparse, fused = fuse_scores(dense_ids[:k], dense_scores[:k], sparse_ids, sparse_scores,
+                                            k, alpha, strategy)
+    return [{'index': i, 'dense_score': d, 'sparse_score': s, 'hybrid_score': f, 'score': f,
+             'stage': 'broad_retrieval'}
+            for i, d, s, f in zip(ids.tolist(), dense.tolist(), sparse.tolist(), fused.tolist())]
+
+
+def stage1_fusion(dense_scores, dense_ids, sparse_ids, sparse_scores, k: int, alpha: float):
+    """What stage 1 runs for the default "linear" strategy"""
+    return fuse_candidates(dense_ids[:k], dense_scores[:k], sparse_ids, sparse_scores, k, alpha)
+
+
+def run(n_docs: int, ks, n_queries: int, repeats: int, dimension: int):
+    alpha = RAGConfig.hybrid_alpha
+    docs = synthetic_financial_corpus(n_docs)
+    bm25 = InvertedIndexBM25([d.lower().split() for d in docs])
+    queries = synthetic_queries(n_queries)
+    rng = np.random.default_rng(0)
+    doc_vectors = rng.standard_normal((n_docs, dimension)).astype(np.float32)
+    doc_vectors /= np.linalg.norm(doc_vectors, axis=1, keepdims=True)
+
+    results = []
+    for k in ks:
+        hits = []
+        for query in queries:
+            query_vector = rng.standard_normal(dimension).astype(np.float32)
+            scores = doc_vectors @ (query_vector / np.linalg.norm(query_vector))
+            dense_ids = np.argsort(-scores)[:k]
+            hits.append((scores[dense_ids], dense_ids, *bm25.top_k(query.lower().split(), k)))
+
+        mismatches = sum(dict_fusion(*h, k, alpha) != array_fusion(*h, k, alpha, "linear")
+                         or dict_fusion(*h, k, alpha) != stage1_fusion(*h, k, alpha) for h in hits)
+        linear_top = [{r['index'] for r in array_fusion(*h, k, alpha, "linear")} for h in hits]
+
+        query_iter = iter(range(10 ** 9))
+        row = {'k': k, 'linear_mismatches': mismatches,
+               'dict': time_calls(lambda: dict_fusion(*hits[next(query_iter) % len(hits)], k, alpha), repeats),
+               'stage1': time_calls(lambda: stage1_fusion(*hits[next(query_iter) % len(hits)], k, alpha), repeats)}
+        for strategy in FUSION_STRATEGIES:
+            row[strategy] = time_calls(
+                lambda: array_fusion(*hits[next(query_iter) % len(hits)], k, alpha, strategy), repeats)
+            row[strategy]['overlap_with_linear'] = float(np.mean([
+                len({r['index'] for r in array_fusion(*h, k, alpha, strategy)} & top) / max(len(top), 1)
+                for h, top in zip(hits, linear_top)]))
+        results.append(row)
+        print(f"k={k:<5} dict p50={row['dict']['p50_ms']:7.3f} ms  stage1 p50={row['stage1']['p50_ms']:7.3f} ms  "
+              + "  ".join(
+            f"{s} p50={row[s]['p50_ms']:6.3f} ms (overlap {row[s]['overlap_with_linear']:.2f})"
+            for s in FUSION_STRATEGIES) + f"  linear mismatches={mismatches}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=20000)
+    parser.add_argument("--k", type=int, nargs="+", default=[20, 100, 1000])
+    parser.add_argument("--queries", type=int, default=30)
+    parser.add_argument("--repeats", type=int, default=200)
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("--json", help="write a machine-readable report to this path")
+    args = parser.parse_args()
+
+    results = run(args.docs, args.k, args.queries, args.repeats, args.dimension)
+    write_report(args.json, "fusion", results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+PyTorch (SentenceTransformer / CrossEncoder) versus the ONNX Runtime backend
+for query encoding, document encoding and cross-encoder reranking.
+
+Each backend is loaded through MultiStageRetriever with the matching
+RAGConfig.inference_backend, optionally INT8-quantized (--int8). The ONNX
+export runs once into a temporary cache; the report includes both the
+export time and the cached load time. Outputs are checked against PyTorch
+fp32: max absolute embedding and score difference and rerank top-k agreement.
+The ONNX fp32 backend should stay within --atol.
+
+Locally built random models (MiniLM sized by default) are used unless real
+model names are passed:
+
+    python benchmarks/bench_onnx.py --json onnx.json
+    python benchmarks/bench_onnx.py --embedding-model sentence-transformers/all-MiniLM-L6-v2 \\
+        --cross-encoder-model cross-encoder/ms-marco-MiniLM-L-6-v2
+"""
+
+import argparse
+import sys
+import tempfile
+import time
+from dataclasses import replace
+from pathlib import Path
+
+import numpy as np
+
+from common import synthetic_financial_corpus, synthetic_queries, time_calls, write_report
+from tiny_models import build_tiny_models
+from convai_group_111_rag_vs_ft import MultiStageRetriever, RAGConfig
+
+
+def load_variants(config: RAGConfig, int8: bool):
+    """(label, retriever, load seconds) per backend; ONNX is loaded twice to time export and cached load"""
+    variants = []
+    for backend in ("torch", "onnx"):
+        for quantize in ((False, True) if int8 else (False,)):
+            variant = replace(config, inference_backend=backend, quantize_embedding_model=quantize,
+                              quantize_cross_encoder=quantize)
+            start = time.perf_counter()
+            retriever = MultiStageRetriever(variant)
+            load_s = time.perf_counter() - start
+            if backend == "onnx":
+                start = time.perf_counter()
+                retriever = MultiStageRetriever(variant)
+                load_s = {'export_s': load_s, 'cached_load_s': time.perf_counter() - start}
+            variants.append((f"{backend}{'-int8' if quantize else ''}", retriever, load_s))
+    return variants
+
+
+def run(variants, docs, queries, k: int, repeats: int, batch_size: int, atol: float):
+    candidates = [[docs[(i * k + j) % len(docs)] for j in range(k)] for i in range(len(queries))]
+    pairs = [(q, d) for q, cands in zip(queries, candidates) for d in cands]
+
+    reference = None
+    results = []
+    for label, retriever, load_s in variants:
+        embedder, cross_encoder = retriever.embedding_model, retriever.cross_encoder
+        doc_emb = np.asarray(embedder.encode(docs, batch_size=batch_size, convert_to_numpy=True,
+                                             normalize_embeddings=True))
+        scores = np.asarray(cross_encoder.predict(pairs), dtype=np.float32).reshape(len(queries), k)
+        top = np.argsort(-scores, axis=1, kind="stable")[:, :5]
+        if reference is None:
+            reference = (doc_emb, scores, top)
+
+        query_iter = iter(range(10 ** 9))
+
+        def next_query():
+            return next(query_iter) % len(queries)
+
+        row = {
+            'backend': label,
+            'load': load_s,
+            'query_encode': time_calls(lambda: embedder.encode([queries[next_query()]], normalize_embeddings=True),
+                                       repeats),
+            'doc_encode': time_calls(lambda: embedder.encode(docs, batch_size=batch_size, normalize_embeddings=True),
+                                     max(1, repeats // 20), items_per_call=len(docs)),
+            'rerank': time_calls(lambda: cross_encoder.predict(
+                [(queries[i], d) for i in [next_query()] for d in candidates[i]]), repeats),
+            'max_abs_embedding_diff': float(np.abs(doc_emb - reference[0]).max()),
+            'max_abs_score_diff': float(np.abs(scores - reference[1]).max()),
+            'top5_agreement': float(np.mean([len(set(a) & set(b)) / len(a) for a, b in zip(top, reference[2])])),
+        }
+        row['within_tolerance'] = max(row['max_abs_embedding_diff'], row['max_abs_score_diff']) <= atol
+        results.append(row)
+        print(f"{label:<11} query p50={row['query_encode']['p50_ms']:7.2f} ms  "
+              f"docs {row['doc_encode']['throughput_per_s']:8.1f}/s  "
+              f"rerank({k}) p50={row['rerank']['p50_ms']:7.2f} ms  "
+              f"emb diff={row['max_abs_embedding_diff']:.2e}  score diff={row['max_abs_score_diff']:.2e}  "
+              f"top5 agreement={row['top5_agreement']:.2f}  "
+              + (f"export={load_s['export_s']:.1f} s  cached load={load_s['cached_load_s']:.1f} s"
+                 if isinstance(load_s, dict) else f"load={load_s:.1f} s"))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=256, help="documents encoded per document-encoding call")
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--k", type=int, default=20, help="candidates reranked per query")
+    parser.add_argument("--repeats", type=int, default=100)
+    parser.add_argument("--batch-size", type=int, default=RAGConfig.batch_size)
+    parser.add_argument("--atol", type=float, default=1e-4, help="max fp32 ONNX vs PyTorch output difference")
+    parser.add_argument("--int8", action="store_true", help="also compare INT8-quantized variants")
+    parser.add_argument("--hidden-size", type=int, default=384, help="width of the local random models")
+    parser.add_argument("--layers", type=int, default=6, help="depth of the local random models")
+    parser.add_argument("--embedding-model", help="use real models instead of the local random ones")
+    parser.add_argument("--cross-encoder-model", default=RAGConfig.cross_encoder_model)
+    parser.add_argument("--json", help="write a machine-readable report to this path")
+    args = parser.parse_args()
+
+    docs = synthetic_financial_corpus(args.docs, seed=7)
+    queries = synthetic_queries(args.queries)
+    with tempfile.TemporaryDirectory() as work_dir:
+        if args.embedding_model:
+            models = {'embedding_model': args.embedding_model, 'cross_encoder_model': args.cross_encoder_model}
+        else:
+            models = build_tiny_models(Path(work_dir), synthetic_financial_corpus(2000, seed=123) + queries,
+                                       hidden_size=args.hidden_size, layers=args.layers)
+            models.pop('generator_model')
+        config = RAGConfig(**models, onnx_cache_dir=str(Path(work_dir) / "onnx"))
+        results = run(load_variants(config, args.int8), docs, queries, args.k, args.repeats,
+                      args.batch_size, args.atol)
+
+    write_report(args.json, "onnx", results)
+    if not all(r['within_tolerance'] for r in results if r['backend'] == "onnx"):
+        print(f"ONNX fp32 outputs differ from PyTorch by more than {args.atol}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
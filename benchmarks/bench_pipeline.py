@@ -0,0 +1,157 @@
+"""
+Per-stage latency of the RAG pipeline at several corpus sizes, fully offline.
+
+Uses the synthetic financial corpus from common.py and tiny locally built
+models (tiny_models.py) unless real model names are passed. Every stage is
+timed on its own with the inputs the previous stage would hand it:
+
+    chunk_text, token_chunk_spans, clean_documents, build_embeddings, build_bm25,
+    stage1_broad_retrieval, stage2_precise_reranking, revenue_boost,
+    extract_numeric_answer, prepare_context, generate_response
+
+Query-embedding and rerank memos are disabled so repeated queries are not
+served from memory. Reports p50/p95/p99 and throughput per stage and size:
+
+    python benchmarks/bench_pipeline.py --sizes 500 5000 --json after.json
+    python benchmarks/bench_pipeline.py --sizes 500 5000 --compare before.json
+"""
+
+import argparse
+import json
+import sys
+import tempfile
+from pathlib import Path
+
+from common import synthetic_financial_corpus, synthetic_queries, time_calls, write_report
+from tiny_models import build_tiny_models
+from convai_group_111_rag_vs_ft import (InvertedIndexBM25, MultiStageRetriever, RAGConfig, ResponseGenerator,
+                                        _chunk_text, clean_documents, extract_numeric_answer,
+                                        token_chunk_spans)
+
+
+def make_config(args, models_dir: Path) -> RAGConfig:
+    if args.embedding_model:
+        models = {
+            'embedding_model': args.embedding_model,
+            'cross_encoder_model': args.cross_encoder_model,
+            'generator_model': args.generator_model,
+        }
+    else:
+        texts = synthetic_financial_corpus(2000, seed=123) + synthetic_queries(200)
+        models = build_tiny_models(models_dir, texts)
+    return RAGConfig(
+        **models,
+        max_generation_length=args.max_new_tokens,
+        query_memo_max_entries=0,
+        rerank_memo_max_entries=0,
+    )
+
+
+def bench_size(size: int, retriever: MultiStageRetriever, generator: ResponseGenerator,
+               queries, repeats: int, build_repeats: int):
+    docs = synthetic_financial_corpus(size)
+    rows = []
+
+    def record(stage, latency):
+        rows.append({'corpus_size': size, 'stage': stage, **latency})
+        print(f"n={size:>7}  {stage:<24} p50={latency['p50_ms']:9.3f} ms  p95={latency['p95_ms']:9.3f} ms  "
+              f"p99={latency['p99_ms']:9.3f} ms  {latency['throughput_per_s']:10.1f}/s")
+
+    record('chunk_text', time_calls(lambda: [_chunk_text(d, 50, 10) for d in docs], repeats,
+                                    items_per_call=len(docs)))
+    record('token_chunk_spans', time_calls(lambda: [token_chunk_spans(d, generator.tokenizer, 50, 10) for d in docs],
+                                           repeats, items_per_call=len(docs)))
+    record('clean_documents', time_calls(lambda: clean_documents(docs), repeats, items_per_call=len(docs)))
+
+    record('build_embeddings', time_calls(lambda: retriever._encode_documents(docs), build_repeats,
+                                          warmup=0, items_per_call=len(docs)))
+    tokenized = [d.lower().split() for d in docs]
+
+    def build_bm25():
+        # top_k merges the buffered postings, which is part of the build
+        InvertedIndexBM25(tokenized).top_k(tokenized[0][:3], 1)
+
+    record('build_bm25', time_calls(build_bm25, build_repeats, warmup=0, items_per_call=len(docs)))
+
+    retriever.build_indices(docs)
+
+    query_iter = iter(range(10 ** 9))
+
+    def per_query(fn):
+        """A zero-argument call that runs fn on the next query in round-robin order"""
+        return lambda: fn(queries[next(query_iter) % len(queries)])
+
+    record('stage1_broad_retrieval', time_calls(per_query(retriever.stage1_broad_retrieval), repeats))
+
+    # Later stages get the previous stage's output for the same query; candidate
+    # dicts are copied because reranking annotates them in place
+    candidates = {q: retriever.stage1_broad_retrieval(q) for q in queries}
+    record('stage2_precise_reranking', time_calls(per_query(
+        lambda q: retriever.stage2_precise_reranking(q, [dict(c) for c in candidates[q]])), repeats))
+
+    # The text and metadata of the final candidates, as multi_stage_retrieve hands them on
+    chunks = retriever.chunks
+    reranked = {q: [{**c, 'text': chunks.text(c['index']), 'metadata': chunks.metadata(c['index']),
+                     'token_marks': chunks.token_marks(c['index'])}
+                    for c in retriever.stage2_precise_reranking(q, [dict(c) for c in candidates[q]])]
+                for q in queries}
+    record('revenue_boost', time_calls(per_query(lambda q: retriever._revenue_boost(q, list(reranked[q]))), repeats))
+    record('extract_numeric_answer', time_calls(per_query(lambda q: extract_numeric_answer(q, reranked[q])), repeats))
+    record('prepare_context', time_calls(per_query(lambda q: generator.prepare_context(q, reranked[q])), repeats))
+    record('generate_response', time_calls(per_query(lambda q: generator.generate_response(q, reranked[q])),
+                                           max(1, repeats // 5)))
+    return rows
+
+
+def compare(results, baseline_path: str, threshold: float) -> int:
+    """Print p50 ratios against a previous report; returns the number of regressions"""
+    baseline = json.loads(Path(baseline_path).read_text(encoding="utf-8"))
+    before = {(r['corpus_size'], r['stage']): r for r in baseline['results']}
+    print(f"\nCompared with {baseline_path} (commit {baseline.get('commit')}):")
+    regressions = 0
+    for row in results:
+        old = before.get((row['corpus_size'], row['stage']))
+        if old is None or old['p50_ms'] <= 0:
+            continue
+        ratio = row['p50_ms'] / old['p50_ms']
+        flag = "  REGRESSION" if ratio > threshold else ""
+        regressions += bool(flag)
+        print(f"n={row['corpus_size']:>7}  {row['stage']:<24} p50 {old['p50_ms']:9.3f} -> {row['p50_ms']:9.3f} ms"
+              f"  x{ratio:5.2f}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[200, 1000, 5000])
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--repeats", type=int, default=50)
+    parser.add_argument("--build-repeats", type=int, default=3)
+    parser.add_argument("--max-new-tokens", type=int, default=32)
+    parser.add_argument("--embedding-model", help="use real models instead of the tiny local ones")
+    parser.add_argument("--cross-encoder-model", default=RAGConfig.cross_encoder_model)
+    parser.add_argument("--generator-model", default=RAGConfig.generator_model)
+    parser.add_argument("--json", help="write a machine-readable report to this path")
+    parser.add_argument("--compare", help="previous --json report to compare p50 latencies against")
+    parser.add_argument("--threshold", type=float, default=1.2,
+                        help="p50 ratio above which a stage counts as a regression")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as models_dir:
+        config = make_config(args, Path(models_dir))
+        retriever = MultiStageRetriever(config)
+        generator = ResponseGenerator(config)
+        queries = synthetic_queries(args.queries)
+
+        results = []
+        for size in args.sizes:
+            results.extend(bench_size(size, retriever, generator, queries,
+                                      args.repeats, args.build_repeats))
+
+    write_report(args.json, "pipeline", results)
+    if args.compare and compare(results, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
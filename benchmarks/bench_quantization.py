@@ -0,0 +1,230 @@
+"""
+FP32 versus INT8 dynamic quantization for every CPU model, fully offline.
+
+For each component (embedding model, cross-encoder, generator and the
+extractive QA model behind Finetune.py) the fp32 and int8 variants are loaded
+the way the app loads them and compared on:
+
+    memory      serialized weight size (packed int8 weights included)
+    latency     per-call p50/p95/p99 on the fixed QA set below
+    drift       accuracy of each variant on the fixed QA set, the fraction of
+                questions where int8 gives the same answer as fp32, plus a
+                component-specific measure (embedding cosine, score rank
+                correlation)
+
+A component is marked "use int8" when it is faster and its agreement with
+fp32 is at least --min-agreement; set the matching RAGConfig.quantize_* flag
+(or the Finetune checkbox) for those.
+
+Locally built random models (MiniLM / DistilBERT sized by default, see
+--hidden-size and --layers) are used unless real model names are passed; their
+accuracy is meaningless but memory, speed-up and agreement are comparable.
+
+    python benchmarks/bench_quantization.py --json quant.json
+    python benchmarks/bench_quantization.py --embedding-model sentence-transformers/all-MiniLM-L6-v2 \\
+        --qa-model deependra-2007/distilbert-qa-finetuned
+"""
+
+import argparse
+import tempfile
+from dataclasses import replace
+from pathlib import Path
+
+import numpy as np
+import torch
+from transformers import AutoModelForQuestionAnswering, AutoTokenizer
+
+from common import synthetic_financial_corpus, time_calls, write_report
+from tiny_models import build_tiny_models, build_tiny_qa_model
+from convai_group_111_rag_vs_ft import (MultiStageRetriever, RAGConfig, ResponseGenerator, model_size_bytes,
+                                        quantize_dynamic_int8)
+
+# Fixed QA set: each question is answered by exactly one context
+QA_SET = [
+    ("Contoso reported total revenue of $4.2 billion in fiscal 2023, up 8% from 2022.",
+     "What was Contoso's revenue in 2023?", "$4.2 billion"),
+    ("Fabrikam's net income for the year ended 2022 was $310 million.",
+     "What was Fabrikam's net income in 2022?", "$310 million"),
+    ("Northwind spent $95 million on research and development during 2024.",
+     "How much did Northwind spend on research and development in 2024?", "$95 million"),
+    ("Tailspin's operating expenses rose to $1.1 billion in 2021 as headcount grew.",
+     "What were Tailspin's operating expenses in 2021?", "$1.1 billion"),
+    ("Litware's earnings per share were $3.45 in fiscal 2023.",
+     "What were Litware's earnings per share in 2023?", "$3.45"),
+    ("Adatum held total assets of $12.8 billion at the end of 2022.",
+     "What were Adatum's total assets in 2022?", "$12.8 billion"),
+    ("Woodgrove generated operating cash flow of $640 million in 2024.",
+     "What was Woodgrove's operating cash flow in 2024?", "$640 million"),
+    ("Proseware's gross margin improved to 41% in 2023 from 38% a year earlier.",
+     "What was Proseware's gross margin in 2023?", "41%"),
+    ("Contoso's board approved a dividend of $0.62 per share in 2024.",
+     "What dividend did Contoso approve in 2024?", "$0.62 per share"),
+    ("Fabrikam closed 2023 with 5,400 employees across 12 countries.",
+     "How many employees did Fabrikam have in 2023?", "5,400"),
+]
+CONTEXTS = [context for context, _, _ in QA_SET]
+QUESTIONS = [question for _, question, _ in QA_SET]
+ANSWERS = [answer for _, _, answer in QA_SET]
+
+
+def _rank_correlation(a: np.ndarray, b: np.ndarray) -> float:
+    """Spearman correlation (no tie correction)"""
+    ranks_a, ranks_b = np.argsort(np.argsort(a)), np.argsort(np.argsort(b))
+    return float(np.corrcoef(ranks_a, ranks_b)[0, 1])
+
+
+def _answer_matches(prediction: str, answer: str) -> bool:
+    return answer.lower() in prediction.lower()
+
+
+def eval_embedding(retriever: MultiStageRetriever):
+    model = retriever.embedding_model
+    doc_emb = model.encode(CONTEXTS, convert_to_numpy=True, normalize_embeddings=True)
+    query_emb = model.encode(QUESTIONS, convert_to_numpy=True, normalize_embeddings=True)
+    picks = np.argmax(query_emb @ doc_emb.T, axis=1)
+    query_iter = iter(range(10 ** 9))
+    latency = time_calls(lambda: model.encode([QUESTIONS[next(query_iter) % len(QUESTIONS)]]), 50)
+    return model, picks, np.vstack([doc_emb, query_emb]), latency
+
+
+def eval_cross_encoder(retriever: MultiStageRetriever):
+    model = retriever.cross_encoder
+    scores = np.asarray(model.predict([(q, c) for q in QUESTIONS for c in CONTEXTS]), dtype=np.float32)
+    picks = np.argmax(scores.reshape(len(QUESTIONS), len(CONTEXTS)), axis=1)
+    query_iter = iter(range(10 ** 9))
+    # One call reranks every context for one question, like stage 2 does
+    latency = time_calls(lambda: model.predict(
+        [(QUESTIONS[next(query_iter) % len(QUESTIONS)], c) for c in CONTEXTS]), 20)
+    return (model if isinstance(model, torch.nn.Module) else model.model), picks, scores, latency
+
+
+def eval_generator(generator: ResponseGenerator):
+    docs = [[{'text': c, 'metadata': {}}] for c in CONTEXTS]
+    answers = [r['answer'] for r in generator.generate_responses(QUESTIONS, docs)]
+    query_iter = iter(range(10 ** 9))
+
+    def one_call():
+        i = next(query_iter) % len(QUESTIONS)
+        generator.generate_response(QUESTIONS[i], docs[i])
+
+    return generator.model, answers, None, time_calls(one_call, 5)
+
+
+def _answer_span(model, tokenizer, question: str, context: str, max_answer_tokens: int = 30) -> str:
+    """Best-scoring context span, as the question-answering pipeline picks it"""
+    inputs = tokenizer(question, context, return_tensors="pt", truncation="only_second", max_length=384,
+                       return_offsets_mapping=True)
+    offsets = inputs.pop("offset_mapping")[0]
+    in_context = torch.tensor([s == 1 for s in inputs.sequence_ids(0)])
+    with torch.no_grad():
+        outputs = model(**inputs)
+    start = outputs.start_logits[0].masked_fill(~in_context, -1e9)
+    end = outputs.end_logits[0].masked_fill(~in_context, -1e9)
+    positions = torch.arange(len(start))
+    length = positions[None, :] - positions[:, None]
+    scores = (start[:, None] + end[None, :]).masked_fill((length < 0) | (length >= max_answer_tokens), -1e9)
+    best = int(torch.argmax(scores))
+    i, j = divmod(best, scores.shape[1])
+    return context[int(offsets[i][0]):int(offsets[j][1])]
+
+
+def eval_qa(model_id: str, quantize: bool):
+    """Loads the QA model the way Finetune.load_qa_pipeline does"""
+    model = AutoModelForQuestionAnswering.from_pretrained(model_id, torch_dtype=torch.float32).eval()
+    if quantize:
+        model = quantize_dynamic_int8(model)
+    tokenizer = AutoTokenizer.from_pretrained(model_id)
+    answers = [_answer_span(model, tokenizer, q, c) for q, c in zip(QUESTIONS, CONTEXTS)]
+    query_iter = iter(range(10 ** 9))
+
+    def one_call():
+        i = next(query_iter) % len(QUESTIONS)
+        _answer_span(model, tokenizer, QUESTIONS[i], CONTEXTS[i])
+
+    return model, answers, None, time_calls(one_call, 20)
+
+
+def accuracy(component: str, outputs) -> float:
+    if component in ("embedding", "cross_encoder"):
+        # Retrieval components: did the right context come first
+        return float(np.mean(outputs == np.arange(len(QA_SET))))
+    return float(np.mean([_answer_matches(p, a) for p, a in zip(outputs, ANSWERS)]))
+
+
+def compare_variants(component: str, fp32, int8, min_agreement: float):
+    (model32, out32, raw32, lat32), (model8, out8, raw8, lat8) = fp32, int8
+    agreement = float(np.mean([a == b for a, b in zip(out32, out8)]))
+    row = {
+        'component': component,
+        'memory_mb': {'fp32': model_size_bytes(model32) / 2 ** 20, 'int8': model_size_bytes(model8) / 2 ** 20},
+        'latency': {'fp32': lat32, 'int8': lat8},
+        'speedup_p50': lat32['p50_ms'] / lat8['p50_ms'] if lat8['p50_ms'] > 0 else float('inf'),
+        'accuracy': {'fp32': accuracy(component, out32), 'int8': accuracy(component, out8)},
+        'agreement': agreement,
+    }
+    if component == "embedding":
+        row['mean_cosine_fp32_int8'] = float(np.mean(np.sum(raw32 * raw8, axis=1)))
+    elif component == "cross_encoder":
+        row['score_rank_correlation'] = _rank_correlation(raw32, raw8)
+    row['use_int8'] = row['speedup_p50'] > 1.0 and agreement >= min_agreement
+
+    drift = {k: v for k, v in row.items() if k in ('mean_cosine_fp32_int8', 'score_rank_correlation')}
+    print(f"{component:<14} memory {row['memory_mb']['fp32']:8.1f} -> {row['memory_mb']['int8']:8.1f} MB  "
+          f"p50 {lat32['p50_ms']:8.2f} -> {lat8['p50_ms']:8.2f} ms (x{row['speedup_p50']:4.2f})  "
+          f"accuracy {row['accuracy']['fp32']:.2f} -> {row['accuracy']['int8']:.2f}  "
+          f"agreement {agreement:.2f}  {' '.join(f'{k}={v:.4f}' for k, v in drift.items())}  "
+          f"{'use int8' if row['use_int8'] else 'keep fp32'}")
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--components", nargs="+", default=["embedding", "cross_encoder", "generator", "qa"],
+                        choices=["embedding", "cross_encoder", "generator", "qa"])
+    parser.add_argument("--max-new-tokens", type=int, default=32)
+    parser.add_argument("--min-agreement", type=float, default=0.9,
+                        help="fraction of fp32 answers int8 must reproduce to be recommended")
+    parser.add_argument("--embedding-model", help="use real models instead of the tiny local ones")
+    parser.add_argument("--cross-encoder-model", default=RAGConfig.cross_encoder_model)
+    parser.add_argument("--generator-model", default=RAGConfig.generator_model)
+    parser.add_argument("--qa-model", help="extractive QA model (default: a local random one)")
+    parser.add_argument("--hidden-size", type=int, default=384, help="width of the local random models")
+    parser.add_argument("--layers", type=int, default=6, help="depth of the local random models")
+    parser.add_argument("--json", help="write a machine-readable report to this path")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as models_dir:
+        texts = synthetic_financial_corpus(500, seed=123) + CONTEXTS + QUESTIONS
+        if args.embedding_model:
+            models = {
+                'embedding_model': args.embedding_model,
+                'cross_encoder_model': args.cross_encoder_model,
+                'generator_model': args.generator_model,
+            }
+        else:
+            models = build_tiny_models(Path(models_dir), texts, hidden_size=args.hidden_size, layers=args.layers)
+        qa_model = args.qa_model or build_tiny_qa_model(Path(models_dir), texts, hidden_size=args.hidden_size,
+                                                        layers=args.layers)
+        config = RAGConfig(**models, max_generation_length=args.max_new_tokens)
+
+        for component in args.components:
+            variants = []
+            for quantize in (False, True):
+                torch.manual_seed(0)
+                if component in ("embedding", "cross_encoder"):
+                    retriever = MultiStageRetriever(replace(config, quantize_embedding_model=quantize,
+                                                            quantize_cross_encoder=quantize))
+                    evaluate = eval_embedding if component == "embedding" else eval_cross_encoder
+                    variants.append(evaluate(retriever))
+                elif component == "generator":
+                    variants.append(eval_generator(ResponseGenerator(replace(config, quantize_generator=quantize))))
+                else:
+                    variants.append(eval_qa(qa_model, quantize))
+            results.append(compare_variants(component, *variants, args.min_agreement))
+
+    write_report(args.json, "quantization", results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Latency saved by the stage-2 reranking cascade and what it costs in ranking
+quality.
+
+The reference is the full cross-encoder on every stage-1 candidate. Each
+cascade setting (RAGConfig.rerank_skip_margin, with and without a first-pass
+reranker) is compared with it on:
+
+    latency     stage-2 mean/p50/p95 per query (memos disabled)
+    skipped     fraction of queries whose reranking was skipped
+    overlap@k   fraction of the reference top-k the cascade also returns
+    top1        fraction of queries with the same first result
+
+The stage-1 margin distribution is printed first to help pick thresholds.
+Locally built random models are used unless real model names are passed.
+Their dense scores are nearly constant, so with them stage 1 defaults to a
+BM25-weighted hybrid_alpha of 0.2 to give the margins some meaning:
+
+    python benchmarks/bench_rerank_cascade.py --json cascade.json
+    python benchmarks/bench_rerank_cascade.py --embedding-model sentence-transformers/all-MiniLM-L6-v2 \\
+        --first-pass-model cross-encoder/ms-marco-TinyBERT-L-2-v2
+"""
+
+import argparse
+import tempfile
+from dataclasses import replace
+from pathlib import Path
+
+import numpy as np
+
+from common import synthetic_financial_corpus, synthetic_queries, time_calls, write_report
+from tiny_models import build_tiny_models
+from convai_group_111_rag_vs_ft import MultiStageRetriever, RAGConfig
+
+
+def make_config(args, models_dir: Path) -> RAGConfig:
+    if args.embedding_model:
+        models = {'embedding_model': args.embedding_model, 'cross_encoder_model': args.cross_encoder_model}
+        first_pass = args.first_pass_model
+    else:
+        texts = synthetic_financial_corpus(2000, seed=123) + synthetic_queries(200)
+        models = build_tiny_models(models_dir / "full", texts, hidden_size=args.hidden_size, layers=args.layers)
+        models.pop('generator_model')
+        first_pass = args.first_pass_model or build_tiny_models(
+            models_dir / "first_pass", texts, hidden_size=max(32, args.hidden_size // 4), layers=1
+        )['cross_encoder_model']
+    alpha = args.hybrid_alpha if args.hybrid_alpha is not None else (
+        RAGConfig.hybrid_alpha if args.embedding_model else 0.2)
+    return RAGConfig(
+        **models,
+        hybrid_alpha=alpha,
+        first_pass_reranker_model=first_pass,
+        first_pass_keep=args.first_pass_keep,
+        query_memo_max_entries=0,
+        rerank_memo_max_entries=0,
+    )
+
+
+def run(retriever: MultiStageRetriever, queries, margins, repeats: int):
+    base_config = retriever.config
+    first_pass = retriever.first_pass_reranker
+    candidates = {q: retriever.stage1_broad_retrieval(q) for q in queries}
+
+    stage1_margins = [m for m in map(retriever._stage1_margin, candidates.values()) if m is not None]
+    print("stage-1 margin percentiles  " + "  ".join(
+        f"p{p}={np.percentile(stage1_margins, p):.3f}" for p in (10, 25, 50, 75, 90)))
+
+    def stage2(query):
+        # Candidate dicts are copied because reranking annotates them in place
+        return [c['index'] for c in retriever.stage2_precise_reranking(query, [dict(c) for c in candidates[query]])]
+
+    def configure(margin, use_first_pass):
+        retriever.config = replace(base_config, rerank_skip_margin=margin)
+        retriever.first_pass_reranker = first_pass if use_first_pass else None
+        retriever.cascade_stats = dict.fromkeys(retriever.cascade_stats, 0)
+
+    configure(None, False)
+    reference = {q: stage2(q) for q in queries}
+
+    results = []
+    for use_first_pass in (False, True):
+        for margin in margins:
+            configure(margin, use_first_pass)
+            ranked = {q: stage2(q) for q in queries}
+            skipped = retriever.cascade_stats['skipped'] / len(queries)
+            query_iter = iter(range(10 ** 9))
+            latency = time_calls(lambda: stage2(queries[next(query_iter) % len(queries)]), repeats)
+            row = {
+                'skip_margin': margin,
+                'first_pass': use_first_pass,
+                'latency': latency,
+                'skipped': skipped,
+                'overlap_at_k': float(np.mean([len(set(ranked[q]) & set(reference[q])) / max(len(reference[q]), 1)
+                                               for q in queries])),
+                'top1': float(np.mean([ranked[q][:1] == reference[q][:1] for q in queries])),
+            }
+            results.append(row)
+            print(f"margin={str(margin):<5} first_pass={str(use_first_pass):<5}  "
+                  f"mean={latency['mean_ms']:8.2f} ms  p50={latency['p50_ms']:8.2f} ms  p95={latency['p95_ms']:8.2f} ms  "
+                  f"skipped={skipped:4.2f}  "
+                  f"overlap@k={row['overlap_at_k']:.2f}  top1={row['top1']:.2f}")
+    retriever.config = base_config
+    retriever.first_pass_reranker = first_pass
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=30)
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--margins", type=float, nargs="+", default=[0.02, 0.05, 0.1, 0.2],
+                        help="rerank_skip_margin values to try (the no-skip setting is always included)")
+    parser.add_argument("--hybrid-alpha", type=float, help="stage-1 dense weight (default: see above)")
+    parser.add_argument("--first-pass-keep", type=int, default=RAGConfig.first_pass_keep)
+    parser.add_argument("--hidden-size", type=int, default=384, help="width of the local random models")
+    parser.add_argument("--layers", type=int, default=6, help="depth of the local random models")
+    parser.add_argument("--embedding-model", help="use real models instead of the local random ones")
+    parser.add_argument("--cross-encoder-model", default=RAGConfig.cross_encoder_model)
+    parser.add_argument("--first-pass-model", help="cheap reranker (default: a one-layer local random model)")
+    parser.add_argument("--json", help="write a machine-readable report to this path")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as models_dir:
+        retriever = MultiStageRetriever(make_config(args, Path(models_dir)))
+        retriever.build_indices(synthetic_financial_corpus(args.docs))
+        results = run(retriever, synthetic_queries(args.queries), [None] + args.margins, args.repeats)
+
+    write_report(args.json, "rerank_cascade", results)
+
+
+if __name__ == "__main__":
+    main()
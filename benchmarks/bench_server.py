@@ -0,0 +1,151 @@
+"""
+Load test for rag_server.py: throughput and latency of concurrent clients
+with micro-batching versus one request at a time.
+
+An in-process server (ephemeral port) serves a pipeline built over the
+synthetic corpus with tiny local models, unless real model names are passed.
+Each scenario runs --requests requests from N keep-alive clients:
+
+    sequential   1 client, the way a single Streamlit session queries today
+    unbatched    N clients, --max-batch-size 1 (requests serialize)
+    batched      N clients, micro-batching up to --max-batch-size
+
+The answer cache, fact lookup and memos are disabled so every request runs
+retrieval, reranking and generation.
+
+    python benchmarks/bench_server.py --clients 16 --requests 128 --json server.json
+"""
+
+import argparse
+import asyncio
+import json
+import tempfile
+import time
+from pathlib import Path
+
+from common import latency_summary, synthetic_financial_corpus, synthetic_queries, write_report
+from tiny_models import build_tiny_models
+from convai_group_111_rag_vs_ft import CompleteRAGPipeline, RAGConfig
+from rag_server import RAGServer
+
+
+async def _post(reader, writer, host: str, path: str, payload: dict):
+    body = json.dumps(payload).encode("utf-8")
+    writer.write(f"POST {path} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+                 f"Content-Length: {len(body)}\r\n\r\n".encode("latin-1") + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.strip().lower() == "content-length":
+            length = int(value)
+    return status, json.loads(await reader.readexactly(length))
+
+
+async def load(host: str, port: int, queries, n_requests: int, clients: int):
+    """Run n_requests spread over `clients` keep-alive connections; returns latencies and status counts"""
+    latencies, statuses = [], {}
+    counter = iter(range(n_requests))
+
+    async def client():
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            for i in counter:
+                start = time.perf_counter()
+                status, _ = await _post(reader, writer, host, "/query", {'query': queries[i % len(queries)]})
+                latencies.append(time.perf_counter() - start)
+                statuses[status] = statuses.get(status, 0) + 1
+        finally:
+            writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(clients)))
+    return latencies, statuses, time.perf_counter() - start
+
+
+async def scenario(pipeline, name: str, queries, args, clients: int, max_batch_size: int):
+    server = RAGServer(pipeline, max_batch_size=max_batch_size, max_wait_ms=args.max_wait_ms,
+                       max_queue_depth=args.max_queue_depth)
+    port = await server.start("127.0.0.1", 0)
+    try:
+        await load("127.0.0.1", port, queries, min(4, args.requests), 1)  # warm-up
+        server.batcher.stats = dict.fromkeys(server.batcher.stats, 0)
+        latencies, statuses, elapsed = await load("127.0.0.1", port, queries, args.requests, clients)
+        batching = server.batcher.statistics()
+    finally:
+        await server.close()
+
+    row = {
+        'scenario': name,
+        'clients': clients,
+        'max_batch_size': max_batch_size,
+        'requests': args.requests,
+        'statuses': statuses,
+        'throughput_rps': statuses.get(200, 0) / elapsed,  # answered requests only
+        'latency': latency_summary(latencies),
+        'mean_batch_size': batching['mean_batch_size'],
+        'rejected': batching['rejected'],
+    }
+    print(f"{name:<11} clients={clients:<3} batch<={max_batch_size:<3} {row['throughput_rps']:7.2f} answers/s  "
+          f"p50={row['latency']['p50_ms']:8.1f} ms  p95={row['latency']['p95_ms']:8.1f} ms  "
+          f"mean batch={row['mean_batch_size']:5.2f}  statuses={statuses}")
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=2000)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=128)
+    parser.add_argument("--max-batch-size", type=int, default=16)
+    parser.add_argument("--max-wait-ms", type=float, default=10.0)
+    parser.add_argument("--max-queue-depth", type=int, default=256)
+    parser.add_argument("--max-new-tokens", type=int, default=16)
+    parser.add_argument("--embedding-model", help="use real models instead of the tiny local ones")
+    parser.add_argument("--cross-encoder-model", default=RAGConfig.cross_encoder_model)
+    parser.add_argument("--generator-model", default=RAGConfig.generator_model)
+    parser.add_argument("--json", help="write a machine-readable report to this path")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as models_dir:
+        if args.embedding_model:
+            models = {
+                'embedding_model': args.embedding_model,
+                'cross_encoder_model': args.cross_encoder_model,
+                'generator_model': args.generator_model,
+            }
+        else:
+            texts = synthetic_financial_corpus(2000, seed=123) + synthetic_queries(200)
+            models = build_tiny_models(Path(models_dir), texts)
+        pipeline = CompleteRAGPipeline(RAGConfig(
+            **models,
+            max_generation_length=args.max_new_tokens,
+            batch_size=args.max_batch_size,
+            enable_answer_cache=False,
+            enable_fact_index=False,
+            query_memo_max_entries=0,
+            rerank_memo_max_entries=0,
+        ))
+        pipeline.load_documents([{'text': doc} for doc in synthetic_financial_corpus(args.docs)])
+        queries = synthetic_queries(200, seed=5)
+
+        async def run_all():
+            return [
+                await scenario(pipeline, "sequential", queries, args, 1, args.max_batch_size),
+                await scenario(pipeline, "unbatched", queries, args, args.clients, 1),
+                await scenario(pipeline, "batched", queries, args, args.clients, args.max_batch_size),
+            ]
+
+        results = asyncio.run(run_all())
+
+    speedup = results[2]['throughput_rps'] / results[0]['throughput_rps']
+    print(f"Micro-batching throughput vs one request at a time: x{speedup:.2f}")
+    write_report(args.json, "server", results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Pipeline startup: models loaded one after another (the former eager
+__init__), lazily on first use, and preloaded concurrently on a thread pool.
+
+Each run builds a fresh CompleteRAGPipeline and reports
+
+    ready_s          until every model is loaded (lazy: until construction returns)
+    first_answer_s   until a first query is answered, from construction
+    loaded           models loaded by then (lazy loads only what the query used)
+
+The query is a numeric question over a small indexed corpus, so it is served
+by Direct Extraction and never needs the generator. A warm-up build runs
+first so every scenario reads the model files from the page cache.
+
+    python benchmarks/bench_startup.py --repeats 3 --json startup.json
+"""
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+from common import synthetic_financial_corpus, synthetic_queries, write_report
+from tiny_models import build_tiny_models
+from convai_group_111_rag_vs_ft import CompleteRAGPipeline, RAGConfig, preload_models
+
+SCENARIOS = {
+    'sequential': lambda pipeline: preload_models(pipeline.models, max_workers=1),
+    'lazy': lambda pipeline: None,
+    'parallel': lambda pipeline: pipeline.preload_models(),
+}
+
+
+def startup(config: RAGConfig, scenario: str, docs, query: str):
+    start = time.perf_counter()
+    pipeline = CompleteRAGPipeline(config)
+    SCENARIOS[scenario](pipeline)
+    ready_s = time.perf_counter() - start
+    pipeline.load_documents([{'text': doc} for doc in docs])
+    result = pipeline.query(query)
+    return {
+        'ready_s': ready_s,
+        'first_answer_s': time.perf_counter() - start,
+        'method': result.get('method'),
+        'loaded': [name for name, s in pipeline.model_status().items() if s['state'] == "warm"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=200)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--embedding-model", help="use real models instead of the tiny local ones")
+    parser.add_argument("--cross-encoder-model", default=RAGConfig.cross_encoder_model)
+    parser.add_argument("--generator-model", default=RAGConfig.generator_model)
+    parser.add_argument("--json", help="write a machine-readable report to this path")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as models_dir:
+        if args.embedding_model:
+            models = {
+                'embedding_model': args.embedding_model,
+                'cross_encoder_model': args.cross_encoder_model,
+                'generator_model': args.generator_model,
+            }
+        else:
+            texts = synthetic_financial_corpus(2000, seed=123) + synthetic_queries(200)
+            models = build_tiny_models(Path(models_dir), texts)
+        config = RAGConfig(**models, enable_answer_cache=False)
+        docs = synthetic_financial_corpus(args.docs)
+        query = "What was the total revenue in 2023?"
+        startup(config, 'parallel', docs, query)  # warm-up
+
+        results = []
+        for scenario in SCENARIOS:
+            runs = [startup(config, scenario, docs, query) for _ in range(args.repeats)]
+            row = {
+                'scenario': scenario,
+                'ready_s': min(r['ready_s'] for r in runs),
+                'first_answer_s': min(r['first_answer_s'] for r in runs),
+                'method': runs[-1]['method'],
+                'loaded': runs[-1]['loaded'],
+            }
+            results.append(row)
+            print(f"{scenario:<11} ready={row['ready_s']:6.2f} s  first answer={row['first_answer_s']:6.2f} s  "
+                  f"method={row['method']}  loaded={', '.join(row['loaded'])}")
+
+    write_report(args.json, "startup", results)
+
+
+if __name__ == "__main__":
+    main()
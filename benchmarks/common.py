@@ -0,0 +1,124 @@
+"""
+Shared helpers for the offline benchmarks: a synthetic financial corpus,
+latency percentiles and JSON report writing.
+
+Run benchmarks from the repository root, e.g.  python benchmarks/bench_bm25.py
+"""
+
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+COMPANIES = ["Contoso", "Fabrikam", "Northwind", "Tailspin", "Litware", "Adatum", "Woodgrove", "Proseware"]
+METRICS = ["revenue", "net income", "operating income", "gross margin", "earnings per share",
+           "operating expenses", "cash flow", "total assets", "research and development"]
+UNITS = ["million", "billion"]
+YEARS = ["2021", "2022", "2023", "2024"]
+TEMPLATES = [
+    "{company} reported total {metric} of ${value} {unit} in fiscal {year}.",
+    "In {year}, {metric} was ${value} {unit}, compared with the prior year.",
+    "{metric} | {year}: {value} | {prev_year}: {prev_value}",
+    "Consolidated {metric} for the year ended {year} increased to ${value} {unit}.",
+]
+
+
+def _filler_vocabulary(size: int, rng: random.Random) -> List[str]:
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    return ["".join(rng.choice(letters) for _ in range(rng.randint(3, 10))) for _ in range(size)]
+
+
+def synthetic_financial_corpus(n_docs: int, words_per_doc: int = 120, vocab_size: int = 5000,
+                               seed: int = 0) -> List[str]:
+    """
+    Deterministic annual-report-like chunks: financial fact sentences mixed with
+    Zipf-distributed filler words, so BM25 statistics look like real text.
+    """
+    rng = random.Random(seed)
+    vocab = _filler_vocabulary(vocab_size, rng)
+    weights = [1.0 / (rank + 1) for rank in range(vocab_size)]
+
+    docs = []
+    for _ in range(n_docs):
+        parts = []
+        n_words = 0
+        while n_words < words_per_doc:
+            if rng.random() < 0.3:
+                year = rng.choice(YEARS)
+                sentence = rng.choice(TEMPLATES).format(
+                    company=rng.choice(COMPANIES), metric=rng.choice(METRICS),
+                    value=f"{rng.uniform(1, 999):,.1f}", unit=rng.choice(UNITS), year=year,
+                    prev_year=int(year) - 1, prev_value=f"{rng.randint(100, 99_999):,}",
+                )
+            else:
+                sentence = " ".join(rng.choices(vocab, weights=weights, k=rng.randint(6, 18))) + "."
+            parts.append(sentence)
+            n_words += len(sentence.split())
+        docs.append(" ".join(parts))
+    return docs
+
+
+def synthetic_queries(n_queries: int, seed: int = 1) -> List[str]:
+    rng = random.Random(seed)
+    return [
+        f"What was {rng.choice(COMPANIES)} {rng.choice(METRICS)} in {rng.choice(YEARS)}?"
+        for _ in range(n_queries)
+    ]
+
+
+def latency_summary(samples: List[float], items_per_call: int = 1) -> Dict[str, float]:
+    """Percentiles in milliseconds and throughput in items per second"""
+    arr = np.asarray(samples, dtype=np.float64)
+    total = float(arr.sum())
+    return {
+        'calls': int(len(arr)),
+        'p50_ms': float(np.percentile(arr, 50) * 1000),
+        'p95_ms': float(np.percentile(arr, 95) * 1000),
+        'p99_ms': float(np.percentile(arr, 99) * 1000),
+        'mean_ms': float(arr.mean() * 1000),
+        'throughput_per_s': (len(arr) * items_per_call / total) if total > 0 else float('inf'),
+    }
+
+
+def time_calls(fn: Callable[[], object], repeats: int, warmup: int = 1, items_per_call: int = 1) -> Dict[str, float]:
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return latency_summary(samples, items_per_call)
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, text=True).strip()
+    except Exception:
+        return None
+
+
+def write_report(path: Optional[str], name: str, results: Dict) -> Dict:
+    """Wrap results with run metadata and write them as JSON (when a path is given)"""
+    report = {
+        'benchmark': name,
+        'commit': _git_commit(),
+        'created_at': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'results': results,
+    }
+    if path:
+        Path(path).write_text(json.dumps(report, indent=2), encoding="utf-8")
+        print(f"Report written to {path}")
+    return report
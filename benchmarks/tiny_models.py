@@ -0,0 +1,104 @@
+"""
+Tiny randomly initialized models with the same interfaces as the real ones
+(SentenceTransformer bi-encoder, CrossEncoder, GPT-2 causal LM, extractive QA
+model), built locally
+so the pipeline benchmarks run with no network access.
+
+Absolute latencies are far below the production models; use them to compare
+commits, not to size hardware. Pass real model names to the benchmarks for
+representative numbers.
+"""
+
+import re
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable
+
+import torch
+from tokenizers import Tokenizer, decoders, models, normalizers, pre_tokenizers
+from transformers import (BertConfig, BertForQuestionAnswering, BertForSequenceClassification, BertModel,
+                          BertTokenizerFast, GPT2Config, GPT2LMHeadModel, PreTrainedTokenizerFast)
+
+SPECIAL_TOKENS = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"]
+EOS_TOKEN = "<|endoftext|>"
+# Words of the generation prompt, so prompt tokens are not all [UNK]
+PROMPT_WORDS = "based on the following context answer question accurately and concisely document".split()
+
+
+def _vocabulary(texts: Iterable[str], size: int):
+    counts = Counter()
+    for text in texts:
+        counts.update(re.findall(r"\w+|[^\w\s]", text.lower()))
+    words = [w for w, _ in counts.most_common(size)]
+    return list(dict.fromkeys(PROMPT_WORDS + words))
+
+
+def build_tiny_models(out_dir: Path, texts: Iterable[str], vocab_size: int = 8000,
+                      hidden_size: int = 64, layers: int = 2, seed: int = 0) -> Dict[str, str]:
+    """
+    Build and save the three models under out_dir; returns RAGConfig keyword
+    arguments (embedding_model, cross_encoder_model, generator_model).
+    """
+    from sentence_transformers import SentenceTransformer, models as st_models
+
+    torch.manual_seed(seed)
+    out_dir = Path(out_dir)
+    words = _vocabulary(texts, vocab_size)
+
+    bert_dir = out_dir / "bert"
+    bert_dir.mkdir(parents=True, exist_ok=True)
+    (bert_dir / "vocab.txt").write_text("\n".join(SPECIAL_TOKENS + words), encoding="utf-8")
+    bert_tokenizer = BertTokenizerFast(vocab_file=str(bert_dir / "vocab.txt"))
+    bert_config = BertConfig(
+        vocab_size=len(bert_tokenizer), hidden_size=hidden_size, num_hidden_layers=layers,
+        num_attention_heads=2, intermediate_size=2 * hidden_size, max_position_embeddings=512,
+    )
+    BertModel(bert_config).save_pretrained(bert_dir)
+    bert_tokenizer.save_pretrained(bert_dir)
+
+    embed_dir = out_dir / "embedding"
+    transformer = st_models.Transformer(str(bert_dir), max_seq_length=256)
+    pooling = st_models.Pooling(transformer.get_word_embedding_dimension())
+    SentenceTransformer(modules=[transformer, pooling]).save(str(embed_dir))
+
+    cross_dir = out_dir / "cross_encoder"
+    BertForSequenceClassification(BertConfig(**{**bert_config.to_dict(), "num_labels": 1})).save_pretrained(cross_dir)
+    bert_tokenizer.save_pretrained(cross_dir)
+
+    gen_dir = out_dir / "generator"
+    word_level = Tokenizer(models.WordLevel(
+        {w: i for i, w in enumerate([EOS_TOKEN, "[UNK]"] + words)}, unk_token="[UNK]"
+    ))
+    word_level.normalizer = normalizers.Lowercase()
+    word_level.pre_tokenizer = pre_tokenizers.Whitespace()
+    word_level.decoder = decoders.WordPiece(prefix="##")  # joins tokens with spaces
+    gen_tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=word_level, eos_token=EOS_TOKEN, bos_token=EOS_TOKEN, unk_token="[UNK]"
+    )
+    gen_tokenizer.save_pretrained(gen_dir)
+    GPT2LMHeadModel(GPT2Config(
+        vocab_size=len(gen_tokenizer), n_embd=hidden_size, n_layer=layers, n_head=2, n_positions=1024,
+        bos_token_id=0, eos_token_id=0,
+    )).save_pretrained(gen_dir)
+
+    return {
+        'embedding_model': str(embed_dir),
+        'cross_encoder_model': str(cross_dir),
+        'generator_model': str(gen_dir),
+    }
+
+
+def build_tiny_qa_model(out_dir: Path, texts: Iterable[str], vocab_size: int = 8000,
+                        hidden_size: int = 64, layers: int = 2, seed: int = 0) -> str:
+    """Build and save an extractive question-answering model (like the fine-tuned DistilBERT); returns its path"""
+    torch.manual_seed(seed)
+    qa_dir = Path(out_dir) / "qa"
+    qa_dir.mkdir(parents=True, exist_ok=True)
+    (qa_dir / "vocab.txt").write_text("\n".join(SPECIAL_TOKENS + _vocabulary(texts, vocab_size)), encoding="utf-8")
+    tokenizer = BertTokenizerFast(vocab_file=str(qa_dir / "vocab.txt"))
+    BertForQuestionAnswering(BertConfig(
+        vocab_size=len(tokenizer), hidden_size=hidden_size, num_hidden_layers=layers,
+        num_attention_heads=2, intermediate_size=2 * hidden_size, max_position_embeddings=512,
+    )).save_pretrained(qa_dir)
+    tokenizer.save_pretrained(qa_dir)
+    return str(qa_dir)
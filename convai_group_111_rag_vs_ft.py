@@ -195,24 +195,41 @@ RAG-Based QA System with Guardrails (Colab Notebook)
 
 
 import os
+import sys
+import math
 import re
+import io
+import copy
 import time
 import numpy as np
 import json
+import pickle
+import hashlib
+import shutil
+import sqlite3
+import threading
+import itertools
+import logging
+import multiprocessing
+from abc import ABC, abstractmethod
+from array import array
+import contextvars
+from collections import OrderedDict
+from contextlib import closing, contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
 from pathlib import Path
-from typing import List, Dict, Optional, Tuple, Union
-from dataclasses import dataclass, asdict
+from typing import Callable, List, Dict, Iterable, Iterator, Optional, Tuple, Union
+from dataclasses import dataclass, asdict, field
 import warnings
 warnings.filterwarnings("ignore")
 
 # Core ML libraries
 import torch
 from transformers import (
-    AutoTokenizer, AutoModelForCausalLM
+    AutoTokenizer, AutoModelForCausalLM, StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
 )
 from sentence_transformers import SentenceTransformer, CrossEncoder
 import faiss
-from rank_bm25 import BM25Okapi
 
 
 # Text processing
@@ -236,6 +253,13 @@ try:
 except ImportError:
     HAS_PDFPLUMBER = False
 
+# Optional ONNX Runtime inference backend (RAGConfig.inference_backend = "onnx")
+try:
+    import onnxruntime as ort
+    HAS_ONNXRUNTIME = True
+except ImportError:
+    HAS_ONNXRUNTIME = False
+
 # Download required NLTK data (idempotent)
 try:
     nltk.data.find('tokenizers/punkt')
@@ -247,6 +271,100 @@ except LookupError:
     nltk.download('stopwords', quiet=True)
 
 
+"""# Logging and Tracing
+   Level-gated logging for the query path and per-stage timing spans that can
+   be exported as JSON lines
+"""
+
+logger = logging.getLogger("convai_rag")
+
+# Trace of the query currently being processed in this thread / task
+_current_trace: contextvars.ContextVar = contextvars.ContextVar("rag_trace", default=None)
+
+
+def configure_logging(level: Union[int, str] = logging.INFO):
+    """Send this module's log records to stderr at the given level"""
+    logger.setLevel(level.upper() if isinstance(level, str) else level)
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+        logger.addHandler(handler)
+
+
+class Trace:
+    """Timing spans recorded while one query (or one batch of queries) runs"""
+
+    def __init__(self, name: str, **attributes):
+        self.trace_id = os.urandom(8).hex()
+        self.name = name
+        self.attributes = attributes
+        self.spans: List[Dict] = []
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.duration_ms: Optional[float] = None
+
+    @contextmanager
+    def activate(self):
+        """Make this the trace that span() records into, for the duration of the block"""
+        token = _current_trace.set(self)
+        try:
+            yield self
+        finally:
+            _current_trace.reset(token)
+
+    def add_span(self, name: str, start: float, end: float, **attributes):
+        self.spans.append({
+            'name': name,
+            'start_ms': (start - self._start) * 1000,
+            'duration_ms': (end - start) * 1000,
+            **attributes
+        })
+
+    def finish(self):
+        self.duration_ms = (time.perf_counter() - self._start) * 1000
+
+    def stage_timings(self) -> Dict[str, float]:
+        """Total milliseconds per stage name (stages repeat once per query in a batch)"""
+        timings: Dict[str, float] = {}
+        for s in self.spans:
+            timings[s['name']] = timings.get(s['name'], 0.0) + s['duration_ms']
+        return timings
+
+    def records(self) -> List[Dict]:
+        """Flat span records, the root span (the whole trace) first"""
+        base = {'trace_id': self.trace_id, 'timestamp': self.started_at}
+        root = {**base, 'name': self.name, 'start_ms': 0.0, 'duration_ms': self.duration_ms, **self.attributes}
+        return [root] + [{**base, 'parent': self.name, **s} for s in self.spans]
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Time a pipeline stage into the active trace; a no-op when nothing is being traced"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add_span(name, start, time.perf_counter(), **attributes)
+
+
+class JsonLinesTraceExporter:
+    """Appends one JSON object per span to a file, e.g. for jq or pandas.read_json(lines=True)"""
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def export(self, trace: Trace):
+        lines = "".join(json.dumps(record, default=str) + "\n" for record in trace.records())
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(lines)
+
+
 def _read_txt(path: Path) -> str:
     try:
         return path.read_text(encoding="utf-8", errors="ignore")
@@ -325,34 +443,135 @@ def _read_pdf(path: Path) -> Tuple[str, List[Dict]]:
 
     return "\n".join(text), tables_json
 
-def load_files_to_strings(paths: List[Path]) -> List[Dict]:
+def _parse_file(p: Path) -> List[Dict]:
+    """Parse one file into document dicts. Top-level so process pool workers can run it."""
     docs = []
-    for p in paths:
-        suffix = p.suffix.lower()
-        try:
-            if suffix == ".txt":
-                text = _read_txt(p)
-                docs.append({"text": text, "metadata": {"source": str(p)}, "score": 0.0})
-            elif suffix == ".docx":
-                full_text, tables_json = _read_docx(p)
-                docs.append({"text": full_text, "metadata": {"source": str(p)}, "score": 0.0})
-                # Include table rows as separate entries
-                for row in tables_json:
-                    row_text = ' | '.join(f'{k}: {v}' for k, v in row.items() if k not in ['table_index', 'row_index', 'type', 'source'])
-                    docs.append({"text": row_text, "metadata": {"source": str(p)}, "score": 0.0})
-            elif suffix == ".pdf":
-                text = _read_pdf(p)
-                docs.append({"text": text, "metadata": {"source": str(p)}, "score": 0.0})
-                for row in tables:  # optional: index table rows
-                   row_text = ' | '.join(f'{k}: {v}' for k, v in row.items() if v is not None)
-                   docs.append({"text": row_text, "metadata": {"source": str(p)}, "score": 0.0})
-            else:
-                pass
-        except Exception as e:
-            print(f"Failed to read {p}: {e}")
+    suffix = p.suffix.lower()
+    try:
+        if suffix == ".txt":
+            text = _read_txt(p)
+            docs.append({"text": text, "metadata": {"source": str(p)}, "score": 0.0})
+        elif suffix == ".docx":
+            full_text, tables_json = _read_docx(p)
+            docs.append({"text": full_text, "metadata": {"source": str(p)}, "score": 0.0})
+            # Include table rows as separate entries
+            for row in tables_json:
+                row_text = ' | '.join(f'{k}: {v}' for k, v in row.items() if k not in ['table_index', 'row_index', 'type', 'source'])
+                docs.append({"text": row_text, "metadata": {"source": str(p)}, "score": 0.0})
+        elif suffix == ".pdf":
+            text, tables = _read_pdf(p)
+            docs.append({"text": text, "metadata": {"source": str(p)}, "score": 0.0})
+            for row in tables:  # optional: index table rows
+               row_text = ' | '.join(f'{k}: {v}' for k, v in row.items() if v is not None)
+               docs.append({"text": row_text, "metadata": {"source": str(p)}, "score": 0.0})
+        else:
+            pass
+    except Exception as e:
+        print(f"Failed to read {p}: {e}")
     return docs
 
 
+def _parse_pool_context():
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("spawn")
+    context = multiprocessing.get_context("forkserver")
+    # Workers then start with _parse_file's module already imported
+    context.set_forkserver_preload([_parse_file.__module__])
+    return context
+
+
+def iter_files_to_strings(paths: List[Path], max_workers: Optional[int] = None,
+                          on_file: Optional[Callable[[Path], None]] = None) -> Iterator[Dict]:
+    """
+    Parse files across a process pool and yield their documents as each file
+    finishes (completion order, not input order). At most 2 * max_workers files
+    are in flight, so parsed text that the caller has not consumed stays bounded.
+    max_workers=None uses every core; 1 parses in the calling process.
+    on_file is called with each path once its documents have been yielded.
+
+    Workers are not forked from the caller: it runs torch/Streamlit threads
+    (and the background indexing thread), and a fork taken while one of them
+    holds a lock can deadlock the child. They fork from a single-threaded
+    fork server instead, which imports this module once per process, or are
+    spawned where there is no fork server.
+    """
+    paths = [Path(p) for p in paths]
+    max_workers = max_workers or os.cpu_count() or 1
+    if max_workers == 1 or len(paths) <= 1:
+        for p in paths:
+            yield from _parse_file(p)
+            if on_file is not None:
+                on_file(p)
+        return
+
+    pending_paths = iter(paths)
+    with ProcessPoolExecutor(max_workers=min(max_workers, len(paths)),
+                             mp_context=_parse_pool_context()) as pool:
+        in_flight = {}
+        for p in itertools.islice(pending_paths, 2 * max_workers):
+            in_flight[pool.submit(_parse_file, p)] = p
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                path = in_flight.pop(future)
+                next_path = next(pending_paths, None)
+                if next_path is not None:
+                    in_flight[pool.submit(_parse_file, next_path)] = next_path
+                yield from future.result()
+                if on_file is not None:
+                    on_file(path)
+
+
+def load_files_to_strings(paths: List[Path], max_workers: Optional[int] = None) -> List[Dict]:
+    return list(iter_files_to_strings(paths, max_workers))
+
+
+# Financial value patterns, compiled once at import
+YEAR_RE = re.compile(r"(20\d{2})")
+REVENUE_STRICT_RE = re.compile(
+    r"(?:total\s+|consolidated\s+)?revenue[^$\d]{0,20}([\$€₹]?\s?\d[\d,]*(?:\.\d+)?)(?:\s?(million|billion|trillion))?",
+    re.IGNORECASE
+)
+REVENUE_FLEX_RE = re.compile(
+    r"(?:total\s+)?revenue[^$\d]{0,10}[\$: ]?\s*([\d,]+(?:\.\d+)?)(?:\s*(million|billion|trillion))?",
+    re.IGNORECASE
+)
+PROFIT_STRICT_RE = re.compile(
+    r"(?:net\s+income|net\s+profit|earnings)[^$\d]{0,20}([\$€₹]?\s?\d[\d,]*(?:\.\d+)?)(?:\s?(million|billion|trillion))?",
+    re.IGNORECASE
+)
+# "Revenue | 2023: 1,234" table rows; the year is checked by the caller
+REVENUE_TABLE_RE = re.compile(r"Revenue\s*\|\s*(20\d{2}):\s*\$?\s*([\d,]+)", re.IGNORECASE)
+PROFIT_TABLE_RE = re.compile(r"(?:Net\s+Income|Earnings)\s*\|\s*(20\d{2}):\s*\$?\s*([\d,]+)", re.IGNORECASE)
+IN_MILLIONS_RE = re.compile(r"in\s+millions", re.IGNORECASE)
+IN_BILLIONS_RE = re.compile(r"in\s+billions", re.IGNORECASE)
+YEAR_VALUE_RE = re.compile(r"19\d{2}|20\d{2}")
+
+
+def _table_search(pattern: re.Pattern, text: str, target_year: Optional[str]):
+    """First table match for target_year (same result as a year-specific pattern)"""
+    if not target_year:
+        return None
+    for match in pattern.finditer(text):
+        if match.group(1) == target_year:
+            return match
+    return None
+
+
+def _table_value(raw: str) -> Optional[str]:
+    try:
+        val = int(raw.replace(",", ""))
+    except ValueError:
+        return None
+    return f"${val/1e3:,.1f} billion"  # assume "in millions"
+
+
+def _query_metrics(query_lower: str) -> Tuple[bool, bool]:
+    is_revenue = "revenue" in query_lower
+    is_profit = any(x in query_lower for x in ["net income", "net profit", "earnings"])
+    return is_revenue, is_profit
+
+
 def extract_numeric_answer(query: str, retrieved_docs: List[Dict]) -> Optional[Tuple[str, str]]:
     """
     Tiered extractor for financial values:
@@ -362,54 +581,19 @@ def extract_numeric_answer(query: str, retrieved_docs: List[Dict]) -> Optional[T
     """
 
     query_lower = query.lower()
-    is_revenue = "revenue" in query_lower
-    is_profit = any(x in query_lower for x in ["net income", "net profit", "earnings"])
+    is_revenue, is_profit = _query_metrics(query_lower)
     """
     if not (is_revenue or is_profit):
         print("[DEBUG] not (is_revenue or is_profit): ")
         return None, None
     """
-    print("[DEBUG] extract_numeric_answer 1")
+    logger.debug("extract_numeric_answer: revenue=%s profit=%s", is_revenue, is_profit)
     # Detect year (e.g. FY 2023)
     target_year = None
-    m = re.search(r"(20\d{2})", query_lower)
+    m = YEAR_RE.search(query_lower)
     if m:
         target_year = m.group(1)
 
-    # --------------------
-    # Revenue patterns
-    # --------------------
-    revenue_strict = re.compile(
-        r"(?:total\s+|consolidated\s+)?revenue[^$\d]{0,20}([\$€₹]?\s?\d[\d,]*(?:\.\d+)?)(?:\s?(million|billion|trillion))?",
-        re.IGNORECASE
-    )
-    revenue_table = (
-        re.compile(rf"Revenue\s*\|\s*{target_year}:\s*\$?\s*([\d,]+)", re.IGNORECASE)
-        if target_year else None
-    )
-    """
-    revenue_flex = re.compile(
-        rf"(?:total\s+)?revenue[^0-9$]{{0,15}}[:\|]?\s*\$?\s*([\d,]+)",
-        re.IGNORECASE
-    )
-    """
-    revenue_flex = re.compile(
-        r"(?:total\s+)?revenue[^$\d]{0,10}[\$: ]?\s*([\d,]+(?:\.\d+)?)(?:\s*(million|billion|trillion))?",
-    re.IGNORECASE
-    )
-
-    # --------------------
-    # Profit patterns
-    # --------------------
-    profit_strict = re.compile(
-        r"(?:net\s+income|net\s+profit|earnings)[^$\d]{0,20}([\$€₹]?\s?\d[\d,]*(?:\.\d+)?)(?:\s?(million|billion|trillion))?",
-        re.IGNORECASE
-    )
-    profit_table = (
-        re.compile(rf"(?:Net\s+Income|Earnings)\s*\|\s*{target_year}:\s*\$?\s*([\d,]+)", re.IGNORECASE)
-        if target_year else None
-    )
-
     # --------------------
     # Loop through docs
     # --------------------
@@ -417,90 +601,210 @@ def extract_numeric_answer(query: str, retrieved_docs: List[Dict]) -> Optional[T
 
     for doc in retrieved_docs:
         text = doc.get("text", "")
-        print("[DEBUG] extract_numeric_answer is_revenue", is_revenue )
         if is_revenue:
 
-            match = revenue_flex.search(text) or revenue_strict.search(text)
-            print("[DEBUG] extract_numeric_answer match", match)
+            match = REVENUE_FLEX_RE.search(text) or REVENUE_STRICT_RE.search(text)
+            logger.debug("extract_numeric_answer revenue match: %s", match)
             if match:
 
                 norm = _normalize_value(match, text)
-                print("[DEBUG] extract_numeric_answer norm", norm )
                 if norm:
-                    print("[DEBUG] extract_numeric_answer 3 ",norm, text[:200])
+                    logger.debug("extract_numeric_answer revenue: %s from %.200s", norm, text)
                     return norm, text[:200]
-            print("[DEBUG] extract_numeric_answer revenue_table", revenue_table )
-            if revenue_table:
-                match = revenue_table.search(text)
-                if match:
-                    raw = match.group(1).replace(",", "")
-                    try:
-                        val = int(raw)
-                        print("[DEBUG] extract_numeric_answer 3 ",f"${val/1e3:,.1f} billion", text[:200])
-                        return f"${val/1e3:,.1f} billion", text[:200]  # assume "in millions"
-                    except:
-                        continue
-        print("[DEBUG] extract_numeric_answer is_profit", is_profit )
+            match = _table_search(REVENUE_TABLE_RE, text, target_year)
+            if match:
+                value = _table_value(match.group(2))
+                if value:
+                    logger.debug("extract_numeric_answer revenue table: %s from %.200s", value, text)
+                    return value, text[:200]
         if is_profit:
-            match = profit_strict.search(text)
+            match = PROFIT_STRICT_RE.search(text)
             if match:
                 norm = _normalize_value(match, text)
                 if norm:
-                    print("[DEBUG] extract_numeric_answer 4 ",norm, text[:200])
+                    logger.debug("extract_numeric_answer profit: %s from %.200s", norm, text)
                     return norm, text[:200]
-            print("[DEBUG] extract_numeric_answer profit_table", profit_table )
-            if profit_table:
-                match = profit_table.search(text)
-                if match:
-                    raw = match.group(1).replace(",", "")
-                    try:
-                        val = int(raw)
-                        print("[DEBUG] extract_numeric_answer 4 " f"${val/1e3:,.1f} billion",text[:200])
-                        return f"${val/1e3:,.1f} billion", text[:200]  # assume "in millions"
-                    except:
-                        continue
-    print("[DEBUG] extract_numeric_answer 3")
+            match = _table_search(PROFIT_TABLE_RE, text, target_year)
+            if match:
+                value = _table_value(match.group(2))
+                if value:
+                    logger.debug("extract_numeric_answer profit table: %s from %.200s", value, text)
+                    return value, text[:200]
+    logger.debug("extract_numeric_answer: no value in %d docs", len(retrieved_docs))
     return None, None
 
 
 def _normalize_value(match, text: str) -> Optional[str]:
     """Helper: normalize numeric with units or implicit context."""
     number, unit = match.groups()
+    logger.debug("_normalize_value: %s %s", number, unit)
+    return _format_value(number, unit, text)
+
+
+def _format_value(number: str, unit: Optional[str], text: str) -> Optional[str]:
     number_clean = number.replace(",", "").replace("$", "").strip()
-    print("[DEBUG] _normalize_value 0 ")
     # Skip false year matches
-    if re.fullmatch(r"19\d{2}|20\d{2}", number_clean):
-        print("[DEBUG] _normalize_value 1 ")
+    if YEAR_VALUE_RE.fullmatch(number_clean):
         return None
 
     try:
         value = float(number_clean)
-        if unit:
-            unit = unit.lower()
-            if unit == "million":
-                value *= 1e6
-            elif unit == "billion":
-                value *= 1e9
-            elif unit == "trillion":
-                value *= 1e12
-        elif re.search(r"in\s+millions", text, re.IGNORECASE):
+    except ValueError:
+        return None
+    if unit:
+        unit = unit.lower()
+        if unit == "million":
             value *= 1e6
-        elif re.search(r"in\s+billions", text, re.IGNORECASE):
+        elif unit == "billion":
             value *= 1e9
+        elif unit == "trillion":
+            value *= 1e12
+    elif IN_MILLIONS_RE.search(text):
+        value *= 1e6
+    elif IN_BILLIONS_RE.search(text):
+        value *= 1e9
+
+    # Pretty formatting
+    if value >= 1e9:
+        return f"${value/1e9:,.1f} billion"
+    elif value >= 1e6:
+        return f"${value/1e6:,.1f} million"
+    else:
+        return f"${value:,.0f}"
+
+"""# Financial Fact Index"""
+
+# Further "| 2022: 1,100" cells that follow a matched table cell
+TABLE_NEXT_CELL_RE = re.compile(r"\s*\|\s*(20\d{2}):\s*\$?\s*([\d,]+)")
+# Like the *_STRICT_RE patterns, but step over a year between metric and value
+# ("revenue in fiscal 2023 was $211.9 billion"). A number followed by "%" or
+# "percent" is a rate, not an amount, and never matches (even in part).
+_FACT_VALUE = (r"[^$\d]{0,20}(?:(?:fy\s*)?20\d{2}[^$\d]{0,20})?([\$€₹]?\s?\d[\d,]*(?:\.\d+)?)"
+               r"(?![\d.,]*\s?(?:%|percent))(?:\s?(million|billion|trillion))?")
+REVENUE_FACT_RE = re.compile(r"(?:total\s+|consolidated\s+)?revenue" + _FACT_VALUE, re.IGNORECASE)
+PROFIT_FACT_RE = re.compile(r"(?:net\s+income|net\s+profit|earnings)" + _FACT_VALUE, re.IGNORECASE)
+# Questions about a change or a comparison, which a single fact cannot answer
+COMPARISON_QUERY_RE = re.compile(
+    r"\b(?:compar\w*|chang\w*|growth|grew|grow\w*|increas\w*|decreas\w*|declin\w*|rose|fell|"
+    r"differ\w*|versus|vs\.?|yoy|year[- ]over[- ]year|trend\w*)\b",
+    re.IGNORECASE
+)
 
-        # Pretty formatting
-        print("[DEBUG] _normalize_value Format ", value)
-        if value >= 1e9:
-            print("[DEBUG] _normalize_value 3 ")
-            return f"${value/1e9:,.1f} billion"
-        elif value >= 1e6:
-            print("[DEBUG] _normalize_value 4 ")
-            return f"${value/1e6:,.1f} million"
-        else:
-            print("[DEBUG] _normalize_value 5 ")
-            return f"${value:,.0f}"
-    except:
-        print("[DEBUG] _normalize_value 6 ")
+
+class FinancialFactIndex:
+    """
+    (metric, year) -> value facts extracted from chunks at index time, so common
+    questions such as "revenue in 2023" are answered by a dict lookup before any
+    retrieval runs. Values are formatted like extract_numeric_answer's.
+
+    Table cells carry their year. A sentence fact is kept only when its value
+    is an amount (a currency symbol or a million/billion/trillion unit; rates
+    like "5%" never match) and exactly one year appears near it; otherwise the
+    query falls back to retrieval + extract_numeric_answer.
+    """
+
+    METRICS = (
+        ('revenue', (REVENUE_FACT_RE,), REVENUE_TABLE_RE),
+        ('net_income', (PROFIT_FACT_RE,), PROFIT_TABLE_RE),
+    )
+    # Characters around a sentence match searched for its year
+    YEAR_WINDOW = 80
+    # Facts from explicit tables and "total"/"consolidated" statements win ties
+    TABLE_PRIORITY = 2
+    TOTAL_PRIORITY = 1
+
+    def __init__(self):
+        # (metric, year) -> {value: [priority, [chunk ids]]}
+        self.facts: Dict[Tuple[str, str], Dict[str, List]] = {}
+        self._chunk_keys: Dict[int, List[Tuple[str, str]]] = {}
+
+    def __len__(self) -> int:
+        return sum(len(values) for values in self.facts.values())
+
+    def add_chunks(self, ids: Iterable[int], texts: List[str]):
+        for chunk_id, text in zip(ids, texts):
+            for metric, year, value, priority in self.extract(text):
+                self._add_fact(metric, year, value, priority, int(chunk_id))
+
+    def remove_chunks(self, ids: List[int]):
+        for chunk_id in ids:
+            for key in self._chunk_keys.pop(int(chunk_id), []):
+                values = self.facts.get(key, {})
+                for value in list(values):
+                    chunk_ids = values[value][1]
+                    if chunk_id in chunk_ids:
+                        chunk_ids.remove(chunk_id)
+                    if not chunk_ids:
+                        del values[value]
+                if not values:
+                    self.facts.pop(key, None)
+
+    def _add_fact(self, metric: str, year: str, value: str, priority: int, chunk_id: int):
+        entry = self.facts.setdefault((metric, year), {}).setdefault(value, [priority, []])
+        entry[0] = max(entry[0], priority)
+        if chunk_id not in entry[1]:
+            entry[1].append(chunk_id)
+            self._chunk_keys.setdefault(chunk_id, []).append((metric, year))
+
+    @classmethod
+    def extract(cls, text: str) -> set:
+        """Distinct (metric, year, value, priority) facts stated in one chunk"""
+        facts = set()
+        for metric, sentence_patterns, table_pattern in cls.METRICS:
+            for match in table_pattern.finditer(text):
+                cells = [match.groups()]
+                pos = match.end()
+                next_cell = TABLE_NEXT_CELL_RE.match(text, pos)
+                while next_cell:
+                    cells.append(next_cell.groups())
+                    next_cell = TABLE_NEXT_CELL_RE.match(text, next_cell.end())
+                for year, raw in cells:
+                    value = _table_value(raw)
+                    if value:
+                        facts.add((metric, year, value, cls.TABLE_PRIORITY))
+
+            for pattern in sentence_patterns:
+                for match in pattern.finditer(text):
+                    number, unit = match.groups()
+                    if not unit and not number.startswith(("$", "€", "₹")):
+                        continue
+                    value = _format_value(number, unit, text)
+                    if not value:
+                        continue
+                    window = text[max(0, match.start() - cls.YEAR_WINDOW):match.end() + cls.YEAR_WINDOW]
+                    years = set(YEAR_RE.findall(window))
+                    if len(years) != 1:
+                        continue
+                    total = match.group(0).lower().startswith(("total", "consolidated"))
+                    facts.add((metric, years.pop(), value, cls.TOTAL_PRIORITY if total else 0))
+        return facts
+
+    def lookup(self, query: str) -> Optional[Dict]:
+        """
+        Answer "<metric> ... <year>" questions from the fact table. Only the highest
+        priority facts count, and they must agree on one value: conflicting values
+        (several companies, segments) return None so retrieval decides, as do
+        questions naming several years or asking about a change or comparison.
+        Returns {'metric', 'year', 'value', 'chunk_id'} or None.
+        """
+        query_lower = query.lower()
+        year_match = YEAR_RE.search(query_lower)
+        if not year_match or len(set(YEAR_RE.findall(query_lower))) > 1 or COMPARISON_QUERY_RE.search(query_lower):
+            return None
+        is_revenue, is_profit = _query_metrics(query_lower)
+        metrics = [metric for metric, wanted in (('revenue', is_revenue), ('net_income', is_profit)) if wanted]
+
+        for metric in metrics:
+            values = self.facts.get((metric, year_match.group(1)))
+            if not values:
+                continue
+            top_priority = max(priority for priority, _ in values.values())
+            candidates = [(value, chunk_ids) for value, (priority, chunk_ids) in values.items()
+                          if priority == top_priority]
+            if len(candidates) != 1:
+                return None
+            value, chunk_ids = candidates[0]
+            return {'metric': metric, 'year': year_match.group(1), 'value': value, 'chunk_id': min(chunk_ids)}
         return None
 
 """#  Data Processing"""
@@ -522,6 +826,52 @@ def _chunk_text(text: str, chunk_size: int, chunk_overlap: int) -> List[str]:
     return chunks
 
 
+# Chunks record the character offset of every TOKEN_MARK_STRIDE-th token, so
+# they can be cut to a token budget without being tokenized again
+TOKEN_MARK_STRIDE = 32
+
+
+def token_chunk_spans(text: str, tokenizer, chunk_size: int,
+                      chunk_overlap: int) -> List[Tuple[int, int, int, List[int]]]:
+    """
+    Token-wise chunking with overlap. The text is tokenized once with offset
+    mapping (needs a fast tokenizer); each chunk is returned as (start, end,
+    token count, marks) where text[start:end] is the chunk and marks[j] is the
+    offset, within the chunk, of the end of its first (j + 1) * TOKEN_MARK_STRIDE
+    tokens.
+    """
+    offsets = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True,
+                        verbose=False)["offset_mapping"]
+    if not offsets:
+        return []
+    if chunk_size <= 0:
+        chunk_size = len(offsets)
+    spans = []
+    step = max(1, chunk_size - chunk_overlap)
+    for first in range(0, len(offsets), step):
+        last = min(len(offsets), first + chunk_size)
+        start = offsets[first][0]
+        marks = [offsets[first + n - 1][1] - start for n in range(TOKEN_MARK_STRIDE, last - first, TOKEN_MARK_STRIDE)]
+        spans.append((start, offsets[last - 1][1], last - first, marks))
+        if last == len(offsets):
+            break
+    return spans
+
+
+def truncate_to_tokens(text: str, token_count: int, marks: List[int], max_tokens: int) -> Tuple[str, int]:
+    """
+    Cut a chunk to at most max_tokens from its stored token count and marks.
+    Cuts fall on a mark, so up to TOKEN_MARK_STRIDE - 1 tokens of the budget
+    may go unused. Returns (text, token count).
+    """
+    if token_count <= max_tokens:
+        return text, token_count
+    n_marks = min(max_tokens // TOKEN_MARK_STRIDE, len(marks))
+    if n_marks == 0:
+        return "", 0
+    return text[:marks[n_marks - 1]], n_marks * TOKEN_MARK_STRIDE
+
+
 def _normalize_space(s: str) -> str:
     return re.sub(r'\s+', ' ', s).strip()
 
@@ -582,16 +932,35 @@ class RAGConfig:
     generator_model: str = "distilgpt2"  # or "gpt2" or "microsoft/DialoGPT-small"
     max_context_length: int = 512
     max_generation_length: int = 150
+    enable_prefix_cache: bool = True  # reuse the KV cache of the fixed prompt header across requests
 
     # Retrieval settings
     initial_retrieval_k: int = 20  # Stage 1: broad retrieval
     final_retrieval_k: int = 5     # Stage 2: after re-ranking
     hybrid_alpha: float = 0.6      # Dense vs sparse weight
+    fusion_strategy: str = "linear"  # "linear", "minmax", "zscore" or "rrf" (see fuse_scores)
+    fusion_rrf_k: int = 60         # rank offset for "rrf"
+    bm25_pruning: bool = False     # MaxScore early termination for sparse top-k
+    enable_fact_index: bool = True  # answer "<metric> in <year>" from index-time facts before retrieval
+
+    # Dense index settings
+    dense_index_type: str = "flat"  # "flat", "ivf_flat", "hnsw", "ivf_pq" or "auto" (by corpus size)
+    ivf_nlist: int = 0              # IVF cells; 0 = 4 * sqrt(corpus size)
+    ivf_nprobe: int = 16            # IVF cells visited per query
+    hnsw_m: int = 32                # HNSW graph degree
+    hnsw_ef_construction: int = 200
+    hnsw_ef_search: int = 64        # HNSW candidate list size per query
+    pq_m: int = 48                  # IVF-PQ sub-quantizers (rounded down to a divisor of the dimension)
+    pq_nbits: int = 8
 
     # Processing settings
     chunk_size: int = 300
     chunk_overlap: int = 50
+    token_chunking: bool = True  # chunk_size/chunk_overlap count generator tokens (words without a fast tokenizer)
+    rerank_max_tokens: int = 128  # generator tokens of each chunk passed to the rerankers
     batch_size: int = 16
+    ingest_workers: int = 0  # processes parsing files during indexing (0 = all cores)
+    ingest_batch_chunks: int = 1024  # chunks embedded per batch while files are still being parsed
 
     # Guardrail settings
     enable_input_guardrails: bool = True
@@ -602,6 +971,49 @@ class RAGConfig:
     # Interface settings
     interface_type: str = "gradio"  # "gradio" or "streamlit"
 
+    # Observability settings
+    log_level: Optional[str] = None  # e.g. "DEBUG" to log query-path details; None leaves logging untouched
+    trace_path: Optional[str] = None  # append per-stage query spans to this JSON lines file
+
+    # Persistence settings
+    index_snapshot_dir: Optional[str] = None  # where save_index/load_index keep snapshots
+    index_registry_dir: Optional[str] = None  # snapshots of named indexes, one directory per name
+    index_memory_budget_mb: Optional[float] = None  # named indexes kept in RAM before LRU eviction (None = no limit)
+    embedding_cache_dir: Optional[str] = None  # disk cache of chunk embeddings (None = disabled)
+    embedding_cache_max_entries: int = 500_000
+    query_memo_max_entries: int = 4096  # in-memory query embeddings
+    rerank_memo_max_entries: int = 100_000  # in-memory cross-encoder scores
+
+    # Answer cache settings
+    enable_answer_cache: bool = True
+    answer_cache_max_entries: int = 1024
+    answer_cache_ttl_seconds: Optional[float] = 3600.0  # None = entries never expire
+    answer_cache_similarity: float = 0.95  # min query-embedding cosine for a paraphrase hit
+
+    # Quantization settings (INT8 dynamic quantization of linear layers, CPU only)
+    quantize_embedding_model: bool = False
+    quantize_cross_encoder: bool = False
+    quantize_generator: bool = False
+
+    # Reranking cascade settings (stage 2)
+    rerank_skip_margin: Optional[float] = None  # keep the stage-1 order when top1 - top2 hybrid score >= this (scale depends on fusion_strategy)
+    first_pass_reranker_model: Optional[str] = None  # e.g. "cross-encoder/ms-marco-TinyBERT-L-2-v2"
+    first_pass_keep: int = 10  # candidates the first pass forwards to the cross-encoder
+
+    # Inference backend for the embedding model and cross-encoder
+    inference_backend: str = "torch"  # "torch" or "onnx" (ONNX Runtime on CPU)
+    onnx_cache_dir: str = ".rag_onnx"  # exported graphs; delete after changing a local model in place
+
+    # Model loading: every model loads on first use unless preloaded
+    preload_models: bool = False  # start loading all models concurrently in the background at startup
+
+# Source of IndexGeneration.version values, unique within the process
+_INDEX_VERSIONS = itertools.count(1)
+
+# Bump whenever the on-disk snapshot layout changes
+INDEX_SNAPSHOT_VERSION = 5
+INDEX_MANIFEST_FILE = "manifest.json"
+
 """# Query Processor"""
 
 class QueryPreprocessor:
@@ -654,13 +1066,1154 @@ class QueryPreprocessor:
             'variations': self.expand_query(query)
         }
 
+"""# Dense Index
+   Exact or approximate nearest-neighbour FAISS indices selected from RAGConfig
+"""
+
+DENSE_INDEX_TYPES = ("flat", "ivf_flat", "hnsw", "ivf_pq")
+
+
+def resolve_dense_index_type(config: RAGConfig, num_vectors: int) -> str:
+    """Map config.dense_index_type to a concrete index type; "auto" picks by corpus size"""
+    index_type = config.dense_index_type
+    if index_type == "auto":
+        if num_vectors < 50_000:
+            return "flat"
+        if num_vectors < 1_000_000:
+            return "hnsw"
+        return "ivf_pq"
+    if index_type not in DENSE_INDEX_TYPES:
+        raise ValueError(f"Unknown dense_index_type '{index_type}', expected one of {DENSE_INDEX_TYPES} or 'auto'")
+    return index_type
+
+
+def create_dense_index(embeddings: np.ndarray, config: RAGConfig) -> Tuple[faiss.Index, str]:
+    """
+    Create an empty ID-mapped inner-product index for the configured type.
+    IVF variants are trained on the given embeddings, so pass the first batch
+    that will be added. Returns (index, resolved index type).
+    """
+    num_vectors, dimension = embeddings.shape
+    index_type = resolve_dense_index_type(config, num_vectors)
+    metric = faiss.METRIC_INNER_PRODUCT
+
+    if index_type == "ivf_pq" and num_vectors < 2 ** config.pq_nbits:
+        print(f"Too few vectors ({num_vectors}) to train IVF-PQ; using IVF-Flat")
+        index_type = "ivf_flat"
+
+    if index_type == "hnsw":
+        base = faiss.IndexHNSWFlat(dimension, config.hnsw_m, metric)
+        base.hnsw.efConstruction = config.hnsw_ef_construction
+        base.hnsw.efSearch = config.hnsw_ef_search
+    elif index_type in ("ivf_flat", "ivf_pq"):
+        nlist = config.ivf_nlist or int(4 * math.sqrt(num_vectors))
+        nlist = max(1, min(nlist, num_vectors // 39 or 1))  # FAISS wants ~39 training points per cell
+        quantizer = faiss.IndexFlatIP(dimension)
+        if index_type == "ivf_pq":
+            pq_m = max(m for m in range(1, min(config.pq_m, dimension) + 1) if dimension % m == 0)
+            base = faiss.IndexIVFPQ(quantizer, dimension, nlist, pq_m, config.pq_nbits, metric)
+        else:
+            base = faiss.IndexIVFFlat(quantizer, dimension, nlist, metric)
+        print(f"Training {index_type} index with {nlist} cells on {num_vectors} vectors...")
+        base.train(embeddings)
+        base.nprobe = config.ivf_nprobe
+    else:
+        base = faiss.IndexFlatIP(dimension)
+
+    return faiss.IndexIDMap2(base), index_type
+
+
+def detect_dense_index_type(index: faiss.Index) -> str:
+    """Recover the index type of a (possibly ID-mapped) index, e.g. after loading a snapshot"""
+    base = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    if isinstance(base, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(base, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(base, faiss.IndexIVF):
+        return "ivf_flat"
+    return "flat"
+
+
+def dense_search_params(index_type: str, config: RAGConfig, k: int, nprobe: Optional[int] = None,
+                        ef_search: Optional[int] = None) -> Optional[faiss.SearchParameters]:
+    """Per-query search parameters (nprobe / efSearch), overriding the config when given"""
+    if index_type in ("ivf_flat", "ivf_pq"):
+        return faiss.SearchParametersIVF(nprobe=nprobe or config.ivf_nprobe)
+    if index_type == "hnsw":
+        # HNSW cannot return more than efSearch results
+        return faiss.SearchParametersHNSW(efSearch=max(ef_search or config.hnsw_ef_search, k))
+    return None
+
+"""# Sparse Index
+   Inverted-index BM25 with top-k retrieval that can grow and shrink without being rebuilt
+"""
+
+class InvertedIndexBM25:
+    """
+    BM25Okapi scoring over an inverted index.
+    Each term has a postings list of array-backed doc ids and term frequencies,
+    so a query only touches the documents that contain its terms. Scores match
+    rank_bm25.BM25Okapi exactly (same idf with an epsilon floor).
+
+    Document slots are append-only so positions stay stable; removed documents
+    are tombstoned, excluded from the corpus statistics and never returned.
+    """
+
+    def __init__(self, corpus: List[List[str]], k1: float = 1.5, b: float = 0.75,
+                 epsilon: float = 0.25, prune: bool = False):
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+        self.prune = prune
+
+        self.vocab: Dict[str, int] = {}
+        self.df: List[int] = []
+        self.postings_docs: List[np.ndarray] = []
+        self.postings_tfs: List[np.ndarray] = []
+        self.doc_terms: List[np.ndarray] = []  # term ids per document, used on removal
+        self.doc_len = np.zeros(0, dtype=np.float64)
+        self.deleted = set()
+        self.corpus_size = 0
+        self.total_len = 0
+        self.avgdl = 0.0
+        self.average_idf = 0.0
+        self.idf = np.zeros(0, dtype=np.float64)
+
+        # Appends are buffered per term and merged on the next query
+        self._pending: Dict[int, Tuple[List[int], List[int]]] = {}
+        self._dirty_terms = set()   # postings that still hold removed documents
+        self._norm = None           # k1 * (1 - b + b * dl / avgdl), per document
+        self._upper_bounds: Dict[int, float] = {}
+
+        self.add_documents(corpus)
+
+    @property
+    def live_count(self) -> int:
+        return self.corpus_size - len(self.deleted)
+
+    def add_documents(self, corpus: List[List[str]]) -> List[int]:
+        """Append tokenized documents; returns their positions"""
+        start = self.corpus_size
+        lengths = []
+        for doc_id, document in enumerate(corpus, start=start):
+            frequencies: Dict[int, int] = {}
+            for word in document:
+                tid = self.vocab.get(word)
+                if tid is None:
+                    tid = self.vocab[word] = len(self.df)
+                    self.df.append(0)
+                    self.postings_docs.append(np.zeros(0, dtype=np.int32))
+                    self.postings_tfs.append(np.zeros(0, dtype=np.float64))
+                frequencies[tid] = frequencies.get(tid, 0) + 1
+            for tid, freq in frequencies.items():
+                self.df[tid] += 1
+                pending = self._pending.setdefault(tid, ([], []))
+                pending[0].append(doc_id)
+                pending[1].append(freq)
+            self.doc_terms.append(np.fromiter(frequencies.keys(), dtype=np.int32, count=len(frequencies)))
+            lengths.append(len(document))
+
+        self.doc_len = np.concatenate([self.doc_len, np.asarray(lengths, dtype=np.float64)])
+        self.corpus_size += len(corpus)
+        self.total_len += sum(lengths)
+        self._update_statistics()
+        return list(range(start, self.corpus_size))
+
+    def remove_documents(self, positions: List[int]) -> int:
+        """Tombstone documents by position and drop them from the statistics"""
+        removed = 0
+        for pos in positions:
+            if pos in self.deleted or not 0 <= pos < self.corpus_size:
+                continue
+            for tid in self.doc_terms[pos]:
+                self.df[tid] -= 1
+                self._dirty_terms.add(int(tid))
+            self.total_len -= int(self.doc_len[pos])
+            self.doc_len[pos] = 0
+            self.doc_terms[pos] = np.zeros(0, dtype=np.int32)
+            self.deleted.add(pos)
+            removed += 1
+        if removed:
+            self._update_statistics()
+        return removed
+
+    def _update_statistics(self):
+        """Recompute avgdl and idf (O(vocabulary), independent of corpus size)"""
+        self.avgdl = self.total_len / max(self.live_count, 1)
+        # Plain math.log and a sequential sum keep idf bit-identical to rank_bm25
+        n_live = self.live_count
+        idf = [math.log(n_live - freq + 0.5) - math.log(freq + 0.5) if freq > 0 else 0.0 for freq in self.df]
+        n_present = sum(1 for freq in self.df if freq > 0)
+        self.average_idf = sum(idf) / max(n_present, 1)
+        eps = self.epsilon * self.average_idf
+        self.idf = np.array([eps if value < 0 else value for value in idf], dtype=np.float64)
+        self._norm = None
+        self._upper_bounds = {}
+
+    def _flush(self):
+        """Merge buffered appends into the postings and purge removed documents"""
+        for tid, (docs, tfs) in self._pending.items():
+            self.postings_docs[tid] = np.concatenate([self.postings_docs[tid], np.asarray(docs, dtype=np.int32)])
+            self.postings_tfs[tid] = np.concatenate([self.postings_tfs[tid], np.asarray(tfs, dtype=np.float64)])
+        self._pending = {}
+
+        if self._dirty_terms:
+            dead = np.fromiter(self.deleted, dtype=np.int32, count=len(self.deleted))
+            for tid in self._dirty_terms:
+                keep = ~np.isin(self.postings_docs[tid], dead)
+                self.postings_docs[tid] = self.postings_docs[tid][keep]
+                self.postings_tfs[tid] = self.postings_tfs[tid][keep]
+            self._dirty_terms = set()
+
+        if self._norm is None:
+            self._norm = self.k1 * (1 - self.b + self.b * self.doc_len / max(self.avgdl, 1e-9))
+
+    def memory_bytes(self) -> int:
+        """Approximate size of the postings, per-document arrays and vocabulary"""
+        arrays = itertools.chain(self.postings_docs, self.postings_tfs, self.doc_terms, [self.doc_len, self.idf])
+        return sum(a.nbytes for a in arrays) + sum(sys.getsizeof(t) + 8 for t in self.vocab)
+
+    def flush(self):
+        """
+        Apply buffered appends and removals now instead of on the next query.
+        Queries only read the postings afterwards, so concurrent queries are
+        safe until the next add_documents/remove_documents.
+        """
+        self._flush()
+
+    def _term_scores(self, tid: int, docs: np.ndarray, tfs: np.ndarray) -> np.ndarray:
+        return self.idf[tid] * (tfs * (self.k1 + 1) / (tfs + self._norm[docs]))
+
+    def get_scores(self, query: List[str]) -> np.ndarray:
+        """Scores for every document slot, as BM25Okapi.get_scores"""
+        self._flush()
+        scores = np.zeros(self.corpus_size)
+        for term in query:
+            tid = self.vocab.get(term)
+            if tid is None or self.df[tid] == 0:
+                continue
+            docs, tfs = self.postings_docs[tid], self.postings_tfs[tid]
+            scores[docs] += self._term_scores(tid, docs, tfs)
+        return scores
+
+    def top_k(self, query: List[str], k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return (doc ids, scores) of the k best documents containing at least one
+        query term, best first. Ties are broken by lower doc id.
+        """
+        self._flush()
+        tids = [self.vocab[t] for t in query if t in self.vocab and self.df[self.vocab[t]] > 0]
+        if not tids or k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+
+        if self.prune and all(self.idf[t] >= 0 for t in tids):
+            docs, scores = self._top_k_maxscore(tids, k)
+            # MaxScore sums terms in a different order; rescore the finalists in
+            # query order so scores and tie-breaking match the exact path bit for bit
+            if len(docs) > k:
+                kth = np.partition(scores, len(scores) - k)[len(scores) - k]
+                docs = docs[scores >= kth * (1 - 1e-9)]
+            scores = np.zeros(self.corpus_size)
+            for tid in tids:
+                self._add_term_scores(tid, docs, scores)
+            scores = scores[docs]
+        else:
+            scores = np.zeros(self.corpus_size)
+            touched = np.zeros(self.corpus_size, dtype=bool)
+            for tid in tids:
+                docs, tfs = self.postings_docs[tid], self.postings_tfs[tid]
+                scores[docs] += self._term_scores(tid, docs, tfs)
+                touched[docs] = True
+            docs = np.flatnonzero(touched)
+            scores = scores[docs]
+        return self._select_top(docs, scores, k)
+
+    @staticmethod
+    def _select_top(docs: np.ndarray, scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        if len(docs) > k:
+            # Keep everything tied with the k-th score so ties resolve by doc id
+            kth = np.partition(scores, len(scores) - k)[len(scores) - k]
+            keep = scores >= kth
+            docs, scores = docs[keep], scores[keep]
+        order = np.lexsort((docs, -scores))[:k]
+        return docs[order].astype(np.int64), scores[order]
+
+    def _upper_bound(self, tid: int) -> float:
+        """Largest contribution the term can add to any single document"""
+        ub = self._upper_bounds.get(tid)
+        if ub is None:
+            docs, tfs = self.postings_docs[tid], self.postings_tfs[tid]
+            ub = float(self._term_scores(tid, docs, tfs).max()) if len(docs) else 0.0
+            self._upper_bounds[tid] = ub
+        return ub
+
+    def _add_term_scores(self, tid: int, candidates: np.ndarray, scores: np.ndarray):
+        """Add one term's contribution for a sorted set of documents via postings lookup"""
+        docs, tfs = self.postings_docs[tid], self.postings_tfs[tid]
+        if len(docs) == 0 or len(candidates) == 0:
+            return
+        pos = np.minimum(np.searchsorted(docs, candidates), len(docs) - 1)
+        hit = docs[pos] == candidates
+        hit_docs = candidates[hit]
+        scores[hit_docs] += self._term_scores(tid, hit_docs, tfs[pos[hit]])
+
+    def _top_k_maxscore(self, tids: List[int], k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        MaxScore early termination: terms are scored in decreasing order of their
+        upper bound. Once the remaining terms together cannot lift an unseen
+        document above the current k-th best score, they are only scored for the
+        documents that can still make it into the top k.
+        """
+        tids = sorted(tids, key=self._upper_bound, reverse=True)
+        bounds = np.array([self._upper_bound(t) for t in tids])
+        remaining = np.concatenate([np.cumsum(bounds[::-1])[::-1], [0.0]])
+
+        scores = np.zeros(self.corpus_size)
+        touched = np.zeros(self.corpus_size, dtype=bool)
+        threshold = -np.inf
+        for i, tid in enumerate(tids):
+            if touched.sum() >= k:
+                candidates = np.flatnonzero(touched)
+                threshold = np.partition(scores[candidates], -k)[-k]
+            if remaining[i] <= threshold:
+                # Non-essential terms: only documents already in contention need them
+                candidates = np.flatnonzero(touched)
+                candidates = candidates[scores[candidates] + remaining[i] >= threshold]
+                for tid_j in tids[i:]:
+                    self._add_term_scores(tid_j, candidates, scores)
+                return candidates, scores[candidates]
+
+            docs, tfs = self.postings_docs[tid], self.postings_tfs[tid]
+            scores[docs] += self._term_scores(tid, docs, tfs)
+            touched[docs] = True
+
+        docs = np.flatnonzero(touched)
+        return docs, scores[docs]
+
+"""# Score Fusion
+   Hybrid dense + BM25 scoring of one query's candidates on NumPy arrays
+"""
+
+FUSION_STRATEGIES = ("linear", "minmax", "zscore", "rrf")
+# Below this many dense + BM25 hits a plain dict loop beats the array setup (see benchmarks/bench_fusion.py)
+FUSION_ARRAY_MIN_CANDIDATES = 64
+
+
+def _normalize_scores(scores: np.ndarray, strategy: str) -> np.ndarray:
+    """Per-list normalization for the minmax and zscore strategies"""
+    if not len(scores):
+        return scores
+    if strategy == "minmax":
+        low, high = float(scores.min()), float(scores.max())
+        return (scores - low) / (high - low) if high > low else np.ones_like(scores)
+    std = float(scores.std())
+    return (scores - float(scores.mean())) / std if std > 0 else np.zeros_like(scores)
+
+
+def fuse_scores(dense_ids: np.ndarray, dense_scores: np.ndarray, sparse_ids: np.ndarray, sparse_scores: np.ndarray,
+                k: int, alpha: float, strategy: str = "linear",
+                rrf_k: int = 60) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Fuse one query's dense and BM25 hits (each sorted best first) into the
+    top-k candidates. Every strategy weighs dense by alpha and BM25 by 1 - alpha:
+
+        linear   raw cosine + BM25 divided by the best BM25 score
+        minmax   both lists scaled to [0, 1]
+        zscore   both lists standardized to zero mean and unit variance
+        rrf      reciprocal rank fusion, 1 / (rrf_k + rank)
+
+    A candidate missing from one list gets 0 for it (the list's lowest z-score
+    under zscore). Ties keep dense order, then BM25 order. Returns (ids,
+    dense scores, sparse scores, fused scores) for the top k, raw scores 0
+    where a candidate was not retrieved by that list.
+    """
+    if strategy not in FUSION_STRATEGIES:
+        raise ValueError(f"Unknown fusion_strategy '{strategy}', expected one of {FUSION_STRATEGIES}")
+
+    # Union of both lists in first-seen order
+    candidates = np.concatenate([dense_ids, sparse_ids]).astype(np.int64)
+    unique_ids, first_seen, inverse = np.unique(candidates, return_index=True, return_inverse=True)
+    order = np.argsort(first_seen, kind="stable")
+    slot = np.empty_like(order)
+    slot[order] = np.arange(len(order))
+    dense_slots, sparse_slots = slot[inverse[:len(dense_ids)]], slot[inverse[len(dense_ids):]]
+
+    ids = unique_ids[order]
+
+    def scatter(values: np.ndarray, slots: np.ndarray, fill: float = 0.0) -> np.ndarray:
+        column = np.full(len(ids), fill)
+        column[slots] = values
+        return column
+
+    raw_dense = scatter(dense_scores, dense_slots)
+    raw_sparse = scatter(sparse_scores, sparse_slots)
+    if strategy == "rrf":
+        dense_part = scatter(1.0 / (rrf_k + np.arange(1, len(dense_ids) + 1)), dense_slots)
+        sparse_part = scatter(1.0 / (rrf_k + np.arange(1, len(sparse_ids) + 1)), sparse_slots)
+    elif strategy == "linear":
+        dense_part = raw_dense
+        sparse_part = raw_sparse / max(float(sparse_scores[0]), 1e-8) if len(sparse_scores) else raw_sparse
+    else:
+        parts = []
+        for scores, slots in ((dense_scores, dense_slots), (sparse_scores, sparse_slots)):
+            norm = _normalize_scores(np.asarray(scores, dtype=np.float64), strategy)
+            floor = float(norm.min()) if strategy == "zscore" and len(norm) else 0.0
+            parts.append(scatter(norm, slots, floor))
+        dense_part, sparse_part = parts
+
+    fused = alpha * dense_part + (1 - alpha) * sparse_part
+    top = np.argsort(-fused, kind="stable")[:k]
+    return ids[top], raw_dense[top], raw_sparse[top], fused[top]
+
+
+def fuse_candidates(dense_ids: np.ndarray, dense_scores: np.ndarray, sparse_ids: np.ndarray,
+                    sparse_scores: np.ndarray, k: int, alpha: float, strategy: str = "linear",
+                    rrf_k: int = 60) -> List[Dict]:
+    """
+    fuse_scores as stage-1 candidate dicts, best first. Small "linear" fusions
+    (the default k) run as a dict loop with the same arithmetic and tie order,
+    so both paths return identical candidates.
+    """
+    if strategy != "linear" or len(dense_ids) + len(sparse_ids) >= FUSION_ARRAY_MIN_CANDIDATES:
+        ids, dense, sparse, fused = fuse_scores(dense_ids, dense_scores, sparse_ids, sparse_scores,
+                                                k, alpha, strategy, rrf_k)
+        return [{'index': idx, 'dense_score': d, 'sparse_score': sp, 'hybrid_score': f, 'score': f,
+                 'stage': 'broad_retrieval'}
+                for idx, d, sp, f in zip(ids.tolist(), dense.tolist(), sparse.tolist(), fused.tolist())]
+
+    dense = dict(zip(dense_ids.tolist(), dense_scores.tolist()))
+    sparse = dict(zip(sparse_ids.tolist(), sparse_scores.tolist()))
+    max_sparse = max(float(sparse_scores[0]), 1e-8) if len(sparse_scores) else 1.0
+    fused = {idx: alpha * score + (1 - alpha) * (sparse.get(idx, 0.0) / max_sparse) for idx, score in dense.items()}
+    for idx, score in sparse.items():
+        if idx not in fused:
+            fused[idx] = (1 - alpha) * (score / max_sparse)
+    top = sorted(fused, key=fused.__getitem__, reverse=True)[:k]
+    return [{'index': idx, 'dense_score': dense.get(idx, 0.0), 'sparse_score': sparse.get(idx, 0.0),
+             'hybrid_score': fused[idx], 'score': fused[idx], 'stage': 'broad_retrieval'} for idx in top]
+
+"""# Chunk Store
+   Columnar, memory-mappable storage of chunk texts and metadata
+"""
+
+class ChunkStore:
+    """
+    Chunk texts and metadata as columns instead of one str and one dict per
+    chunk. All texts share one UTF-8 buffer addressed by an offsets array; id,
+    type, source, span and token count are integer columns (type and source
+    index small string tables), and the token marks of every chunk share one
+    ragged column. Metadata keys that fit no column are kept per chunk in
+    `extra`, and the preview is derived from the text on read.
+
+    save() writes the columns as flat files and load() memory-maps them, so
+    the OS pages in only the chunks that are read (reranking and the prompt).
+    Chunks appended after a load go to in-memory buffers behind the mapped
+    part. A chunk's text and columns never change once appended, so readers
+    need no lock; appends must not run concurrently with each other.
+    """
+
+    TEXT_FILE = "chunk_text.bin"
+    TABLES_FILE = "chunk_tables.json"
+    # Per-chunk integer columns: name -> (dtype, array typecode), metadata key.
+    # -1 means the key is absent (a code for type/source, a value otherwise).
+    COLUMNS = {
+        'ids': ((np.int64, 'q'), 'id'),
+        'types': ((np.int32, 'i'), 'type'),
+        'sources': ((np.int32, 'i'), 'source'),
+        'starts': ((np.int64, 'q'), 'start'),
+        'ends': ((np.int64, 'q'), 'end'),
+        'tokens': ((np.int32, 'i'), 'tokens'),
+    }
+    # Offset arrays (one more entry than items) and the ragged token marks
+    RAGGED = {'offsets': (np.int64, 'q'), 'mark_offsets': (np.int64, 'q'), 'marks': (np.uint32, 'I')}
+    PREVIEW_CHARS = 100
+
+    def __init__(self):
+        # Mapped part (empty until load)
+        self._text = np.zeros(0, dtype=np.uint8)
+        self._mapped = {name: np.zeros(0, dtype=dtype) for name, ((dtype, _), _) in self.COLUMNS.items()}
+        self._mapped.update(offsets=np.zeros(1, dtype=np.int64), mark_offsets=np.zeros(1, dtype=np.int64),
+                            marks=np.zeros(0, dtype=np.uint32))
+        # Appended part, with offsets relative to its own buffers
+        self._tail_text = bytearray()
+        self._tail = {name: array(code) for name, ((_, code), _) in self.COLUMNS.items()}
+        self._tail.update(offsets=array('q', [0]), mark_offsets=array('q', [0]), marks=array('I'))
+        self.type_names: List[str] = []
+        self.source_names: List[str] = []
+        self._type_codes: Dict[str, int] = {}
+        self._source_codes: Dict[str, int] = {}
+        self.extra: Dict[int, Dict] = {}
+
+    def __len__(self) -> int:
+        # The text offsets are appended last, so a chunk is only counted once complete
+        return len(self._mapped['ids']) + len(self._tail['offsets']) - 1
+
+    @staticmethod
+    def _code(value, names: List[str], codes: Dict[str, int]) -> int:
+        if value is None:
+            return -1
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(names)
+            names.append(value)
+        return code
+
+    def append(self, texts: List[str], metadata: List[Dict]) -> range:
+        """
+        Append chunks with their metadata dicts; returns their positions.
+        'start', 'end', 'tokens' and 'token_marks' (see token_chunk_spans) are
+        optional.
+        """
+        start = len(self)
+        for position, (text, meta) in enumerate(zip(texts, metadata), start=start):
+            rest = dict(meta)
+            values = {}
+            for name, (_, key) in self.COLUMNS.items():
+                value = rest.pop(key, None)
+                if name == 'types' and isinstance(value, str):
+                    value = self._code(value, self.type_names, self._type_codes)
+                elif name == 'sources' and isinstance(value, str):
+                    value = self._code(value, self.source_names, self._source_codes)
+                elif value is not None and not isinstance(value, (int, np.integer)):
+                    # e.g. the row dict of a table_row chunk, kept as is
+                    rest[key], value = value, None
+                values[name] = (position if name == 'ids' else -1) if value is None else int(value)
+            marks = rest.pop('token_marks', None) or []
+            if rest.get('preview') == text[:self.PREVIEW_CHARS]:
+                del rest['preview']
+            if rest:
+                self.extra[position] = rest
+
+            for name, value in values.items():
+                self._tail[name].append(value)
+            self._tail['marks'].extend(marks)
+            self._tail['mark_offsets'].append(len(self._tail['marks']))
+            self._tail_text += text.encode("utf-8")
+            self._tail['offsets'].append(len(self._tail_text))
+        return range(start, len(self))
+
+    def _locate(self, position: int) -> Tuple[Dict, int]:
+        """The part (mapped or tail columns) holding a chunk and its index there"""
+        n_mapped = len(self._mapped['ids'])
+        return (self._mapped, position) if position < n_mapped else (self._tail, position - n_mapped)
+
+    def text(self, position: int) -> str:
+        part, i = self._locate(position)
+        buffer = self._text if part is self._mapped else self._tail_text
+        data = buffer[part['offsets'][i]:part['offsets'][i + 1]]
+        return (data.tobytes() if part is self._mapped else data).decode("utf-8")
+
+    def texts(self, positions: Iterable[int]) -> List[str]:
+        return [self.text(position) for position in positions]
+
+    def _value(self, name: str, position: int) -> int:
+        part, i = self._locate(position)
+        return int(part[name][i])
+
+    def token_count(self, position: int) -> Optional[int]:
+        """Tokens in the chunk as counted at chunking time (None if unknown)"""
+        tokens = self._value('tokens', position)
+        return tokens if tokens >= 0 else None
+
+    def token_marks(self, position: int) -> List[int]:
+        part, i = self._locate(position)
+        return [int(mark) for mark in part['marks'][part['mark_offsets'][i]:part['mark_offsets'][i + 1]]]
+
+    def text_prefix(self, position: int, max_tokens: int) -> str:
+        """
+        The chunk cut to at most max_tokens, from its stored token count and
+        marks. Chunks indexed without them are cut at 4 characters per token.
+        """
+        text = self.text(position)
+        tokens = self.token_count(position)
+        if tokens is None:
+            return text[:4 * max_tokens]
+        return truncate_to_tokens(text, tokens, self.token_marks(position), max_tokens)[0]
+
+    def metadata(self, position: int) -> Dict:
+        """A fresh metadata dict for one chunk, in the shape it was appended with (without token marks)"""
+        meta = {'id': self._value('ids', position)}
+        type_code = self._value('types', position)
+        if type_code >= 0:
+            meta['type'] = self.type_names[type_code]
+        meta['preview'] = self.text(position)[:self.PREVIEW_CHARS]
+        source_code = self._value('sources', position)
+        if source_code >= 0:
+            meta['source'] = self.source_names[source_code]
+        for name in ('starts', 'ends', 'tokens'):
+            value = self._value(name, position)
+            if value >= 0:
+                meta[self.COLUMNS[name][1]] = value
+        meta.update(self.extra.get(position, {}))
+        return meta
+
+    def positions_with_source(self, source: str) -> np.ndarray:
+        code = self._source_codes.get(source)
+        if code is None:
+            return np.zeros(0, dtype=np.int64)
+        tail = np.fromiter(self._tail['sources'], dtype=np.int32, count=len(self._tail['sources']))
+        return np.flatnonzero(np.concatenate([self._mapped['sources'], tail]) == code)
+
+    def memory_bytes(self) -> int:
+        """
+        Heap size of the appended part, the string tables and the extras. The
+        mapped part is paged in and out by the OS and is not counted.
+        """
+        return (len(self._tail_text) + sum(c.itemsize * len(c) for c in self._tail.values())
+                + sum(sys.getsizeof(name) for name in itertools.chain(self.type_names, self.source_names))
+                + sum(sys.getsizeof(meta) for meta in self.extra.values()))
+
+    def _merged(self, name: str) -> np.ndarray:
+        """Mapped and appended values of one column as a single array"""
+        dtype = self.COLUMNS[name][0][0] if name in self.COLUMNS else self.RAGGED[name][0]
+        tail = np.asarray(self._tail[name], dtype=dtype)
+        if name in ('offsets', 'mark_offsets'):
+            # The tail's offsets continue from the end of the mapped buffer
+            base = self._mapped[name][-1]
+            return np.concatenate([self._mapped[name], base + tail[1:]])
+        return np.concatenate([self._mapped[name], tail])
+
+    def save(self, path: Path):
+        """
+        Write the store as flat files under path. Every file is written aside and
+        renamed into place, so stores mapped from an earlier save stay valid.
+        """
+        def write(name: str, write_fn: Callable):
+            tmp = path / (name + ".tmp")
+            with open(tmp, "wb") as f:
+                write_fn(f)
+            os.replace(tmp, path / name)
+
+        write(self.TEXT_FILE, lambda f: (f.write(self._text.data), f.write(self._tail_text)))
+        for name in itertools.chain(self.COLUMNS, self.RAGGED):
+            write(f"chunk_{name}.npy", lambda f: np.save(f, self._merged(name)))
+        tables = {'types': self.type_names, 'sources': self.source_names,
+                  'extra': {str(position): meta for position, meta in self.extra.items()}}
+        write(self.TABLES_FILE, lambda f: f.write(json.dumps(tables, default=str).encode("utf-8")))
+
+    @classmethod
+    def load(cls, path: Path) -> "ChunkStore":
+        """Memory-map a store written by save()"""
+        store = cls()
+        for name in itertools.chain(cls.COLUMNS, cls.RAGGED):
+            store._mapped[name] = np.load(path / f"chunk_{name}.npy", mmap_mode="r")
+        if store._mapped['offsets'][-1] > 0:
+            store._text = np.memmap(path / cls.TEXT_FILE, dtype=np.uint8, mode="r")
+        tables = json.loads((path / cls.TABLES_FILE).read_text(encoding="utf-8"))
+        store.type_names = tables['types']
+        store.source_names = tables['sources']
+        store._type_codes = {name: code for code, name in enumerate(store.type_names)}
+        store._source_codes = {name: code for code, name in enumerate(store.source_names)}
+        store.extra = {int(position): meta for position, meta in tables['extra'].items()}
+        return store
+
+"""# Embedding Cache
+   Content-addressed, disk-backed cache of chunk embeddings
+"""
+
+class EmbeddingCache:
+    """
+    Disk-backed cache of chunk embeddings keyed by a hash of the embedding model
+    name and the chunk text, so identical chunks are only encoded once across
+    indexing runs. Holds at most max_entries vectors, evicting least recently used.
+    """
+
+    def __init__(self, cache_dir: Union[str, Path], model_name: str, max_entries: int = 500_000):
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        cache_dir = Path(cache_dir)
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(cache_dir / "embeddings.sqlite"), check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, dim INTEGER NOT NULL, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON embeddings(last_used)")
+        self._conn.commit()
+        # Counted once here and kept up to date from row counts, never by scanning the table again
+        self.entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\x00{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """Look up embeddings; returns None for each text that is not cached"""
+        keys = [self._key(t) for t in texts]
+        found: Dict[str, np.ndarray] = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, dim, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})",
+                    batch,
+                ).fetchall()
+                for key, dim, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32, count=dim)
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, k) for k in found]
+                )
+                self._conn.commit()
+
+            results = [found.get(k) for k in keys]
+            hits = sum(r is not None for r in results)
+            self.hits += hits
+            self.misses += len(results) - hits
+        return results
+
+    def put_many(self, texts: List[str], vectors: np.ndarray):
+        """Store embeddings and evict the least recently used entries above the size bound"""
+        now = time.time()
+        rows = [
+            (self._key(t), int(v.shape[0]), np.ascontiguousarray(v, dtype=np.float32).tobytes(), now)
+            for t, v in zip(texts, vectors)
+        ]
+        with self._lock:
+            # A key already stored holds the same vector (the key hashes model and text), so
+            # only its last_used changes; the insert's row count is the number of new entries
+            self.entries += self._conn.executemany("INSERT OR IGNORE INTO embeddings VALUES (?, ?, ?, ?)",
+                                                   rows).rowcount
+            self._conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?",
+                                   [(now, key) for key, _, _, _ in rows])
+            overflow = self.entries - self.max_entries
+            if overflow > 0:
+                deleted = self._conn.execute(
+                    "DELETE FROM embeddings WHERE key IN "
+                    "(SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+                    (overflow,),
+                ).rowcount
+                self.entries -= deleted
+                self.evictions += deleted
+            self._conn.commit()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': self.entries,
+                'evictions': self.evictions,
+            }
+
+"""# Model Quantization
+   INT8 dynamic quantization of linear layers for CPU inference
+"""
+
+def model_size_bytes(model: torch.nn.Module) -> int:
+    """Serialized size of the model weights; unlike parameters() this counts packed int8 weights"""
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.getbuffer().nbytes
+
+def _conv1d_to_linear(model: torch.nn.Module) -> torch.nn.Module:
+    """
+    GPT-2 style models implement their projections with transformers' Conv1D
+    (a Linear with transposed weights), which dynamic quantization does not
+    recognise. Swap them for equivalent nn.Linear layers in place.
+    """
+    from transformers.pytorch_utils import Conv1D
+
+    for parent in list(model.modules()):
+        for name, child in list(parent.named_children()):
+            if isinstance(child, Conv1D):
+                in_features, out_features = child.weight.shape
+                linear = torch.nn.Linear(in_features, out_features, device=child.weight.device)
+                linear.weight.data = child.weight.data.t().contiguous()
+                linear.bias.data = child.bias.data
+                setattr(parent, name, linear)
+    return model
+
+def quantize_dynamic_int8(model: torch.nn.Module, device: str = "cpu") -> torch.nn.Module:
+    """
+    Replace the Linear layers of model with dynamically quantized int8 versions
+    (weights stored as int8, activations quantized per call). Only CPU kernels
+    exist, so on other devices the model is returned unchanged.
+
+    An output projection tied to the input embeddings (e.g. a GPT-2 lm_head) is
+    left in fp32: quantizing it would store a second copy of the embedding matrix.
+    """
+    if device != "cpu":
+        logger.warning("INT8 dynamic quantization needs CPU; keeping fp32 weights on %s", device)
+        return model
+
+    model.eval()
+    _conv1d_to_linear(model)
+    tied = set()
+    get_output = getattr(model, "get_output_embeddings", None)
+    get_input = getattr(model, "get_input_embeddings", None)
+    if get_output is not None and get_input is not None:
+        output, embeddings = get_output(), get_input()
+        if output is not None and embeddings is not None and output.weight is embeddings.weight:
+            tied.add(id(output))
+
+    spec = {
+        name: torch.ao.quantization.default_dynamic_qconfig
+        for name, module in model.named_modules()
+        if isinstance(module, torch.nn.Linear) and id(module) not in tied
+    }
+    return torch.ao.quantization.quantize_dynamic(model, spec, dtype=torch.qint8, inplace=True)
+
+"""# ONNX Runtime Backend
+   Embedding model and cross-encoder exported to ONNX and run with ONNX Runtime
+"""
+
+INFERENCE_BACKENDS = ("torch", "onnx")
+
+def onnx_model_path(cache_dir: Union[str, Path], kind: str, model_name: str, quantize: bool = False) -> Path:
+    digest = hashlib.sha256(model_name.encode("utf-8")).hexdigest()[:16]
+    return Path(cache_dir) / f"{kind}-{digest}{'-int8' if quantize else ''}.onnx"
+
+class _EmbeddingGraph(torch.nn.Module):
+    """SentenceTransformer forward (transformer, pooling, normalization) over positional inputs"""
+
+    def __init__(self, model: SentenceTransformer, input_names: List[str]):
+        super().__init__()
+        self.model = model
+        self.input_names = input_names
+
+    def forward(self, *inputs):
+        return self.model(dict(zip(self.input_names, inputs)))["sentence_embedding"]
+
+class _CrossEncoderGraph(torch.nn.Module):
+    """Cross-encoder logits followed by the activation CrossEncoder.predict applies"""
+
+    def __init__(self, model: torch.nn.Module, activation, input_names: List[str]):
+        super().__init__()
+        self.model = model
+        self.activation = activation
+        self.input_names = input_names
+
+    def forward(self, *inputs):
+        return self.activation(self.model(**dict(zip(self.input_names, inputs))).logits)
+
+class OnnxModel(ABC):
+    """
+    A Hugging Face tokenizer in front of an ONNX Runtime CPU session with all
+    graph optimizations enabled. The graph is exported from the loaded PyTorch
+    model the first time and cached on disk under a hash of the model name;
+    int8 variants come from the fp32 graph via ONNX Runtime dynamic quantization.
+    """
+
+    device = torch.device("cpu")
+    export_sample: List = []
+
+    def __init__(self, graph: torch.nn.Module, tokenizer, max_length: Optional[int], path: Path, quantize: bool):
+        self.tokenizer = tokenizer
+        self.max_length = max_length
+        self.input_names = list(tokenizer.model_input_names)
+        self.path = path
+        if not path.exists():
+            self._export(graph, path, quantize)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(str(path), options, providers=["CPUExecutionProvider"])
+        # The exporter drops inputs the graph never reads (e.g. unused token_type_ids)
+        self.session_inputs = [n for n in self.input_names if n in {i.name for i in self.session.get_inputs()}]
+
+    def _export(self, graph: torch.nn.Module, path: Path, quantize: bool):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fp32_path = path.with_name(path.name.replace("-int8", "")) if quantize else path
+        if not fp32_path.exists():
+            print(f"Exporting {type(self).__name__} to {fp32_path}")
+            sample = self._tokenize(self.export_sample, return_tensors="pt")
+            tmp_path = fp32_path.with_name(fp32_path.name + ".tmp")
+            axes = {name: {0: "batch", 1: "sequence"} for name in self.input_names}
+            graph.eval()
+            with torch.no_grad():
+                torch.onnx.export(
+                    graph, tuple(sample[name] for name in self.input_names), str(tmp_path),
+                    input_names=self.input_names, output_names=["output"],
+                    dynamic_axes={**axes, "output": {0: "batch"}}, opset_version=17, dynamo=False,
+                )
+            os.replace(tmp_path, fp32_path)
+        if quantize:
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+
+            tmp_path = path.with_name(path.name + ".tmp")
+            quantize_dynamic(str(fp32_path), str(tmp_path), weight_type=QuantType.QInt8)
+            os.replace(tmp_path, path)
+
+    @abstractmethod
+    def _tokenize(self, items: List, return_tensors: str):
+        """Tokenizer features for a batch of items"""
+
+    @abstractmethod
+    def _length(self, item) -> int:
+        """Approximate size of an item, used to batch items of similar length"""
+
+    def _run(self, items: List, batch_size: int) -> List[np.ndarray]:
+        """Run items through the session in batches of similar length; returns one output row per item"""
+        order = sorted(range(len(items)), key=lambda i: -self._length(items[i]))
+        outputs: List[Optional[np.ndarray]] = [None] * len(items)
+        for start in range(0, len(items), batch_size):
+            batch = order[start:start + batch_size]
+            features = self._tokenize([items[i] for i in batch], return_tensors="np")
+            feed = {name: features[name].astype(np.int64) for name in self.session_inputs}
+            for i, row in zip(batch, self.session.run(None, feed)[0]):
+                outputs[i] = row
+        return outputs
+
+class OnnxSentenceEncoder(OnnxModel):
+    """ONNX Runtime replacement for the SentenceTransformer calls the retriever makes"""
+
+    export_sample = ["Total revenue for fiscal 2023 was $4.2 billion.", "Net income"]
+
+    def __init__(self, model: SentenceTransformer, model_name: str, cache_dir: Union[str, Path],
+                 quantize: bool = False):
+        self.dimension = model.get_sentence_embedding_dimension()
+        tokenizer = model.tokenizer
+        super().__init__(
+            _EmbeddingGraph(model, list(tokenizer.model_input_names)), tokenizer, model.max_seq_length,
+            onnx_model_path(cache_dir, "embedding", model_name, quantize), quantize,
+        )
+
+    def _tokenize(self, items: List[str], return_tensors: str):
+        return self.tokenizer(items, padding=True, truncation="longest_first", max_length=self.max_length,
+                              return_tensors=return_tensors)
+
+    def _length(self, item: str) -> int:
+        return len(item)
+
+    def get_sentence_embedding_dimension(self) -> Optional[int]:
+        return self.dimension
+
+    def encode(self, sentences: Union[str, List[str]], batch_size: int = 32, show_progress_bar: bool = False,
+               convert_to_numpy: bool = True, normalize_embeddings: bool = False) -> np.ndarray:
+        single = isinstance(sentences, str)
+        rows = self._run([sentences] if single else list(sentences), batch_size)
+        embeddings = np.stack(rows).astype(np.float32) if rows else np.zeros((0, self.dimension), dtype=np.float32)
+        if normalize_embeddings:
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            embeddings = embeddings / np.maximum(norms, 1e-12)
+        return embeddings[0] if single else embeddings
+
+class OnnxCrossEncoder(OnnxModel):
+    """ONNX Runtime replacement for CrossEncoder.predict"""
+
+    export_sample = [("What was revenue in 2023?", "Total revenue for fiscal 2023 was $4.2 billion."),
+                     ("Net income", "Net income rose")]
+
+    def __init__(self, cross_encoder: CrossEncoder, model_name: str, cache_dir: Union[str, Path],
+                 quantize: bool = False):
+        # Attribute names differ across sentence-transformers releases
+        activation = (getattr(cross_encoder, "activation_fn", None)
+                      or getattr(cross_encoder, "default_activation_function", None)
+                      or torch.nn.Identity())
+        max_length = getattr(cross_encoder, "max_seq_length", None) or getattr(cross_encoder, "max_length", None)
+        tokenizer = cross_encoder.tokenizer
+        super().__init__(
+            _CrossEncoderGraph(cross_encoder.model, activation, list(tokenizer.model_input_names)), tokenizer,
+            max_length, onnx_model_path(cache_dir, "cross_encoder", model_name, quantize), quantize,
+        )
+
+    def _tokenize(self, items: List[Tuple[str, str]], return_tensors: str):
+        return self.tokenizer([q for q, _ in items], [d for _, d in items], padding=True,
+                              truncation="longest_first", max_length=self.max_length, return_tensors=return_tensors)
+
+    def _length(self, item: Tuple[str, str]) -> int:
+        return len(item[0]) + len(item[1])
+
+    def predict(self, sentences: List[Tuple[str, str]], batch_size: int = 32, **kwargs) -> np.ndarray:
+        rows = self._run(list(sentences), batch_size)
+        if not rows:
+            return np.zeros(0, dtype=np.float32)
+        scores = np.stack(rows).astype(np.float32)
+        return scores[:, 0] if scores.shape[1] == 1 else scores
+
+"""# Model Loading
+   Models load on first use, or concurrently through preload
+"""
+
+class LazyModel:
+    """
+    A model that is loaded on first use instead of at construction. get()
+    runs the loader once; threads calling it meanwhile wait for that load and
+    share its result. A failed load is raised to its callers and retried by
+    the next get().
+    """
+
+    def __init__(self, name: str, loader: Callable[[], object]):
+        self.name = name
+        self._loader = loader
+        self._lock = threading.Lock()
+        self._model = None
+        self._loading = False
+        self.load_seconds: Optional[float] = None
+        self.error: Optional[str] = None
+
+    @classmethod
+    def loaded(cls, name: str, model) -> "LazyModel":
+        """A LazyModel wrapping an already loaded model"""
+        lazy = cls(name, lambda: model)
+        lazy._model = model
+        lazy.load_seconds = 0.0
+        return lazy
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._model is not None
+
+    def get(self):
+        model = self._model
+        if model is not None:
+            return model
+        with self._lock:
+            if self._model is None:
+                self._loading = True
+                start = time.perf_counter()
+                try:
+                    with span("load_model", model=self.name):
+                        self._model = self._loader()
+                except Exception as e:
+                    self.error = str(e)
+                    raise
+                finally:
+                    self._loading = False
+                self.error = None
+                self.load_seconds = time.perf_counter() - start
+                logger.info("Loaded %s in %.2f s", self.name, self.load_seconds)
+            return self._model
+
+    def status(self) -> Dict:
+        """'cold' (not loaded yet), 'loading', 'warm' or 'failed', with the load time or error"""
+        if self._model is not None:
+            state = "warm"
+        elif self._loading:
+            state = "loading"
+        else:
+            state = "failed" if self.error else "cold"
+        return {'state': state, 'load_seconds': self.load_seconds, 'error': self.error}
+
+
+def preload_models(models: List[LazyModel], wait: bool = True, max_workers: Optional[int] = None):
+    """
+    Load the models that are not loaded yet concurrently on a thread pool, so
+    the wait is about the slowest load rather than the sum of all of them.
+    With wait=False it returns at once; failures then show in status() and
+    are raised again by the first get().
+    """
+    cold = [model for model in models if not model.is_loaded]
+    if not cold:
+        return
+    pool = ThreadPoolExecutor(max_workers=max_workers or len(cold), thread_name_prefix="model-preload")
+    futures = [pool.submit(model.get) for model in cold]
+    pool.shutdown(wait=False)
+    if wait:
+        for future in futures:
+            future.result()
+
 """   # Multi Stage Retrieval
-    
+
     Advanced RAG Technique: Multi-Stage Retrieval
     Stage 1: Broad retrieval using hybrid search
     Stage 2: Precise re-ranking using cross-encoder
 """
 
+class ReadWriteLock:
+    """
+    Many concurrent readers or one writer. A waiting writer blocks new readers,
+    so a stream of queries cannot starve an index update. Not reentrant.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+
+class IndexingCancelled(Exception):
+    """An index build was stopped through its cancel event; the previous index is untouched"""
+
+
+@dataclass
+class IndexGeneration:
+    """
+    Everything a query reads from one build of the index. A rebuild fills a new
+    generation off to the side and publishes it with a single reference
+    assignment, so a query that took a generation keeps consistent documents,
+    metadata and FAISS/BM25 ids even if a swap happens mid-query.
+    """
+    dense_index: Optional[faiss.Index] = None
+    dense_index_type: Optional[str] = None
+    sparse_index: Optional[InvertedIndexBM25] = None
+    fact_index: FinancialFactIndex = field(default_factory=FinancialFactIndex)
+    # Chunk ids are positions in chunks; removed chunks keep their slot and
+    # are tombstoned in deleted_ids so ids stay stable across updates
+    chunks: ChunkStore = field(default_factory=ChunkStore)
+    deleted_ids: set = field(default_factory=set)
+    # Tombstoned ids still present in the dense index (not physically removed)
+    dense_tombstones: int = 0
+    # Identifies what chunk ids refer to; a new generation always gets a new
+    # version, incremental add/remove keep it
+    version: int = field(default_factory=lambda: next(_INDEX_VERSIONS))
+    # Searches hold the read side, in-place add/remove the write side
+    lock: ReadWriteLock = field(default_factory=ReadWriteLock, repr=False, compare=False)
+
+    @property
+    def live_count(self) -> int:
+        return len(self.chunks) - len(self.deleted_ids)
+
+    def memory_bytes(self) -> int:
+        """
+        Estimated resident size: vectors (plus HNSW links), BM25 postings and the
+        in-memory part of the chunk store. Used for memory budgets, so cheap
+        rather than exact.
+        """
+        total = 0
+        if self.dense_index is not None:
+            index = self.dense_index
+            if isinstance(index, faiss.IndexIDMap):
+                total += index.ntotal * 8  # id map
+                index = faiss.downcast_index(index.index)
+            if isinstance(index, faiss.IndexHNSW):
+                total += index.ntotal * index.hnsw.nb_neighbors(0) * 2 * 4
+                index = faiss.downcast_index(index.storage)
+            total += index.ntotal * index.code_size
+        if self.sparse_index is not None:
+            total += self.sparse_index.memory_bytes()
+        return total + self.chunks.memory_bytes()
+
+
 class MultiStageRetriever:
     """
     Advanced RAG Technique: Multi-Stage Retrieval
@@ -671,28 +2224,159 @@ class MultiStageRetriever:
     def __init__(self, config: RAGConfig):
         self.config = config
 
-        print("Loading retrieval models...")
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.embedding_model = SentenceTransformer(config.embedding_model, device=device)
-        self.cross_encoder = CrossEncoder(config.cross_encoder_model, device=device)
+        if config.inference_backend not in INFERENCE_BACKENDS:
+            raise ValueError(
+                f"Unknown inference_backend '{config.inference_backend}' (expected one of {INFERENCE_BACKENDS})"
+            )
+        if config.fusion_strategy not in FUSION_STRATEGIES:
+            raise ValueError(
+                f"Unknown fusion_strategy '{config.fusion_strategy}' (expected one of {FUSION_STRATEGIES})"
+            )
+        use_onnx = config.inference_backend == "onnx"
+        if use_onnx and not HAS_ONNXRUNTIME:
+            logger.warning("onnxruntime is not installed (pip install onnxruntime onnx); using the torch backend")
+            use_onnx = False
+
+        # ONNX graphs are exported from (and run on) CPU
+        self.device = "cuda" if torch.cuda.is_available() and not use_onnx else "cpu"
+        self.use_onnx = use_onnx
+        # Models load on first use (see LazyModel)
+        self._embedding_model = LazyModel("embedding_model", self._load_embedding_model)
+        self._cross_encoder = LazyModel("cross_encoder",
+                                        lambda: self._load_cross_encoder(config.cross_encoder_model))
+        # Optional cheaper reranker that narrows the candidates before the cross-encoder
+        self._first_pass_reranker = None
+        if config.first_pass_reranker_model:
+            self._first_pass_reranker = LazyModel(
+                "first_pass_reranker", lambda: self._load_cross_encoder(config.first_pass_reranker_model))
+        self.cascade_stats = {'skipped': 0, 'first_pass': 0, 'full': 0}
+        self._stats_lock = threading.Lock()
+
+        self.embedding_cache = None
+        if config.embedding_cache_dir:
+            # Quantized embeddings differ slightly, so they get their own cache namespace
+            self.embedding_cache = EmbeddingCache(
+                config.embedding_cache_dir, self.embedding_space, config.embedding_cache_max_entries
+            )
 
-        self.dense_index = None
-        self.sparse_index = None
-        self.documents: List[str] = []
-        self.metadata: List[Dict] = []
-        self.scores = []
+        # The published index; replaced as a whole by rebuilds and snapshot loads.
+        # Other generations (e.g. named indexes) can be passed to the query methods.
+        self.generation = IndexGeneration()
 
-        print("Multi-stage retriever initialized")
+        # In-process memos: query text -> embedding, (query, chunk id, index version) -> score
+        self.query_embedding_memo = LRUCache(config.query_memo_max_entries)
+        self.rerank_memo = LRUCache(config.rerank_memo_max_entries)
 
-    def build_indices(self, documents: List[str], metadata: Optional[List[Dict]] = None):
-        """Build both dense and sparse indices"""
-        print(f"Building indices for {len(documents)} documents...")
+        print("Multi-stage retriever initialized")
 
-        # Normalize documents -> always text
+    def _load_embedding_model(self):
+        print(f"Loading embedding model: {self.config.embedding_model}")
+        embedding_model = SentenceTransformer(self.config.embedding_model, device=self.device)
+        if self.use_onnx:
+            return OnnxSentenceEncoder(
+                embedding_model, self.config.embedding_model, self.config.onnx_cache_dir,
+                self.config.quantize_embedding_model
+            )
+        if self.config.quantize_embedding_model:
+            return quantize_dynamic_int8(embedding_model, self.device)
+        return embedding_model
+
+    def _load_cross_encoder(self, model_name: str):
+        print(f"Loading cross-encoder: {model_name}")
+        cross_encoder = CrossEncoder(model_name, device=self.device)
+        if self.use_onnx:
+            return OnnxCrossEncoder(cross_encoder, model_name, self.config.onnx_cache_dir,
+                                    self.config.quantize_cross_encoder)
+        if self.config.quantize_cross_encoder:
+            # Recent sentence-transformers CrossEncoders are modules; older ones wrap a model
+            if isinstance(cross_encoder, torch.nn.Module):
+                return quantize_dynamic_int8(cross_encoder, self.device)
+            cross_encoder.model = quantize_dynamic_int8(cross_encoder.model, self.device)
+        return cross_encoder
+
+    @property
+    def embedding_model(self):
+        return self._embedding_model.get()
+
+    @embedding_model.setter
+    def embedding_model(self, model):
+        self._embedding_model = LazyModel.loaded("embedding_model", model)
+
+    @property
+    def cross_encoder(self):
+        return self._cross_encoder.get()
+
+    @cross_encoder.setter
+    def cross_encoder(self, model):
+        self._cross_encoder = LazyModel.loaded("cross_encoder", model)
+
+    @property
+    def first_pass_reranker(self):
+        return self._first_pass_reranker.get() if self._first_pass_reranker is not None else None
+
+    @first_pass_reranker.setter
+    def first_pass_reranker(self, model):
+        self._first_pass_reranker = LazyModel.loaded("first_pass_reranker", model) if model is not None else None
+
+    @property
+    def models(self) -> List[LazyModel]:
+        """The retriever's models, loaded or not"""
+        return [model for model in (self._embedding_model, self._cross_encoder, self._first_pass_reranker)
+                if model is not None]
+
+    @property
+    def embedding_space(self) -> str:
+        """Embedding model name, tagged when int8-quantized (its vectors differ from the fp32 model's)"""
+        # Known without loading the model: quantization only applies on CPU
+        if self.config.quantize_embedding_model and self.device == "cpu":
+            # ONNX Runtime and PyTorch quantize differently
+            backend = "onnx-" if self.use_onnx else ""
+            return f"{self.config.embedding_model}@{backend}int8"
+        return self.config.embedding_model
+
+    # Read access to the published generation, for callers that do not need a
+    # consistent view across several attributes
+    @property
+    def chunks(self) -> ChunkStore:
+        return self.generation.chunks
+
+    @property
+    def dense_index(self):
+        return self.generation.dense_index
+
+    @property
+    def dense_index_type(self) -> Optional[str]:
+        return self.generation.dense_index_type
+
+    @property
+    def sparse_index(self):
+        return self.generation.sparse_index
+
+    @property
+    def fact_index(self) -> FinancialFactIndex:
+        return self.generation.fact_index
+
+    @property
+    def deleted_ids(self) -> set:
+        return self.generation.deleted_ids
+
+    @property
+    def index_version(self) -> int:
+        return self.generation.version
+
+    @property
+    def live_count(self) -> int:
+        """Number of indexed chunks that have not been removed"""
+        return self.generation.live_count
+
+    def _normalize_documents(self, documents: List[Union[str, Dict]], start_id: int,
+                             metadata: Optional[List[Dict]] = None) -> Tuple[List[str], List[Dict]]:
+        """Normalize documents -> always text, with one metadata dict per chunk"""
         flat_docs = []
         enriched_metadata = []
 
-        for i, doc in enumerate(documents):
+        for offset, doc in enumerate(documents):
+          i = start_id + offset
           if isinstance(doc, dict):
              if 'text' in doc:
                 flat_docs.append(doc['text'])
@@ -705,39 +2389,315 @@ class MultiStageRetriever:
             flat_docs.append(doc)
             meta={'id': i, 'type': 'paragraph', 'preview': str(doc)[:100]}
 
-
-          meta['score'] = 0.0
+          if metadata is not None:
+            meta = {'id': i, **metadata[offset]}
           enriched_metadata.append(meta)
 
-        self.documents = flat_docs
-        self.metadata = metadata if metadata is not None else enriched_metadata
-        # Initialize default score for each document
-        self.scores = [0.0 for _ in self.documents]
+        return flat_docs, enriched_metadata
 
+    def _encode_documents(self, texts: List[str]) -> np.ndarray:
+        """
+        Embed chunk texts. Identical texts are encoded once, and cached embeddings
+        are reused so only unseen chunks go through the transformer.
+        """
+        unique_texts = list(dict.fromkeys(texts))
+        vectors: Dict[str, np.ndarray] = {}
+
+        if self.embedding_cache is not None:
+            for text, vec in zip(unique_texts, self.embedding_cache.get_many(unique_texts)):
+                if vec is not None:
+                    vectors[text] = vec
+        to_encode = [t for t in unique_texts if t not in vectors]
+
+        if to_encode:
+            encoded = self.embedding_model.encode(
+                to_encode,
+                batch_size=self.config.batch_size,
+                show_progress_bar=False,
+                convert_to_numpy=True,
+                normalize_embeddings=True,  # cosine via inner product
+            ).astype(np.float32)
+            vectors.update(zip(to_encode, encoded))
+            if self.embedding_cache is not None:
+                self.embedding_cache.put_many(to_encode, encoded)
+
+        print(f"Encoded {len(to_encode)} of {len(texts)} chunks "
+              f"({len(texts) - len(to_encode)} reused from duplicates or cache)")
+        return np.stack([vectors[t] for t in texts]).astype(np.float32)
 
+    def build_indices(self, documents: List[str], metadata: Optional[List[Dict]] = None):
+        """Build both dense and sparse indices from scratch"""
+        print(f"Building indices for {len(documents)} documents...")
+        return self.build_indices_from_batches([(documents, metadata)])
 
-        print("Creating embeddings...")
-         # Dense index (FAISS)
-        embeddings = self.embedding_model.encode(
-            self.documents,
-            batch_size=self.config.batch_size,
-            show_progress_bar=False,
-            convert_to_numpy=True,
-            normalize_embeddings=True,  # cosine via inner product
-        ).astype(np.float32)
+    def build_indices_from_batches(self, batches: Iterable[Tuple[List[str], List[Dict]]],
+                                   progress: Optional[Callable[[int], None]] = None,
+                                   cancel_event: Optional[threading.Event] = None) -> int:
+        """
+        Build the indices from scratch while the corpus is still arriving and
+        publish them once complete; the published generation keeps serving
+        queries until then. See build_generation for the arguments.
+        """
+        self.generation = self.build_generation(batches, progress, cancel_event)
+        return len(self.generation.chunks)
 
-        dimension = embeddings.shape[1]
-        self.dense_index = faiss.IndexFlatIP(dimension)
-        self.dense_index.add(embeddings)
+    def build_generation(self, batches: Iterable[Tuple[List[str], List[Dict]]],
+                         progress: Optional[Callable[[int], None]] = None,
+                         cancel_event: Optional[threading.Event] = None) -> IndexGeneration:
+        """
+        Build a new, unpublished IndexGeneration: each (chunks, metadata) batch is
+        embedded and added to BM25 as soon as it is pulled. The FAISS index is
+        created once at the end so IVF training and the "auto" index type see
+        the whole corpus. progress is called with the number of chunks embedded
+        so far. Setting cancel_event stops the build between batches with
+        IndexingCancelled.
+        """
+        gen = IndexGeneration()
+        embeddings = []
+        for documents, metadata in batches:
+            if cancel_event is not None and cancel_event.is_set():
+                raise IndexingCancelled()
+            if not documents:
+                continue
+            flat_docs, enriched_metadata = self._normalize_documents(documents, len(gen.chunks), metadata)
+            print(f"Creating embeddings for {len(flat_docs)} chunks...")
+            embeddings.append(self._encode_documents(flat_docs))
+
+            tokenized_docs = [doc.lower().split() for doc in flat_docs]
+            if gen.sparse_index is None:
+                gen.sparse_index = InvertedIndexBM25(tokenized_docs, prune=self.config.bm25_pruning)
+            else:
+                gen.sparse_index.add_documents(tokenized_docs)
+            gen.fact_index.add_chunks(gen.chunks.append(flat_docs, enriched_metadata), flat_docs)
+            if progress is not None:
+                progress(len(gen.chunks))
+
+        if cancel_event is not None and cancel_event.is_set():
+            raise IndexingCancelled()
+        if embeddings:
+            embeddings = np.vstack(embeddings)
+            gen.dense_index, gen.dense_index_type = create_dense_index(embeddings, self.config)
+            print(f"Dense index type: {gen.dense_index_type}")
+            gen.dense_index.add_with_ids(embeddings, np.arange(len(gen.chunks), dtype=np.int64))
+            gen.sparse_index.flush()
+
+        print(f"Indices built: {len(gen.chunks)} documents indexed")
+        return gen
+
+    def add_documents(self, documents: List[Union[str, Dict]], metadata: Optional[List[Dict]] = None,
+                      generation: Optional[IndexGeneration] = None) -> List[int]:
+        """
+        Incrementally index new chunks into `generation` (default: the published
+        one). Only the new chunks are embedded; they are appended to the
+        ID-mapped FAISS index and folded into the BM25 statistics.
+        Returns the ids assigned to the new chunks.
+        """
+        if not documents:
+            return []
 
-        # Sparse index (BM25)
-        print("Building BM25 index...")
-        tokenized_docs = [doc.lower().split() for doc in self.documents]
-        self.sparse_index = BM25Okapi(tokenized_docs)
+        flat_docs, _ = self._normalize_documents(documents, 0, metadata)
+        print(f"Creating embeddings for {len(flat_docs)} chunks...")
+        # Embedding is the slow part and needs no lock; queries keep running meanwhile
+        embeddings = self._encode_documents(flat_docs)
+        tokenized_docs = [doc.lower().split() for doc in flat_docs]
+
+        gen = generation or self.generation
+        with gen.lock.write():
+            start_id = len(gen.chunks)
+            _, enriched_metadata = self._normalize_documents(documents, start_id, metadata)
+            ids = np.arange(start_id, start_id + len(flat_docs), dtype=np.int64)
+
+            # Dense index (FAISS), ids map back to positions in gen.chunks
+            if gen.dense_index is None:
+                gen.dense_index, gen.dense_index_type = create_dense_index(embeddings, self.config)
+                print(f"Dense index type: {gen.dense_index_type}")
+            self._check_dimension(gen, embeddings)
+            gen.dense_index.add_with_ids(embeddings, ids)
+
+            # Sparse index (BM25)
+            if gen.sparse_index is None:
+                gen.sparse_index = InvertedIndexBM25(tokenized_docs, prune=self.config.bm25_pruning)
+            else:
+                gen.sparse_index.add_documents(tokenized_docs)
+            gen.fact_index.add_chunks(ids.tolist(), flat_docs)
+            gen.sparse_index.flush()
+            gen.chunks.append(flat_docs, enriched_metadata)
+        return ids.tolist()
+
+    def remove_documents(self, ids: List[int], generation: Optional[IndexGeneration] = None) -> int:
+        """Tombstone chunks by id and drop them from the dense and sparse indices"""
+        gen = generation or self.generation
+        with gen.lock.write():
+            ids = [int(i) for i in ids if 0 <= int(i) < len(gen.chunks) and int(i) not in gen.deleted_ids]
+            if not ids:
+                return 0
+
+            gen.deleted_ids.update(ids)
+            gen.sparse_index.remove_documents(ids)
+            gen.sparse_index.flush()
+            gen.fact_index.remove_chunks(ids)
+            try:
+                gen.dense_index.remove_ids(np.array(ids, dtype=np.int64))
+            except RuntimeError:
+                # Index type without removal support: results are filtered at query time
+                gen.dense_tombstones += len(ids)
+
+        print(f"Removed {len(ids)} chunks ({gen.live_count} remaining)")
+        return len(ids)
+
+    def remove_source(self, source: Union[str, Path], generation: Optional[IndexGeneration] = None) -> int:
+        """Remove every chunk whose metadata 'source' matches the given file path"""
+        gen = generation or self.generation
+        ids = [i for i in gen.chunks.positions_with_source(str(source)).tolist() if i not in gen.deleted_ids]
+        return self.remove_documents(ids, gen)
+
+    def save_index(self, path: Union[str, Path], extra: Optional[Dict] = None,
+                   generation: Optional[IndexGeneration] = None) -> Path:
+        """
+        Persist a snapshot of `generation` (default: the published indices) to a
+        directory. The snapshot holds the FAISS index, the BM25 statistics, the
+        chunk store and the config used to build it. It is written into a
+        sibling directory that then replaces `path`, so a reader sees either the
+        previous snapshot or the new one, never files mixed from both.
+        """
+        gen = generation or self.generation
+        with gen.lock.read():
+            return self._save_generation(gen, Path(path), extra)
+
+    def _save_generation(self, gen: IndexGeneration, path: Path, extra: Optional[Dict]) -> Path:
+        if gen.dense_index is None or gen.sparse_index is None:
+            raise RuntimeError("No indices to save. Build indices first.")
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        print(f"Saving index snapshot to {path}...")
+        suffix = f"{os.getpid()}-{threading.get_ident()}"
+        staging, retired = path.with_name(f".{path.name}.saving-{suffix}"), path.with_name(f".{path.name}.old-{suffix}")
+        for leftover in (staging, retired):  # from a crashed save
+            shutil.rmtree(leftover, ignore_errors=True)
+        staging.mkdir()
+        try:
+            self._write_snapshot(gen, staging, extra)
+            if path.exists():
+                # Stores mapped from the previous snapshot keep their (unlinked) files
+                os.replace(path, retired)
+                os.replace(staging, path)
+                shutil.rmtree(retired, ignore_errors=True)
+            else:
+                os.replace(staging, path)
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+
+        print(f"Index snapshot saved: {gen.live_count} documents")
+        return path
+
+    def _write_snapshot(self, gen: IndexGeneration, path: Path, extra: Optional[Dict]):
+        faiss.write_index(gen.dense_index, str(path / "dense.faiss"))
+        with open(path / "sparse.pkl", "wb") as f:
+            pickle.dump(gen.sparse_index, f, protocol=pickle.HIGHEST_PROTOCOL)
+        gen.chunks.save(path)
+        with open(path / "chunks.json", "w", encoding="utf-8") as f:
+            json.dump({
+                "num_chunks": len(gen.chunks),
+                "deleted_ids": sorted(gen.deleted_ids),
+                "dense_tombstones": gen.dense_tombstones,
+            }, f)
+
+        manifest = {
+            "version": INDEX_SNAPSHOT_VERSION,
+            "created_at": time.time(),
+            "num_documents": gen.live_count,
+            "dimension": int(gen.dense_index.d),
+            "embedding_space": self.embedding_space,
+            "config": asdict(self.config),
+            "extra": extra or {},
+        }
+        (path / INDEX_MANIFEST_FILE).write_text(json.dumps(manifest, indent=2, default=str), encoding="utf-8")
+
+    def load_index(self, path: Union[str, Path]) -> Dict:
+        """
+        Load a snapshot written by save_index, replacing the current indices.
+        Raises ValueError if the snapshot is missing or was built with an
+        incompatible format or embedding model. Returns the snapshot manifest.
+        """
+        self.generation, manifest = self.load_generation(path)
+        return manifest
+
+    def load_generation(self, path: Union[str, Path]) -> Tuple[IndexGeneration, Dict]:
+        """Load a snapshot as a new, unpublished IndexGeneration; returns it with the manifest"""
+        path = Path(path)
+        manifest_path = path / INDEX_MANIFEST_FILE
+        if not manifest_path.exists():
+            raise ValueError(f"No index snapshot found at {path}")
+
+        manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+        self._check_snapshot_compatibility(manifest)
+
+        print(f"Loading index snapshot from {path}...")
+        dense_index = faiss.read_index(str(path / "dense.faiss"))
+        with open(path / "sparse.pkl", "rb") as f:
+            sparse_index = pickle.load(f)
+        with open(path / "chunks.json", "r", encoding="utf-8") as f:
+            chunks = json.load(f)
+        chunk_store = ChunkStore.load(path)
+        if len(chunk_store) != chunks["num_chunks"]:
+            raise ValueError(f"Corrupt index snapshot: {len(chunk_store)} chunks, expected {chunks['num_chunks']}")
+
+        expected_vectors = (len(chunk_store) - len(chunks["deleted_ids"])
+                            + chunks["dense_tombstones"])
+        if dense_index.ntotal != expected_vectors:
+            raise ValueError(
+                f"Corrupt index snapshot: {dense_index.ntotal} vectors, expected {expected_vectors}"
+            )
+
+        gen = IndexGeneration(
+            dense_index=dense_index,
+            dense_index_type=detect_dense_index_type(dense_index),
+            sparse_index=sparse_index,
+            chunks=chunk_store,
+            deleted_ids=set(chunks["deleted_ids"]),
+            dense_tombstones=chunks["dense_tombstones"],
+        )
+        # Facts are cheap to re-extract, so they are not stored in the snapshot
+        live_ids = [i for i in range(len(chunk_store)) if i not in gen.deleted_ids]
+        gen.fact_index.add_chunks(live_ids, (chunk_store.text(i) for i in live_ids))
+        sparse_index.flush()
+
+        print(f"Index snapshot loaded: {gen.live_count} documents")
+        return gen, manifest
+
+    def _check_snapshot_compatibility(self, manifest: Dict):
+        """Reject snapshots whose format or embedding space differs from the running config"""
+        version = manifest.get("version")
+        if version != INDEX_SNAPSHOT_VERSION:
+            raise ValueError(
+                f"Incompatible index snapshot version {version} (expected {INDEX_SNAPSHOT_VERSION})"
+            )
+
+        snapshot_model = manifest.get("embedding_space") or manifest.get("config", {}).get("embedding_model")
+        if snapshot_model != self.embedding_space:
+            raise ValueError(
+                f"Index snapshot was built with embedding model '{snapshot_model}', "
+                f"but the pipeline uses '{self.embedding_space}'"
+            )
+
+        # Loading the embedding model just to compare dimensions would defeat lazy loading;
+        # a cold model's vectors are checked against the index when they are first searched or added
+        if self._embedding_model.is_loaded:
+            dimension = self.embedding_model.get_sentence_embedding_dimension()
+            if dimension is not None and manifest.get("dimension") != dimension:
+                raise ValueError(
+                    f"Index snapshot dimension {manifest.get('dimension')} does not match model dimension {dimension}"
+                )
+
+    @staticmethod
+    def _check_dimension(gen: IndexGeneration, embeddings: np.ndarray):
+        """Reject embeddings whose dimension differs from the generation's dense index"""
+        if gen.dense_index is not None and embeddings.shape[1] != gen.dense_index.d:
+            raise ValueError(
+                f"Index dimension {gen.dense_index.d} does not match model dimension {embeddings.shape[1]}"
+            )
 
-        print(f"Indices built: {len(documents)} documents indexed")
-        return len(documents)
-        
     def _revenue_boost(self, query: str, docs: List[Dict]) -> List[Dict]:
         """Boost docs mentioning revenue + numbers when query relates to revenue/financials"""
         if not re.search(r"\brevenue|income|sales|earnings\b", query.lower()):
@@ -771,185 +2731,366 @@ class MultiStageRetriever:
             elif re.search(r"\b(income|profit|sales|total)\b", text, re.IGNORECASE):
                 score += 0.02
 
-            d['score'] = score  # ensure score is always set
             boosted.append({**d, "score": score})
 
         # Re-sort by boosted score
         boosted = sorted(boosted, key=lambda x: x["score"], reverse=True)
 
-        print("[DEBUG] Revenue Boosted documents ",boosted)
+        logger.debug("Revenue boosted documents: %s", boosted)
         return boosted
 
-    def stage1_broad_retrieval(self, query: str, k: Optional[int] = None) -> List[Dict]:
-        k = k or self.config.initial_retrieval_k
-
-        query_embedding = self.embedding_model.encode(
-               [query],
-               convert_to_numpy=True,
-               normalize_embeddings=True
-               ).astype(np.float32)
-
-        print("[DEBUG] Query:", query)
-        print("[DEBUG] Query embedding norm:", np.linalg.norm(query_embedding))
-
-        dense_scores, dense_indices = self.dense_index.search(
-            query_embedding,
-            min(k, len(self.documents))
-            )
-
-        print("[DEBUG] Dense scores:", dense_scores)
-        print("[DEBUG] Dense indices:", dense_indices)
-
-        dense_results = []
-
-        for score, idx in zip(dense_scores[0], dense_indices[0]):
-            if 0 <= idx < len(self.documents):
-                dense_results.append({
-                    'index': int(idx),
-                    'dense_score': float(score),
-                    'sparse_score': 0.0,
-                    'text': self.documents[idx],
-                    'metadata': self.metadata[idx]
-                })
-
-
-        # Sparse retrieval (BM25)
-        query_tokens = query.lower().split()
-        sparse_scores = self.sparse_index.get_scores(query_tokens)
-
-
-        print("[DEBUG] Query tokens:", query_tokens)
-        print("[DEBUG] Sparse scores (first 10):", sparse_scores[:10] if sparse_scores is not None else None)
-
-        if sparse_scores is None or len(sparse_scores) == 0:
-            sparse_top_indices = []
-        else:
-            sparse_top_indices = np.argsort(sparse_scores)[::-1][:k]
-
-        alpha = self.config.hybrid_alpha
-        combined_results: Dict[int, Dict] = {}
-
-        for result in dense_results:
-            combined_results[result['index']] = result
-
-        for idx in sparse_top_indices:
-            sparse_score = float(sparse_scores[idx])
-            if idx in combined_results:
-                combined_results[idx]['sparse_score'] = sparse_score
-            else:
-                combined_results[idx] = {
-                    'index': int(idx),
-                    'dense_score': 0.0,
-                    'sparse_score': sparse_score,
-                    'text': self.documents[idx],
-                    'metadata': self.metadata[idx]
-                }
-
-        # Normalize sparse scores
-        max_sparse = float(max(sparse_scores)) if isinstance(sparse_scores, (list, np.ndarray)) and len(sparse_scores) > 0 else 1.0
-        max_sparse = max(max_sparse, 1e-8)
-
-        for r in combined_results.values():
-            dense_norm = r['dense_score']  # already cosine-ish
-            sparse_norm = r['sparse_score'] / max_sparse
-            r['hybrid_score'] = alpha * dense_norm + (1 - alpha) * sparse_norm
-            r['score'] = r['hybrid_score']
-            r['stage'] = 'broad_retrieval'
-
-        sorted_results = sorted(combined_results.values(), key=lambda x: x['hybrid_score'], reverse=True)
-        print("[DEBUG] Combined results (top 5):", sorted_results[:5])
-
-
-        return sorted_results[:k]
+    def encode_queries(self, queries: List[str]) -> np.ndarray:
+        """Embed a batch of queries; only texts missing from the memo go to the model, in one call"""
+        embeddings = [self.query_embedding_memo.get(q) for q in queries]
+        misses = list(dict.fromkeys(q for q, e in zip(queries, embeddings) if e is None))
+        if misses:
+            encoded = self.embedding_model.encode(
+                   misses,
+                   batch_size=self.config.batch_size,
+                   convert_to_numpy=True,
+                   normalize_embeddings=True
+                   ).astype(np.float32)
+            fresh = dict(zip(misses, encoded))
+            for q, e in fresh.items():
+                self.query_embedding_memo.put(q, e)
+            embeddings = [fresh[q] if e is None else e for q, e in zip(queries, embeddings)]
+        return np.stack(embeddings)
+
+    def stage1_broad_retrieval(self, query: str, k: Optional[int] = None, nprobe: Optional[int] = None,
+                               ef_search: Optional[int] = None) -> List[Dict]:
+        """
+        Hybrid dense + BM25 retrieval. nprobe/ef_search override the configured
+        IVF/HNSW search effort for this query (ignored for a flat index).
+        """
+        return self.stage1_broad_retrieval_batch([query], k, nprobe, ef_search)[0]
 
-    def stage2_precise_reranking(self, query: str, candidates: List[Dict], k: Optional[int] = None) -> List[Dict]:
-        k = k or self.config.final_retrieval_k
-        if not candidates:
+    def stage1_broad_retrieval_batch(self, queries: List[str], k: Optional[int] = None,
+                                     nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+                                     generation: Optional[IndexGeneration] = None,
+                                     query_embeddings: Optional[np.ndarray] = None) -> List[List[Dict]]:
+        """
+        Stage 1 for many queries: one encode call and one FAISS search with a query
+        matrix, against `generation` (default: the published one). Pass
+        query_embeddings (encode_queries of the same texts) to skip the encode.
+        """
+        k = k or self.config.initial_retrieval_k
+        if not queries:
             return []
+        gen = generation or self.generation
+
+        logger.debug("Queries: %s", queries)
+
+        # In-place add/remove may not run while FAISS and BM25 are being searched
+        with gen.lock.read():
+            with span("dense_search", queries=len(queries)):
+                if query_embeddings is None:
+                    query_embeddings = self.encode_queries(queries)
+                self._check_dimension(gen, query_embeddings)
+
+                # Over-fetch by the tombstones still in the dense index so k live results remain
+                dense_k = min(k + gen.dense_tombstones, gen.dense_index.ntotal)
+                dense_scores, dense_indices = gen.dense_index.search(
+                    query_embeddings,
+                    dense_k,
+                    params=dense_search_params(gen.dense_index_type, self.config, dense_k, nprobe, ef_search)
+                    )
+
+            logger.debug("Dense scores: %s indices: %s", dense_scores, dense_indices)
+
+            # Sparse retrieval (BM25): inverted-index top-k, removed chunks are never returned
+            with span("bm25", queries=len(queries)):
+                sparse_hits = [gen.sparse_index.top_k(query.lower().split(), k) for query in queries]
+
+            with span("fusion", queries=len(queries)):
+                return [
+                    self._hybrid_fusion(gen, dense_scores[row], dense_indices[row], *sparse_hits[row], k)
+                    for row in range(len(queries))
+                ]
+
+    def _hybrid_fusion(self, gen: IndexGeneration, dense_scores: np.ndarray, dense_indices: np.ndarray,
+                       sparse_top_indices: np.ndarray, sparse_top_scores: np.ndarray, k: int) -> List[Dict]:
+        """
+        Combine one query's dense hits with its BM25 top-k into hybrid-scored
+        candidates with config.fusion_strategy. Larger candidate sets are scored
+        on arrays and dicts built for the top k only. Candidates carry chunk ids, not texts;
+        the stages that need a text read it from the chunk store.
+        """
+        valid = (dense_indices >= 0) & (dense_indices < len(gen.chunks))
+        if gen.dense_tombstones:
+            # Removed chunks that the dense index could not drop
+            valid &= ~np.isin(dense_indices, np.fromiter(gen.deleted_ids, dtype=np.int64, count=len(gen.deleted_ids)))
+        dense_ids, dense_scores = dense_indices[valid][:k], dense_scores[valid][:k]
+
+        results = fuse_candidates(
+            dense_ids, dense_scores, sparse_top_indices, sparse_top_scores, k,
+            self.config.hybrid_alpha, self.config.fusion_strategy, self.config.fusion_rrf_k
+        )
+        logger.debug("Combined results (top 5): %s", results[:5])
+        return results
 
-        print(f"Re-ranking {len(candidates)} candidates with cross-encoder...")
-        query_doc_pairs = []
-        for candidate in candidates:
-            doc_text = candidate['text'][:500]
-            query_doc_pairs.append([query, doc_text])
+    def stage2_precise_reranking(self, query: str, candidates: List[Dict], k: Optional[int] = None) -> List[Dict]:
+        return self.stage2_precise_reranking_batch([query], [candidates], k)[0]
 
+    def stage2_precise_reranking_batch(self, queries: List[str], candidate_lists: List[List[Dict]],
+                                       k: Optional[int] = None,
+                                       generation: Optional[IndexGeneration] = None) -> List[List[Dict]]:
+        """
+        Cascade reranking. Per query, stage 2 is skipped when the stage-1 hybrid
+        score margin between the top two candidates reaches config.rerank_skip_margin
+        (the stage-1 order is kept). Otherwise the optional first-pass reranker
+        keeps the best config.first_pass_keep candidates, and the cross-encoder
+        scores the survivors of every query in one predict call. Pairs already
+        scored against the candidates' index generation (default: the published
+        one) come from the rerank memo; only the misses are sent to the model,
+        and only their chunk texts are read.
+        """
+        k = k or self.config.final_retrieval_k
+        threshold = self.config.rerank_skip_margin
+        results: List[Optional[List[Dict]]] = [None] * len(queries)
+        margins = [self._stage1_margin(candidates) for candidates in candidate_lists]
+        pending = []
+        for i, (query, candidates, margin) in enumerate(zip(queries, candidate_lists, margins)):
+            if threshold is not None and margin is not None and margin >= threshold:
+                logger.info("Rerank cascade for %r: skipped, stage-1 margin %.3f >= %.3f", query, margin, threshold)
+                self._count_cascade('skipped')
+                results[i] = candidates[:k]
+            else:
+                pending.append(i)
+
+        if pending:
+            gen = generation or self.generation
+            queries_left = [queries[i] for i in pending]
+            candidates_left = [candidate_lists[i] for i in pending]
+            mode = 'full'
+            if self._first_pass_reranker is not None:
+                mode = 'first_pass'
+                keep = max(k, self.config.first_pass_keep)
+                with span("rerank_first_pass", queries=len(pending)):
+                    candidates_left = self._first_pass_batch(queries_left, candidates_left, keep, gen)
+            for i, survivors in zip(pending, candidates_left):
+                logger.info("Rerank cascade for %r: %s, stage-1 margin %s, %d -> %d candidates to the cross-encoder",
+                            queries[i], mode.replace('_', ' '),
+                            "n/a" if margins[i] is None else f"{margins[i]:.3f}",
+                            len(candidate_lists[i]), len(survivors))
+            self._count_cascade(mode, len(pending))
+
+            with span("rerank", queries=len(pending)):
+                reranked = self._rerank_batch(queries_left, candidates_left, k, gen)
+            for i, ranked in zip(pending, reranked):
+                results[i] = ranked
+        return results
+
+    def _count_cascade(self, mode: str, n: int = 1):
+        with self._stats_lock:
+            self.cascade_stats[mode] += n
+
+    @staticmethod
+    def _stage1_margin(candidates: List[Dict]) -> Optional[float]:
+        """Hybrid score gap between the best two stage-1 candidates (None with fewer than two)"""
+        if len(candidates) < 2:
+            return None
+        top = sorted((c.get('hybrid_score', 0.0) for c in candidates), reverse=True)
+        return top[0] - top[1]
+
+    def _first_pass_batch(self, queries: List[str], candidate_lists: List[List[Dict]],
+                          keep: int, gen: IndexGeneration) -> List[List[Dict]]:
+        """Score all candidates with the cheap reranker in one call and keep the best `keep` per query"""
+        pairs = [[query, gen.chunks.text_prefix(candidate['index'], self.config.rerank_max_tokens)]
+                 for query, candidates in zip(queries, candidate_lists) for candidate in candidates]
+        if not pairs:
+            return candidate_lists
         try:
-            cross_encoder_scores = self.cross_encoder.predict(query_doc_pairs)
-            for i, candidate in enumerate(candidates):
-                candidate['cross_encoder_score'] = float(cross_encoder_scores[i])
-                candidate['score'] = candidate['cross_encoder_score']
-                candidate['stage'] = 'precise_reranking'
-            reranked = sorted(candidates, key=lambda x: x['cross_encoder_score'], reverse=True)
-            print("[DEBUG] Cross Encoder Re-Ranked documents ",reranked[:k])
-            return reranked[:k]
-
+            scores = iter(self.first_pass_reranker.predict(pairs))
         except Exception as e:
-            print(f"Cross-encoder re-ranking failed: {e}")
-            return candidates[:k]
+            logger.warning("First-pass re-ranking failed: %s", e)
+            return candidate_lists
+
+        survivors = []
+        for candidates in candidate_lists:
+            scored = [{**candidate, 'first_pass_score': float(next(scores))} for candidate in candidates]
+            survivors.append(sorted(scored, key=lambda x: x['first_pass_score'], reverse=True)[:keep])
+        return survivors
+
+    def _rerank_batch(self, queries: List[str], candidate_lists: List[List[Dict]], k: int,
+                      gen: IndexGeneration) -> List[List[Dict]]:
+        pair_keys = [(query, candidate['index'], gen.version)
+                     for query, candidates in zip(queries, candidate_lists) for candidate in candidates]
+        if not pair_keys:
+            return [[] for _ in queries]
+
+        scores = {key: self.rerank_memo.get(key) for key in pair_keys}
+        miss_keys = [key for key, score in scores.items() if score is None]
+        if miss_keys:
+            query_doc_pairs = []
+            for query, idx, _ in miss_keys:
+                doc_text = gen.chunks.text_prefix(idx, self.config.rerank_max_tokens)
+                query_doc_pairs.append([query, doc_text])
+
+            logger.debug("Re-ranking %d of %d candidates for %d queries with cross-encoder",
+                         len(query_doc_pairs), len(pair_keys), len(queries))
+            try:
+                cross_encoder_scores = self.cross_encoder.predict(query_doc_pairs)
+            except Exception as e:
+                logger.warning("Cross-encoder re-ranking failed: %s", e)
+                return [candidates[:k] for candidates in candidate_lists]
+            for key, score in zip(miss_keys, cross_encoder_scores):
+                scores[key] = float(score)
+                self.rerank_memo.put(key, scores[key])
+
+        reranked_lists = []
+        for query, candidates in zip(queries, candidate_lists):
+            # New dicts, so the caller's candidates can be reranked again or concurrently
+            scored = []
+            for candidate in candidates:
+                score = scores[(query, candidate['index'], gen.version)]
+                scored.append({**candidate, 'cross_encoder_score': score, 'score': score, 'stage': 'precise_reranking'})
+            reranked = sorted(scored, key=lambda x: x['cross_encoder_score'], reverse=True)
+            logger.debug("Cross-encoder re-ranked documents: %s", reranked[:k])
+            reranked_lists.append(reranked[:k])
+        return reranked_lists
+
+    def multi_stage_retrieve(self, query: str, generation: Optional[IndexGeneration] = None,
+                             query_embedding: Optional[np.ndarray] = None) -> List[Dict]:
+        query_embeddings = query_embedding[None, :] if query_embedding is not None else None
+        return self.multi_stage_retrieve_batch([query], generation, query_embeddings)[0]
+
+    def multi_stage_retrieve_batch(self, queries: List[str], generation: Optional[IndexGeneration] = None,
+                                   query_embeddings: Optional[np.ndarray] = None) -> List[List[Dict]]:
+        """
+        Multi-stage retrieval for a batch of queries against `generation`
+        (default: the published one). Stage timings in the results are for the
+        whole batch. query_embeddings are passed on to stage 1.
+        """
+        if not queries:
+            return []
 
-    def multi_stage_retrieve(self, query: str) -> List[Dict]:
+        # Both stages read the same generation even if a rebuild is swapped in meanwhile
+        gen = generation or self.generation
 
         # Stage 1: broad retrieval
         start_time = time.time()
-        stage1_results = self.stage1_broad_retrieval(query, self.config.initial_retrieval_k)
+        stage1_results = self.stage1_broad_retrieval_batch(queries, self.config.initial_retrieval_k, generation=gen,
+                                                           query_embeddings=query_embeddings)
         stage1_time = time.time()
 
         # Stage 2: precise reranking
-        final_results = self.stage2_precise_reranking(query, stage1_results, self.config.final_retrieval_k)
+        stage2_results = self.stage2_precise_reranking_batch(queries, stage1_results, self.config.final_retrieval_k,
+                                                             generation=gen)
         stage2_time = time.time()
 
-        # Stage 3: financial boosting
-        final_results = self._revenue_boost(query, final_results)
+        batch_results = []
+        for query, final_results in zip(queries, stage2_results):
+            # Only the final candidates, which go on to the prompt, have their text and metadata read
+            final_results = [{**result, 'text': gen.chunks.text(result['index']),
+                              'metadata': gen.chunks.metadata(result['index']),
+                              'token_marks': gen.chunks.token_marks(result['index'])} for result in final_results]
+
+            # Stage 3: financial boosting
+            with span("boost"):
+                final_results = self._revenue_boost(query, final_results)
 
-        enriched_results = []
-        for i, result in enumerate(final_results):
-            meta = result.get("metadata", {})
-            meta["score"] = result.get("score", 0.0)
+            enriched_results = []
+            for i, result in enumerate(final_results):
+                meta = {**result["metadata"], "score": result.get("score", 0.0)}
 
-            enriched = {
-            "final_rank": i + 1,
-            "stage1_time": stage1_time - start_time,
-            "stage2_time": stage2_time - stage1_time,
-            "total_time": stage2_time - start_time,
-            #"score": result.get("cross_encoder_score", result.get("hybrid_score", 0.0)),
-            "score": result.get("score", 0.0),
-            "text": result["text"],
-            "metadata": meta
-             }
-            print("[DEBUG] Final scores ",enriched["score"])
-            if meta.get("type") == "table_row":
-               enriched["table_row"] = meta.get("source")
+                enriched = {
+                "final_rank": i + 1,
+                "stage1_time": stage1_time - start_time,
+                "stage2_time": stage2_time - stage1_time,
+                "total_time": stage2_time - start_time,
+                #"score": result.get("cross_encoder_score", result.get("hybrid_score", 0.0)),
+                "score": result.get("score", 0.0),
+                "text": result["text"],
+                "token_marks": result["token_marks"],  # lets prepare_context cut the text without tokenizing
+                "metadata": meta
+                 }
+                if meta.get("type") == "table_row":
+                   enriched["table_row"] = meta.get("source")
 
-            enriched_results.append(enriched)
+                enriched_results.append(enriched)
 
-        self.scores = [res["score"] for res in enriched_results]
-        print(f"Multi-stage retrieval completed: {len(enriched_results)} results")
+            batch_results.append(enriched_results)
 
+        logger.debug("Multi-stage retrieval completed: %d results for %d queries",
+                     sum(len(r) for r in batch_results), len(queries))
 
-        return enriched_results
+
+        return batch_results
 
 """   # ResponseGenerator  
   
   Handles response generation with context management
 """
 
+class _StopOnEvent(StoppingCriteria):
+    """Ends generate() once the event is set, e.g. when nobody reads a stream any more"""
+
+    def __init__(self, event: threading.Event):
+        self.event = event
+
+    def __call__(self, input_ids: torch.Tensor, scores: torch.Tensor, **kwargs) -> torch.Tensor:
+        return torch.full((input_ids.shape[0],), self.event.is_set(), dtype=torch.bool, device=input_ids.device)
+
+
 class ResponseGenerator:
     """Handles response generation with context management"""
+
+    # Static start of every prompt; its KV cache is computed once and reused
+    prompt_prefix = "Based on the following context, answer the question accurately and concisely.\n\nContext:\n"
+
     def __init__(self, config: RAGConfig):
         self.config = config
+        self._prefix_lock = threading.Lock()
+        self._prefix_key = None
+        self._prefix_ids: Optional[torch.Tensor] = None
+        self._prefix_past = None
 
-        print(f"Loading generation model: {config.generator_model}")
-        self.tokenizer = AutoTokenizer.from_pretrained(config.generator_model)
-        self.model = AutoModelForCausalLM.from_pretrained(config.generator_model)
-
-        # Proper padding configuration for GPT2-like models
-        if self.tokenizer.pad_token is None:
-            self.tokenizer.pad_token = self.tokenizer.eos_token
-        if getattr(self.model.config, "pad_token_id", None) is None:
-            self.model.config.pad_token_id = self.tokenizer.pad_token_id
+        # Loaded on first use: queries answered by fact lookup or direct
+        # extraction never need the model, and indexing only the tokenizer
+        self._tokenizer = LazyModel("generator_tokenizer", self._load_tokenizer)
+        self._model = LazyModel("generator", self._load_model)
 
         print("Response generator initialized")
 
+    def _load_tokenizer(self):
+        tokenizer = AutoTokenizer.from_pretrained(self.config.generator_model)
+        # Proper padding configuration for GPT2-like models
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+        # Decoder-only models must be left-padded for batched generation
+        tokenizer.padding_side = "left"
+        return tokenizer
+
+    def _load_model(self):
+        print(f"Loading generation model: {self.config.generator_model}")
+        model = AutoModelForCausalLM.from_pretrained(self.config.generator_model)
+        if self.config.quantize_generator:
+            model = quantize_dynamic_int8(model, str(model.device))
+        if getattr(model.config, "pad_token_id", None) is None:
+            model.config.pad_token_id = self.tokenizer.pad_token_id
+        return model
+
+    @property
+    def tokenizer(self):
+        return self._tokenizer.get()
+
+    @tokenizer.setter
+    def tokenizer(self, tokenizer):
+        self._tokenizer = LazyModel.loaded("generator_tokenizer", tokenizer)
+
+    @property
+    def model(self):
+        return self._model.get()
+
+    @model.setter
+    def model(self, model):
+        self._model = LazyModel.loaded("generator", model)
+
+    @property
+    def models(self) -> List[LazyModel]:
+        """The generator's tokenizer and model, loaded or not"""
+        return [self._tokenizer, self._model]
+
     def prepare_context(self, query: str, retrieved_docs: List[Dict]) -> str:
         context_parts = []
         current_tokens = 0
@@ -957,15 +3098,23 @@ class ResponseGenerator:
 
         for doc in retrieved_docs:
             doc_text = doc['text']
-            doc_tokens = len(self.tokenizer.encode(doc_text, add_special_tokens=False))
+            # Chunks indexed by tokens carry their count; others are tokenized once here
+            doc_tokens = doc.get('metadata', {}).get('tokens')
+            token_ids = None
+            if doc_tokens is None:
+                token_ids = self.tokenizer.encode(doc_text, add_special_tokens=False)
+                doc_tokens = len(token_ids)
             if current_tokens + doc_tokens <= max_context_tokens:
                 context_parts.append(f"Document {len(context_parts)+1}: {doc_text}")
                 current_tokens += doc_tokens
             else:
                 remaining_tokens = max_context_tokens - current_tokens
                 if remaining_tokens > 50:
-                    truncated_tokens = self.tokenizer.encode(doc_text, add_special_tokens=False)[:remaining_tokens]
-                    truncated_text = self.tokenizer.decode(truncated_tokens, skip_special_tokens=True)
+                    if token_ids is None:
+                        truncated_text, _ = truncate_to_tokens(doc_text, doc_tokens, doc.get('token_marks', []),
+                                                               remaining_tokens)
+                    else:
+                        truncated_text = self.tokenizer.decode(token_ids[:remaining_tokens], skip_special_tokens=True)
                     context_parts.append(f"Document {len(context_parts)+1}: {truncated_text}...")
                 break
 
@@ -973,20 +3122,149 @@ class ResponseGenerator:
 
 
 
-    def generate_response(self, query: str, retrieved_docs: List[Dict]) -> Dict[str, Union[str, int]]:
+    def build_prompt(self, query: str, retrieved_docs: List[Dict]) -> str:
         context = self.prepare_context(query, retrieved_docs)
-        prompt = (
-            "Based on the following context, answer the question accurately and concisely.\n\n"
-            f"Context:\n{context}\n\n"
+        return (
+            self.prompt_prefix
+            + f"{context}\n\n"
             f"Question: {query}\n\n"
             "Answer:"
         )
 
+    def _prefix_cache_for(self, input_ids: torch.Tensor):
+        """
+        A private copy of the prompt-prefix KV cache when the single tokenized
+        prompt in input_ids starts with the prefix tokens, else None. The cache
+        is rebuilt whenever the model object, its checkpoint or the prefix text
+        changes; generate() then only prefills the tokens after the prefix.
+        """
+        if not self.config.enable_prefix_cache or input_ids.shape[0] != 1:
+            return None
+        with self._prefix_lock:
+            key = (id(self.model), self.model.config.name_or_path, self.prompt_prefix)
+            if self._prefix_key != key:
+                prefix_ids = self.tokenizer(self.prompt_prefix, return_tensors="pt")["input_ids"]
+                with torch.no_grad():
+                    self._prefix_past = self.model(input_ids=prefix_ids, use_cache=True).past_key_values
+                self._prefix_ids = prefix_ids[0]
+                self._prefix_key = key
+                logger.debug("Prompt prefix cache built: %d tokens", len(self._prefix_ids))
+
+            n = len(self._prefix_ids)
+            # generate() needs at least one uncached token to start from
+            if input_ids.shape[1] <= n or not torch.equal(input_ids[0, :n], self._prefix_ids):
+                return None
+            # generate() appends to the cache it is given
+            return copy.deepcopy(self._prefix_past)
+
+    def generate_response(self, query: str, retrieved_docs: List[Dict]) -> Dict[str, Union[str, int]]:
+        return self.generate_responses([query], [retrieved_docs])[0]
+
+    def generate_responses(self, queries: List[str], docs_lists: List[List[Dict]]) -> List[Dict[str, Union[str, int]]]:
+        """
+        Generate answers for several queries, batching config.batch_size prompts
+        per generate call. Prompts are left-padded so every row continues right
+        after its own prompt.
+        """
+        prompts = [self.build_prompt(query, docs) for query, docs in zip(queries, docs_lists)]
+        results = []
+        batch_size = max(1, self.config.batch_size)
+        for start in range(0, len(prompts), batch_size):
+            results.extend(self._generate_batch(prompts[start:start + batch_size],
+                                                docs_lists[start:start + batch_size]))
+        return results
+
+    def generate_response_stream(self, query: str, retrieved_docs: List[Dict]) -> Iterator[Dict]:
+        """
+        Stream an answer while it is generated. Yields {'type': 'token', 'text': ...}
+        for each decoded piece, then one {'type': 'done', 'result': ...} whose result
+        has the generate_response schema plus time_to_first_token. Closing the
+        iterator early (e.g. a Streamlit rerun) stops generation at the next token.
+        """
+        prompt = self.build_prompt(query, retrieved_docs)
+        start_time = time.time()
+        first_token_time = None
         try:
             inputs = self.tokenizer(
                 prompt,
                 return_tensors="pt",
                 max_length=self.config.max_context_length,
+                truncation=True
+            )
+            streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+            stop = threading.Event()
+            generation = {}
+
+            def _run():
+                try:
+                    with torch.no_grad():
+                        generation['outputs'] = self.model.generate(
+                            input_ids=inputs["input_ids"],
+                            attention_mask=inputs.get("attention_mask", None),
+                            max_new_tokens=self.config.max_generation_length,
+                            do_sample=False,
+                            no_repeat_ngram_size=3,
+                            pad_token_id=self.tokenizer.pad_token_id,
+                            eos_token_id=self.tokenizer.eos_token_id,
+                            streamer=streamer,
+                            stopping_criteria=StoppingCriteriaList([_StopOnEvent(stop)]),
+                            past_key_values=self._prefix_cache_for(inputs["input_ids"]),
+                        )
+                except Exception as e:
+                    generation['error'] = e
+                    # Unblock the consumer loop below
+                    streamer.end()
+
+            worker = threading.Thread(target=_run, daemon=True)
+            worker.start()
+            try:
+                for text in streamer:
+                    if not text:
+                        continue
+                    if first_token_time is None:
+                        first_token_time = time.time() - start_time
+                    yield {'type': 'token', 'text': text}
+            finally:
+                # The consumer may have stopped reading (GeneratorExit); don't decode for nobody
+                stop.set()
+            worker.join()
+            if 'error' in generation:
+                raise generation['error']
+
+            # Streamed text is for display; the final answer is decoded like generate_response
+            answer = self._extract_answer(prompt, generation['outputs'][0])
+            prompt_tokens = int(inputs['input_ids'].shape[1])
+            result = {
+                'answer': answer,
+                'prompt_tokens': prompt_tokens,
+                'generated_tokens': int(generation['outputs'][0].shape[0] - prompt_tokens),
+                'context_docs': len(retrieved_docs),
+                'time_to_first_token': first_token_time
+            }
+
+        except Exception as e:
+            logger.warning("Generation failed: %s", e)
+            result = {
+                'answer': f"I encountered an error generating a response: {str(e)}",
+                'prompt_tokens': 0,
+                'generated_tokens': 0,
+                'context_docs': len(retrieved_docs),
+                'time_to_first_token': first_token_time
+            }
+        yield {'type': 'done', 'result': result}
+
+    def _extract_answer(self, prompt: str, output_ids: torch.Tensor) -> str:
+        generated_text = self.tokenizer.decode(output_ids, skip_special_tokens=True)
+        if "Answer:" in generated_text:
+            return generated_text.split("Answer:")[-1].strip()
+        return generated_text[len(prompt):].strip()
+
+    def _generate_batch(self, prompts: List[str], docs_lists: List[List[Dict]]) -> List[Dict[str, Union[str, int]]]:
+        try:
+            inputs = self.tokenizer(
+                prompts,
+                return_tensors="pt",
+                max_length=self.config.max_context_length,
                 truncation=True,
                 padding=True
             )
@@ -1003,29 +3281,36 @@ class ResponseGenerator:
                     no_repeat_ngram_size=3,
                     pad_token_id=self.tokenizer.pad_token_id,
                     eos_token_id=self.tokenizer.eos_token_id,
+                    # Only single prompts can share it; left padding shifts the prefix per row
+                    past_key_values=self._prefix_cache_for(inputs["input_ids"]),
                 )
 
-            generated_text = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
-            if "Answer:" in generated_text:
-                answer = generated_text.split("Answer:")[-1].strip()
-            else:
-                answer = generated_text[len(prompt):].strip()
-
-            return {
-                'answer': answer,
-                'prompt_tokens': int(inputs['input_ids'].shape[1]),
-                'generated_tokens': int(outputs[0].shape[0] - inputs['input_ids'].shape[1]),
-                'context_docs': len(retrieved_docs)
-            }
+            input_length = inputs['input_ids'].shape[1]
+            results = []
+            for row, (prompt, docs) in enumerate(zip(prompts, docs_lists)):
+                answer = self._extract_answer(prompt, outputs[row])
+
+                # Finished rows are padded with eos until the longest row stops
+                new_tokens = outputs[row, input_length:].tolist()
+                if self.tokenizer.eos_token_id in new_tokens:
+                    new_tokens = new_tokens[:new_tokens.index(self.tokenizer.eos_token_id) + 1]
+
+                results.append({
+                    'answer': answer,
+                    'prompt_tokens': int(attention_mask[row].sum()) if attention_mask is not None else input_length,
+                    'generated_tokens': len(new_tokens),
+                    'context_docs': len(docs)
+                })
+            return results
 
         except Exception as e:
-            print(f"Generation failed: {e}")
-            return {
+            logger.warning("Generation failed: %s", e)
+            return [{
                 'answer': f"I encountered an error generating a response: {str(e)}",
                 'prompt_tokens': 0,
                 'generated_tokens': 0,
-                'context_docs': len(retrieved_docs)
-            }
+                'context_docs': len(docs)
+            } for docs in docs_lists]
 
 """   # Gaurd Rail System  
   Implements both input and output guardrails
@@ -1122,6 +3407,440 @@ class GuardrailSystem:
             'confidence': confidence
         }
 
+"""# Answer Cache
+   In-memory LRU/TTL caches for answers to repeated and near-duplicate questions
+"""
+
+class LRUCache:
+    """Thread-safe in-memory LRU map whose entries also expire after ttl_seconds (None = never)"""
+
+    def __init__(self, max_entries: int, ttl_seconds: Optional[float] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._entries: "OrderedDict[object, Tuple[float, object]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _expired(self, stored_at: float, now: float) -> bool:
+        return self.ttl_seconds is not None and now - stored_at > self.ttl_seconds
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry[0], now):
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def items(self) -> List[Tuple[object, object]]:
+        """Snapshot of live entries; expired ones are dropped (does not count as a lookup)"""
+        now = time.monotonic()
+        with self._lock:
+            for key in [k for k, (stored_at, _) in self._entries.items() if self._expired(stored_at, now)]:
+                del self._entries[key]
+                self.expirations += 1
+            return [(k, v) for k, (_, v) in self._entries.items()]
+
+    def touch(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+
+    def pop(self, key, default=None):
+        """Remove an entry without counting a lookup"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': len(self._entries),
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
+
+
+class AnswerCache:
+    """
+    Caches successful pipeline results by normalized query text. On an exact
+    miss, a cached query whose embedding has cosine similarity >= threshold is
+    reused, but only if both queries mention the same numbers and years, since
+    "revenue in 2023" and "revenue in 2022" embed almost identically.
+    Entries are kept per namespace (the index a query ran against), so answers
+    never cross between corpora. Results are copied in and out, so callers may
+    modify what they get back.
+    """
+
+    NUMBER_RE = re.compile(r"\d+(?:[.,]\d+)*")
+
+    def __init__(self, max_entries: int, ttl_seconds: Optional[float], similarity_threshold: float):
+        self.similarity_threshold = similarity_threshold
+        self.semantic_hits = 0
+        self._hits_lock = threading.Lock()
+        self._cache = LRUCache(max_entries, ttl_seconds)
+        # Bumped by clear(); a query started before a clear must not store its answer
+        self._versions: Dict[str, int] = {}
+        self._clears = 0
+        self._version_lock = threading.Lock()
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        query = re.sub(r"[^\w\s.,$%]", " ", query.lower())
+        query = re.sub(r"[.,?!]+(\s|$)", r"\1", query)
+        return re.sub(r"\s+", " ", query).strip()
+
+    def _numbers(self, normalized: str) -> frozenset:
+        return frozenset(n.replace(",", "") for n in self.NUMBER_RE.findall(normalized))
+
+    def get(self, query: str, namespace: str = "") -> Optional[Dict]:
+        """Exact lookup by normalized query"""
+        entry = self._cache.get((namespace, self.normalize(query)))
+        return copy.deepcopy(entry['result']) if entry else None
+
+    def get_similar(self, query: str, embedding: np.ndarray, namespace: str = "") -> Optional[Dict]:
+        """Best cached answer for a paraphrase, or None"""
+        numbers = self._numbers(self.normalize(query))
+        candidates = [(key, entry) for key, entry in self._cache.items()
+                      if key[0] == namespace and entry['numbers'] == numbers]
+        if not candidates:
+            return None
+        similarities = np.stack([entry['embedding'] for _, entry in candidates]) @ embedding
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.similarity_threshold:
+            return None
+        key, entry = candidates[best]
+        self._cache.touch(key)
+        with self._hits_lock:
+            self.semantic_hits += 1
+        return copy.deepcopy(entry['result'])
+
+    def version(self, namespace: str = "") -> Tuple[int, int]:
+        """Changes whenever the namespace is cleared; pass it to put() from before the answer was computed"""
+        with self._version_lock:
+            return self._clears, self._versions.get(namespace, 0)
+
+    def put(self, query: str, embedding: np.ndarray, result: Dict, namespace: str = "",
+            version: Optional[Tuple[int, int]] = None):
+        """Store an answer; skipped if the namespace was cleared since `version` was read"""
+        normalized = self.normalize(query)
+        entry = {
+            'result': copy.deepcopy(result),
+            'embedding': np.asarray(embedding, dtype=np.float32),
+            'numbers': self._numbers(normalized),
+        }
+        with self._version_lock:
+            if version is not None and version != (self._clears, self._versions.get(namespace, 0)):
+                return
+            self._cache.put((namespace, normalized), entry)
+
+    def clear(self, namespace: Optional[str] = None):
+        """Drop every entry, or only those of one namespace"""
+        with self._version_lock:
+            if namespace is None:
+                self._clears += 1
+                self._cache.clear()
+                return
+            self._versions[namespace] = self._versions.get(namespace, 0) + 1
+            for key, _ in self._cache.items():
+                if key[0] == namespace:
+                    self._cache.pop(key)
+
+    def stats(self) -> Dict:
+        stats = self._cache.stats()
+        # A semantic hit follows an exact-match miss; report it as a hit
+        stats['hits'] += self.semantic_hits
+        stats['misses'] -= self.semantic_hits
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return {**stats, 'semantic_hits': self.semantic_hits}
+
+"""# Index Registry"""
+
+class IndexRegistry:
+    """
+    Named indexes, one IndexGeneration each, all served by the same retriever
+    (and so the same models). Each index is snapshotted under root_dir/<name>.
+    When the estimated resident size of the loaded indexes exceeds
+    memory_budget_bytes, the least recently used ones are written to their
+    snapshot (if changed since) and dropped from memory; the next get() loads
+    them back. Indexes held through pinned() are never evicted. Without a
+    root_dir nothing can be evicted.
+    """
+
+    NAME_RE = re.compile(r"[A-Za-z0-9][A-Za-z0-9_.-]{0,63}")
+
+    def __init__(self, retriever: MultiStageRetriever, root_dir: Optional[Union[str, Path]] = None,
+                 memory_budget_bytes: Optional[int] = None):
+        self.retriever = retriever
+        self.root_dir = Path(root_dir) if root_dir else None
+        self.memory_budget_bytes = memory_budget_bytes
+        self.loads = 0
+        self.evictions = 0
+        # name -> {'generation', 'bytes', 'dirty', 'info', 'pins'}, least recently used first
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.RLock()
+
+        # Indexes snapshotted by an earlier process are known but loaded on first use
+        if self.root_dir is not None and self.root_dir.is_dir():
+            for path in sorted(self.root_dir.iterdir()):
+                if (path / INDEX_MANIFEST_FILE).exists() and self.NAME_RE.fullmatch(path.name):
+                    self._entries[path.name] = {'generation': None, 'bytes': 0, 'dirty': False, 'info': None,
+                                                'pins': 0}
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._entries
+
+    def names(self) -> List[str]:
+        with self._lock:
+            return sorted(self._entries)
+
+    def _path(self, name: str) -> Optional[Path]:
+        return self.root_dir / name if self.root_dir is not None else None
+
+    def get(self, name: str) -> IndexGeneration:
+        """The generation of a named index, loading it from its snapshot if it was evicted"""
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None:
+                raise ValueError(f"Unknown index '{name}'")
+            self._entries.move_to_end(name)
+            if entry['generation'] is None:
+                gen, manifest = self.retriever.load_generation(self._path(name))
+                entry.update(generation=gen, bytes=gen.memory_bytes(), dirty=False,
+                             info=manifest.get("extra", {}).get("indexing_info"))
+                self.loads += 1
+                logger.info("Loaded index '%s' (%.1f MB)", name, entry['bytes'] / 2**20)
+                self._enforce_budget(keep=name)
+            return entry['generation']
+
+    @contextmanager
+    def pinned(self, name: str) -> Iterator[IndexGeneration]:
+        """
+        get(), keeping the index resident until the block exits. Writers that
+        change a generation in place hold it this way, so their changes cannot
+        go into a copy the budget has already evicted (and would never save).
+        """
+        with self._lock:
+            gen = self.get(name)
+            entry = self._entries[name]
+            entry['pins'] += 1
+        try:
+            yield gen
+        finally:
+            with self._lock:
+                entry['pins'] -= 1
+
+    @classmethod
+    def validate_name(cls, name: str):
+        if not cls.NAME_RE.fullmatch(name):
+            raise ValueError(f"Invalid index name '{name}' (letters, digits, '.', '_' and '-', up to 64)")
+
+    def put(self, name: str, gen: IndexGeneration, info: Optional[Dict] = None):
+        """Add or replace a named index"""
+        self.validate_name(name)
+        with self._lock:
+            self._entries[name] = {'generation': gen, 'bytes': gen.memory_bytes(), 'dirty': True, 'info': info,
+                                   'pins': 0}
+            self._entries.move_to_end(name)
+            self._enforce_budget(keep=name)
+
+    def modified(self, name: str, info: Optional[Dict] = None):
+        """Record an in-place change (add/remove) to a loaded index"""
+        with self._lock:
+            entry = self._entries[name]
+            if entry['generation'] is not None:
+                entry.update(bytes=entry['generation'].memory_bytes(), dirty=True)
+            if info is not None:
+                entry['info'] = info
+            self._enforce_budget(keep=name)
+
+    def info(self, name: str) -> Optional[Dict]:
+        """Indexing info of a named index; read from its snapshot if it is not loaded"""
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None:
+                return None
+            if entry['info'] is None and entry['generation'] is None:
+                manifest = json.loads((self._path(name) / INDEX_MANIFEST_FILE).read_text(encoding="utf-8"))
+                entry['info'] = manifest.get("extra", {}).get("indexing_info")
+            return entry['info']
+
+    def save(self, name: str) -> Optional[Path]:
+        """Snapshot a named index if it changed since it was last written"""
+        with self._lock:
+            entry = self._entries[name]
+            path = self._path(name)
+            if path is None or entry['generation'] is None or not entry['dirty']:
+                return path
+            self.retriever.save_index(path, extra={"indexing_info": entry['info']}, generation=entry['generation'])
+            entry['dirty'] = False
+            return path
+
+    def remove(self, name: str):
+        """Forget a named index and delete its snapshot"""
+        with self._lock:
+            self._entries.pop(name, None)
+            path = self._path(name)
+            if path is not None and path.exists():
+                shutil.rmtree(path)
+
+    def memory_bytes(self) -> int:
+        return sum(entry['bytes'] for entry in self._entries.values() if entry['generation'] is not None)
+
+    def _enforce_budget(self, keep: str):
+        """Evict least recently used indexes (never `keep` or pinned ones) until the resident size fits the budget"""
+        if self.memory_budget_bytes is None or self.root_dir is None:
+            return
+        for name in list(self._entries):
+            if self.memory_bytes() <= self.memory_budget_bytes:
+                break
+            entry = self._entries[name]
+            if name != keep and entry['generation'] is not None and not entry['pins']:
+                self._evict(name)
+
+    def _evict(self, name: str):
+        entry = self._entries[name]
+        # Queries that already hold the generation finish on it; it is freed afterwards
+        self.save(name)
+        logger.info("Evicted index '%s' (%.1f MB) to %s", name, entry['bytes'] / 2**20, self._path(name))
+        entry.update(generation=None, bytes=0)
+        self.evictions += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'indexes': len(self._entries),
+                'resident': [name for name, entry in self._entries.items() if entry['generation'] is not None],
+                'resident_bytes': self.memory_bytes(),
+                'memory_budget_bytes': self.memory_budget_bytes,
+                'loads': self.loads,
+                'evictions': self.evictions,
+            }
+
+"""# Background Indexing"""
+
+class IndexingJob:
+    """
+    One run_indexing or add_documents call on a background thread. The worker
+    thread updates the counters; any thread may read progress() or cancel().
+    A cancelled rebuild leaves the published index untouched; a cancelled
+    append keeps the batches already added.
+    """
+
+    def __init__(self, total_files: int, append: bool = False):
+        self.total_files = total_files
+        self.append = append
+        self.files_parsed = 0
+        self.chunks_parsed = 0
+        self.chunks_embedded = 0
+        self.state = "pending"  # running, succeeded, failed or cancelled
+        self.result: Optional[Dict] = None
+        self.error: Optional[str] = None
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.cancel_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, target: Callable[["IndexingJob"], Dict],
+              on_finish: Optional[Callable[["IndexingJob"], None]] = None) -> "IndexingJob":
+        """Run target(job) on a daemon thread; on_finish(job) runs there afterwards, whatever the outcome"""
+        def _run():
+            try:
+                self.result = target(self)
+                self.state = "succeeded"
+            except IndexingCancelled:
+                self.state = "cancelled"
+                print("Indexing cancelled")
+            except Exception as e:
+                logger.error("Indexing job failed: %s", e)
+                self.error = str(e)
+                self.state = "failed"
+            finally:
+                self.finished_at = time.time()
+                if on_finish is not None:
+                    on_finish(self)
+
+        self.started_at = time.time()
+        self.state = "running"
+        self._thread = threading.Thread(target=_run, name="rag-indexing", daemon=True)
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Block until the job has finished; returns False on timeout"""
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return self.done
+
+    @property
+    def done(self) -> bool:
+        return self.state in ("succeeded", "failed", "cancelled")
+
+    def file_parsed(self, path: Path):
+        self.files_parsed += 1
+
+    def chunks_embedded_to(self, count: int):
+        self.chunks_embedded = count
+
+    def progress(self) -> Dict:
+        """
+        Snapshot of the job. The chunk total is unknown until every file is
+        parsed, so it is extrapolated from the chunks per file parsed so far.
+        """
+        elapsed = ((self.finished_at or time.time()) - self.started_at) if self.started_at else 0.0
+        if self.state == "succeeded":
+            fraction = 1.0
+        elif self.files_parsed:
+            expected_chunks = self.chunks_parsed * self.total_files / self.files_parsed
+            # Hold back the last percent for building the FAISS index
+            fraction = min(self.chunks_embedded / max(expected_chunks, 1), 0.99)
+        else:
+            fraction = 0.0
+        eta = elapsed * (1 - fraction) / fraction if 0 < fraction < 1 and not self.done else None
+        return {
+            'state': self.state,
+            'files_parsed': self.files_parsed,
+            'total_files': self.total_files,
+            'chunks_parsed': self.chunks_parsed,
+            'chunks_embedded': self.chunks_embedded,
+            'fraction': fraction,
+            'elapsed_seconds': elapsed,
+            'eta_seconds': eta,
+            'error': self.error,
+        }
+
 """# MAIN RAG PIPELINE
    Main RAG pipeline orchestrating all components
 
@@ -1139,18 +3858,53 @@ class CompleteRAGPipeline:
         self.preprocessor = QueryPreprocessor()
         self.retriever = MultiStageRetriever(self.config)
         self.generator = ResponseGenerator(self.config)
+        if self.config.preload_models:
+            # Returns at once; the first query waits only for the models it uses
+            self.preload_models(wait=False)
         self.guardrails = GuardrailSystem(self.config)
+        self.trace_exporter = JsonLinesTraceExporter(self.config.trace_path) if self.config.trace_path else None
+        if self.config.log_level:
+            configure_logging(self.config.log_level)
+        self.answer_cache = None
+        if self.config.enable_answer_cache:
+            self.answer_cache = AnswerCache(
+                self.config.answer_cache_max_entries,
+                self.config.answer_cache_ttl_seconds,
+                self.config.answer_cache_similarity
+            )
+
+        # Named indexes next to the default one; all share the retriever's models
+        budget_mb = self.config.index_memory_budget_mb
+        self.indexes = IndexRegistry(self.retriever, self.config.index_registry_dir,
+                                     int(budget_mb * 2**20) if budget_mb is not None else None)
 
         self.is_initialized = False
+        self.indexing_info: Optional[Dict] = None
+        self.indexing_job: Optional[IndexingJob] = None
+        self._indexing_job_lock = threading.Lock()
         self.stats = {
             'total_queries': 0,
             'successful_queries': 0,
             'guardrail_violations': 0,
             'avg_response_time': 0.0
         }
+        # Shared by every thread querying this pipeline
+        self._stats_lock = threading.Lock()
 
         print("RAG Pipeline initialized successfully")
 
+    @property
+    def models(self) -> List[LazyModel]:
+        return self.retriever.models + self.generator.models
+
+    def preload_models(self, wait: bool = True):
+        """Load every model that is still cold, concurrently (see preload_models)"""
+        preload_models(self.models, wait=wait)
+
+    def model_status(self) -> Dict[str, Dict]:
+        """Load state of each model by name; see LazyModel.status"""
+        return {model.name: model.status() for model in self.models}
+
     def load_documents(self, documents: List[str], metadata: Optional[List[Dict]] = None):
         """Load, clean, chunk, and index documents"""
         print(f"Loading {len(documents)} raw documents...")
@@ -1173,163 +3927,659 @@ class CompleteRAGPipeline:
 
         # Chunking
         chunked_docs = []
+        chunk_metadata = []
         for d in docs:
-            chunks = _chunk_text(d, self.config.chunk_size, self.config.chunk_overlap)
-            chunked_docs.extend(chunks)
+            for chunk, spans in self._chunk(d, self.config.chunk_size, self.config.chunk_overlap):
+                chunked_docs.append(chunk)
+                chunk_metadata.append({'type': 'paragraph', 'preview': chunk[:100], **spans})
 
         print(f"Indexing {len(chunked_docs)} chunks...")
-        self.retriever.build_indices(chunked_docs, metadata=None)
+        self.retriever.build_indices(chunked_docs, metadata=chunk_metadata)
+        self._corpus_changed()
         self.is_initialized = True
         print("Documents loaded and indexed")
         
-    def run_indexing(self, paths: List[Path], chunk_size: int, chunk_overlap: int):
+    def run_indexing(self, paths: List[Path], chunk_size: int, chunk_overlap: int,
+                     job: Optional[IndexingJob] = None, index: Optional[str] = None):
         """
         Loads documents from file paths, processes them, builds the search indices,
-        and returns statistics about the operation.
+        and returns statistics about the operation. The new index replaces the
+        current one only once it is complete, so queries keep being answered
+        from the old index meanwhile. `job` receives progress and can cancel.
+        With `index`, the result becomes (or replaces) that named index instead
+        of the default one.
         """
         print(f"Starting indexing process for {len(paths)} files...")
 
-        # 1. Load documents from the file paths using the global function
-        # This function should be available in your script
-        raw_docs = load_files_to_strings(paths)
-        if not raw_docs:
+        # 1. Parse files across a process pool; chunks arrive as files finish
+        batches = self._iter_chunk_batches(paths, chunk_size, chunk_overlap, job)
+        first_batch = next(batches, None)
+        if first_batch is None:
             raise ValueError("No readable documents were found at the specified paths.")
 
-        # 2. Extract text and perform chunking
+        # 2. Embed and index each batch of chunks while later files are still being parsed
+        gen = self.retriever.build_generation(
+            itertools.chain([first_batch], batches),
+            progress=job.chunks_embedded_to if job else None,
+            cancel_event=job.cancel_event if job else None,
+        )
+        chunk_count = len(gen.chunks)
+        print(f"Created {chunk_count} chunks for indexing.")
+
+        # 3. Publish it and return the final statistics in a dictionary for the Streamlit UI
+        info = {
+            "message": f"Successfully indexed {len(paths)} files into {chunk_count} chunks.",
+            "files_indexed": len(paths),
+            "chunks_created": chunk_count
+        }
+        if index is None:
+            self.retriever.generation = gen
+            self.indexing_info = info
+            self.is_initialized = True
+        else:
+            self.indexes.put(index, gen, info)
+        self._corpus_changed(index)
+        print("Documents have been successfully indexed.")
+        return info
+
+    def start_indexing(self, paths: List[Path], chunk_size: Optional[int] = None,
+                       chunk_overlap: Optional[int] = None, append: bool = False,
+                       on_finish: Optional[Callable[[IndexingJob], None]] = None,
+                       index: Optional[str] = None) -> IndexingJob:
+        """
+        Start run_indexing (or add_documents with append=True) on a background
+        thread and return its IndexingJob. Only one job runs at a time.
+        """
+        if index is not None:
+            IndexRegistry.validate_name(index)
+        chunk_size = chunk_size or self.config.chunk_size
+        chunk_overlap = self.config.chunk_overlap if chunk_overlap is None else chunk_overlap
+        paths = [Path(p) for p in paths]
+
+        def target(job: IndexingJob) -> Dict:
+            if append and self.is_ready(index):
+                return self.add_documents(paths, chunk_size, chunk_overlap, job, index)
+            return self.run_indexing(paths, chunk_size, chunk_overlap, job, index)
+
+        # Sessions may start jobs concurrently; only one of them gets to run
+        with self._indexing_job_lock:
+            if self.indexing_job is not None and not self.indexing_job.done:
+                raise RuntimeError("An indexing job is already running.")
+            self.indexing_job = IndexingJob(len(paths), append=append)
+            return self.indexing_job.start(target, on_finish)
+
+    def _chunk_raw_docs(self, raw_docs: List[Dict], chunk_size: int, chunk_overlap: int) -> Tuple[List[str], List[Dict]]:
+        """Chunk loaded documents, keeping the source file of every chunk in its metadata"""
         all_chunks = []
+        chunk_metadata = []
         for doc in raw_docs:
             # The load_files_to_strings function returns a list of dictionaries
             if 'text' in doc and isinstance(doc['text'], str):
+                source = doc.get('metadata', {}).get('source')
                 # Use the dynamic chunk_size and chunk_overlap passed from the UI
-                chunks = _chunk_text(doc['text'], chunk_size, chunk_overlap)
-                all_chunks.extend(chunks)
+                for chunk, spans in self._chunk(doc['text'], chunk_size, chunk_overlap):
+                    all_chunks.append(chunk)
+                    chunk_metadata.append({'type': 'paragraph', 'preview': chunk[:100], 'source': source, **spans})
+        return all_chunks, chunk_metadata
+
+    def _chunk(self, text: str, chunk_size: int, chunk_overlap: int) -> List[Tuple[str, Dict]]:
+        """
+        Split one text into (chunk, span metadata) pairs. With config.token_chunking
+        and a fast generator tokenizer the text is tokenized once and every chunk
+        records its character span, token count and token marks, so reranking and
+        prompt building never tokenize it again; otherwise chunks are word-wise
+        and carry no span metadata.
+        """
+        tokenizer = self.generator.tokenizer
+        if not (self.config.token_chunking and getattr(tokenizer, "is_fast", False)):
+            return [(chunk, {}) for chunk in _chunk_text(text, chunk_size, chunk_overlap)]
+        return [(text[start:end], {'start': start, 'end': end, 'tokens': tokens, 'token_marks': marks})
+                for start, end, tokens, marks in token_chunk_spans(text, tokenizer, chunk_size, chunk_overlap)]
+
+    def _iter_chunk_batches(self, paths: List[Path], chunk_size: int, chunk_overlap: int,
+                            job: Optional[IndexingJob] = None) -> Iterator[Tuple[List[str], List[Dict]]]:
+        """Stream (chunks, metadata) batches of about config.ingest_batch_chunks as files are parsed"""
+        batch_chunks, batch_metadata = [], []
+        for doc in iter_files_to_strings(paths, self.config.ingest_workers or None,
+                                         on_file=job.file_parsed if job else None):
+            chunks, metadata = self._chunk_raw_docs([doc], chunk_size, chunk_overlap)
+            batch_chunks.extend(chunks)
+            batch_metadata.extend(metadata)
+            if job is not None:
+                job.chunks_parsed += len(chunks)
+            if len(batch_chunks) >= self.config.ingest_batch_chunks:
+                yield batch_chunks, batch_metadata
+                batch_chunks, batch_metadata = [], []
+        if batch_chunks:
+            yield batch_chunks, batch_metadata
+
+    def add_documents(self, paths: List[Path], chunk_size: Optional[int] = None,
+                      chunk_overlap: Optional[int] = None, job: Optional[IndexingJob] = None,
+                      index: Optional[str] = None) -> Dict:
+        """
+        Incrementally index additional files without rebuilding the existing index
+        (the default one, or the named `index`). Only the new chunks are
+        embedded; cost scales with the size of the change. Cancelling `job`
+        stops between batches, keeping the batches already added.
+        """
+        chunk_size = chunk_size or self.config.chunk_size
+        chunk_overlap = self.config.chunk_overlap if chunk_overlap is None else chunk_overlap
+        with self._pinned_generation(index) as gen:
+            print(f"Adding {len(paths)} files to the index...")
+
+            new_chunk_count = 0
+            try:
+                for new_chunks, chunk_metadata in self._iter_chunk_batches(paths, chunk_size, chunk_overlap, job):
+                    if job is not None and job.cancel_event.is_set():
+                        raise IndexingCancelled()
+                    self.retriever.add_documents(new_chunks, metadata=chunk_metadata, generation=gen)
+                    new_chunk_count += len(new_chunks)
+                    if job is not None:
+                        job.chunks_embedded_to(new_chunk_count)
+            finally:
+                if new_chunk_count:
+                    self._corpus_changed(index)
+                    if index is not None:
+                        self.indexes.modified(index)
+            if not new_chunk_count:
+                raise ValueError("No readable documents were found at the specified paths.")
+
+            previous_info = self.get_indexing_info(index)
+            previous_files = previous_info.get("files_indexed", 0) if previous_info else 0
+            info = {
+                "message": f"Added {len(paths)} files as {new_chunk_count} new chunks.",
+                "files_indexed": previous_files + len(paths),
+                "chunks_created": gen.live_count
+            }
+            self._set_indexing_info(index, gen, info)
+            return info
+
+    def remove_source(self, path: Union[str, Path], index: Optional[str] = None) -> int:
+        """Remove all chunks indexed from the given file; returns the number removed"""
+        with self._pinned_generation(index) as gen:
+            removed = self.retriever.remove_source(path, gen)
+            if removed:
+                self._corpus_changed(index)
+                previous_info = self.get_indexing_info(index)
+                if previous_info:
+                    self._set_indexing_info(index, gen, {
+                        **previous_info,
+                        "message": f"Removed {removed} chunks from {path}.",
+                        "files_indexed": max(previous_info.get("files_indexed", 1) - 1, 0),
+                        "chunks_created": gen.live_count
+                    })
+                elif index is not None:
+                    self.indexes.modified(index)
+            if index is None:
+                self.is_initialized = gen.live_count > 0
+            return removed
+
+    def _generation(self, index: Optional[str] = None) -> IndexGeneration:
+        """The default index, or a named one (loaded back if it was evicted)"""
+        return self.retriever.generation if index is None else self.indexes.get(index)
+
+    @contextmanager
+    def _pinned_generation(self, index: Optional[str] = None) -> Iterator[IndexGeneration]:
+        """_generation for in-place writers: a named index stays resident until the block exits"""
+        if index is None:
+            yield self.retriever.generation
+        else:
+            with self.indexes.pinned(index) as gen:
+                yield gen
+
+    def is_ready(self, index: Optional[str] = None) -> bool:
+        """Whether queries against the default index, or the named one, can be answered"""
+        return self.is_initialized if index is None else index in self.indexes
 
-        print(f"Created {len(all_chunks)} chunks for indexing.")
+    def get_indexing_info(self, index: Optional[str] = None) -> Optional[Dict]:
+        return self.indexing_info if index is None else self.indexes.info(index)
 
-        # 3. Build the indices using the retriever component
-        # This calls the build_indices method you updated earlier to return the count
-        chunk_count = self.retriever.build_indices(all_chunks, metadata=None)
+    def _set_indexing_info(self, index: Optional[str], gen: IndexGeneration, info: Dict):
+        if index is None:
+            self.indexing_info = info
+            self.is_initialized = gen.live_count > 0
+        else:
+            self.indexes.modified(index, info)
+
+    def _corpus_changed(self, index: Optional[str] = None):
+        """Drop answers that were computed against the previous corpus of this index"""
+        if self.answer_cache is not None:
+            self.answer_cache.clear(namespace=index or "")
+
+    def save_index(self, path: Optional[Union[str, Path]] = None, index: Optional[str] = None) -> Path:
+        """
+        Write an index snapshot so a restarted process can skip re-indexing.
+        A named index is written to its directory in config.index_registry_dir.
+        """
+        if index is not None:
+            path = self.indexes.save(index)
+            if path is None:
+                raise ValueError("config.index_registry_dir is not set.")
+            return path
+        path = path or self.config.index_snapshot_dir
+        if path is None:
+            raise ValueError("No snapshot path given and config.index_snapshot_dir is not set.")
+        return self.retriever.save_index(path, extra={"indexing_info": self.indexing_info})
+
+    def load_index(self, path: Optional[Union[str, Path]] = None) -> Dict:
+        """Load an index snapshot written by save_index and mark the pipeline ready"""
+        path = path or self.config.index_snapshot_dir
+        if path is None:
+            raise ValueError("No snapshot path given and config.index_snapshot_dir is not set.")
+        manifest = self.retriever.load_index(path)
+        self._corpus_changed()
+        self.indexing_info = manifest.get("extra", {}).get("indexing_info") or {
+            "message": f"Loaded index snapshot with {manifest['num_documents']} chunks.",
+            "files_indexed": 0,
+            "chunks_created": manifest["num_documents"]
+        }
         self.is_initialized = True
-        print("Documents have been successfully indexed.")
+        return self.indexing_info
 
-        # 4. Return the final statistics in a dictionary for the Streamlit UI
+    def query(self, user_query: str, index: Optional[str] = None) -> Dict:
+        """Process a complete query through the RAG pipeline"""
+        return self.query_batch([user_query], index)[0]
+
+    def query_batch(self, queries: List[str], index: Optional[str] = None) -> List[Dict]:
+        """
+        Process several queries together, against the default index or the named
+        `index`. Query encoding, the FAISS search, the cross-encoder and
+        generation each run once over the whole batch; results come back in
+        input order with the same schema as query().
+        """
+        if not self.is_ready(index):
+            return [self._not_ready_result(index) for _ in queries]
+
+        trace = Trace("query_batch", batch_size=len(queries))
+        with trace.activate():
+            results = self._query_batch(queries, index)
+        self._finish_trace(trace, results)
+        return results
+
+    @staticmethod
+    def _not_ready_result(index: Optional[str]) -> Dict:
         return {
-            "message": f"Successfully indexed {len(paths)} files into {chunk_count} chunks.",
-            "files_indexed": len(paths),
-            "chunks_created": chunk_count
+            'success': False,
+            'error': ("Pipeline not initialized. Load documents first." if index is None
+                      else f"Unknown index '{index}'. Index documents into it first."),
+            'answer': '',
+            'confidence': 0.0,
+            'response_time': 0.0
         }
-    def query(self, user_query: str) -> Dict:
-        """Process a complete query through the RAG pipeline"""
 
-        if not self.is_initialized:
-            return {
+    def _query_batch(self, queries: List[str], index: Optional[str] = None) -> List[Dict]:
+        start_time = time.time()
+        results: List[Optional[Dict]] = [None] * len(queries)
+        namespace = index or ""
+        cache_version = self.answer_cache.version(namespace) if self.answer_cache is not None else None
+        try:
+            self._count('total_queries', len(queries))
+            # Every stage of this batch reads the same index, even across a swap or eviction
+            gen = self._generation(index)
+
+            pending = []
+            for i, user_query in enumerate(queries):
+                results[i] = self._validate_input(user_query, start_time)
+                if results[i] is None:
+                    pending.append(i)
+
+            for j, cached_result in self._check_answer_cache([queries[i] for i in pending], namespace).items():
+                results[pending[j]] = self._cached_result(cached_result, start_time)
+            pending = [i for i in pending if results[i] is None]
+
+            with span("preprocessing"):
+                preprocessed = {i: self.preprocessor.preprocess(queries[i]) for i in pending}
+
+            # Indexed fact lookup answers common metric/year questions without retrieval
+            # (or any model call, so it runs before the similarity lookup embeds the query)
+            for i in list(pending):
+                results[i] = self._fact_lookup_result(queries[i], preprocessed[i], start_time, gen)
+                if results[i] is not None:
+                    pending.remove(i)
+
+            cached, cache_embeddings = self._check_similar_answers([queries[i] for i in pending], namespace)
+            for j, cached_result in cached.items():
+                results[pending[j]] = self._cached_result(cached_result, start_time)
+            cache_embeddings = {pending[j]: emb for j, emb in cache_embeddings.items()}
+            pending = [i for i in pending if results[i] is None]
+
+            # The answer cache already embedded the cleaned queries it missed
+            query_embeddings = None
+            if pending and all(i in cache_embeddings for i in pending):
+                query_embeddings = np.stack([cache_embeddings[i] for i in pending])
+            retrieved = dict(zip(pending, self.retriever.multi_stage_retrieve_batch(
+                [preprocessed[i]['cleaned'] for i in pending], gen, query_embeddings)))
+
+            to_generate = []
+            for i in pending:
+                results[i] = self._direct_answer_result(queries[i], preprocessed[i], retrieved[i], start_time)
+                if results[i] is None:
+                    to_generate.append(i)
+
+            generation_results = []
+            if to_generate:
+                with span("generation", queries=len(to_generate)):
+                    generation_results = self.generator.generate_responses(
+                        [preprocessed[i]['cleaned'] for i in to_generate],
+                        [retrieved[i] for i in to_generate]
+                    )
+            for i, generation_result in zip(to_generate, generation_results):
+                logger.debug("Generation result: %s", generation_result)
+                results[i] = self._generation_result(queries[i], preprocessed[i], retrieved[i],
+                                                     generation_result, start_time)
+
+            for i, embedding in cache_embeddings.items():
+                self._cache_answer(queries[i], embedding, results[i], namespace, cache_version)
+            return results
+
+        except Exception as e:
+            logger.exception("Pipeline error: %s", e)
+            error_result = {
                 'success': False,
-                'error': "Pipeline not initialized. Load documents first.",
+                'error': f"Pipeline error: {str(e)}",
                 'answer': '',
                 'confidence': 0.0,
-                'response_time': 0.0
+                'response_time': time.time() - start_time
             }
+            return [result if result is not None else dict(error_result) for result in results]
+
+    def query_stream(self, user_query: str, index: Optional[str] = None) -> Iterator[Dict]:
+        """
+        Streaming variant of query(). Yields {'type': 'token', 'text': ...} events
+        while the answer is generated and finishes with {'type': 'result', 'result': ...}
+        where result has the query() schema plus time_to_first_token. Output
+        guardrails run once the full answer is known, so flags only appear in the
+        final result. Direct extractions and errors yield only the result event.
+        """
+        if not self.is_ready(index):
+            yield {'type': 'result', 'result': self._not_ready_result(index)}
+            return
 
+        trace = Trace("query_stream")
         start_time = time.time()
+        result = None
+        namespace = index or ""
+        cache_version = self.answer_cache.version(namespace) if self.answer_cache is not None else None
         try:
-            self.stats['total_queries'] += 1
-
-            if self.config.enable_input_guardrails:
-                input_validation = self.guardrails.validate_input(user_query)
-                if not input_validation['is_valid']:
-                    self.stats['guardrail_violations'] += 1
-                    return {
-                        'success': False,
-                        'error': f"Input validation failed: {', '.join(input_validation['issues'])}",
-                        'answer': '',
-                        'confidence': 0.0,
-                        'response_time': time.time() - start_time
-                    }
-
-            preprocessed = self.preprocessor.preprocess(user_query)
-
-            retrieved_docs = self.retriever.multi_stage_retrieve(preprocessed['cleaned'])
+            self._count('total_queries')
+            gen = self._generation(index)
+            # Spans are recorded through the context variable, so the trace is only
+            # active around code that does not yield back to the caller
+            with trace.activate():
+                result = self._validate_input(user_query, start_time)
+                cache_embedding = None
+                if result is None:
+                    cached = self._check_answer_cache([user_query], namespace)
+                    if cached:
+                        result = self._cached_result(cached[0], start_time)
+                if result is None:
+                    with span("preprocessing"):
+                        preprocessed = self.preprocessor.preprocess(user_query)
+                    result = self._fact_lookup_result(user_query, preprocessed, start_time, gen)
+                if result is None:
+                    cached, cache_embeddings = self._check_similar_answers([user_query], namespace)
+                    cache_embedding = cache_embeddings.get(0)
+                    if cached:
+                        result = self._cached_result(cached[0], start_time)
+                if result is None:
+                    retrieved_docs = self.retriever.multi_stage_retrieve(preprocessed['cleaned'], gen, cache_embedding)
+                    result = self._direct_answer_result(user_query, preprocessed, retrieved_docs, start_time)
+                if result is not None:
+                    result['time_to_first_token'] = result['response_time']
+
+            if result is None:
+                generation_result = None
+                first_token_time = None
+                generation_start = time.perf_counter()
+                # Closed with this generator, so an abandoned stream stops generating at once
+                with closing(self.generator.generate_response_stream(preprocessed['cleaned'],
+                                                                     retrieved_docs)) as events:
+                    for event in events:
+                        if event['type'] == 'token':
+                            if first_token_time is None:
+                                first_token_time = time.time() - start_time
+                            yield event
+                        else:
+                            generation_result = event['result']
+                trace.add_span("generation", generation_start, time.perf_counter())
+
+                with trace.activate():
+                    result = self._generation_result(user_query, preprocessed, retrieved_docs,
+                                                     generation_result, start_time)
+                result['time_to_first_token'] = first_token_time
+
+            if result.get('success') and not result.get('cached'):
+                self._cache_answer(user_query, cache_embedding,
+                                   {k: v for k, v in result.items() if k != 'time_to_first_token'},
+                                   namespace, cache_version)
+
+        except Exception as e:
+            logger.exception("Pipeline error: %s", e)
+            result = {
+                'success': False,
+                'error': f"Pipeline error: {str(e)}",
+                'answer': '',
+                'confidence': 0.0,
+                'response_time': time.time() - start_time
+            }
+        self._finish_trace(trace, [result])
+        yield {'type': 'result', 'result': result}
+
+    def _finish_trace(self, trace: Trace, results: List[Dict]):
+        """Attach per-stage timings to the results and export the trace if configured"""
+        trace.finish()
+        timings = trace.stage_timings()
+        for result in results:
+            if result is not None:
+                result['stage_timings'] = timings
+        if self.trace_exporter is not None:
+            try:
+                self.trace_exporter.export(trace)
+            except OSError as e:
+                logger.warning("Could not export trace: %s", e)
+
+    def _validate_input(self, user_query: str, start_time: float) -> Optional[Dict]:
+        """Run the input guardrails; returns the failure result, or None if the query may proceed"""
+        if not self.config.enable_input_guardrails:
+            return None
+        with span("guardrails", check="input"):
+            input_validation = self.guardrails.validate_input(user_query)
+        if input_validation['is_valid']:
+            return None
+        self._count('guardrail_violations')
+        return {
+            'success': False,
+            'error': f"Input validation failed: {', '.join(input_validation['issues'])}",
+            'answer': '',
+            'confidence': 0.0,
+            'response_time': time.time() - start_time
+        }
+
+    def _direct_answer_result(self, user_query: str, preprocessed: Dict, retrieved_docs: List[Dict],
+                              start_time: float) -> Optional[Dict]:
+        """Extract a numeric answer from the retrieved chunks, or None to generate one"""
+        with span("extraction", source="retrieved"):
             direct_answer = extract_numeric_answer(user_query, retrieved_docs)
-            print("[DEBUG] Direct answer ",direct_answer)
-            if isinstance(direct_answer, tuple):
-               if all(v is None for v in direct_answer):
-                  direct_answer = None
-            if direct_answer:
-                confidence = 0.95
-                response_time = time.time() - start_time
-                self.stats['successful_queries'] += 1
-                self.stats['avg_response_time'] = (
-                      self.stats['avg_response_time'] * (self.stats['total_queries'] - 1) + response_time
-                        ) / self.stats['total_queries']
-
-                return {
-                   'success': True,
-                   'answer': direct_answer,
-                   'confidence': confidence,
-                   'response_time': response_time,
-                   'method': 'Direct Extraction',
-                   'retrieved_docs': len(retrieved_docs),
-                   'context_tokens': 0,
-                   'generated_tokens': 0,
-                   'preprocessing': preprocessed,
-                   'retrieval_details': retrieved_docs,
-                    'stats': self.get_statistics()
-                  }
-
-            generation_result = self.generator.generate_response(preprocessed['cleaned'], retrieved_docs)
-            print("[DEBUG] Generation result ",generation_result)
-            if self.config.enable_output_guardrails:
+        logger.debug("Direct answer: %s", direct_answer)
+        if isinstance(direct_answer, tuple):
+           if all(v is None for v in direct_answer):
+              direct_answer = None
+        if not direct_answer:
+            return None
+
+        response_time = time.time() - start_time
+        self._record_success(response_time)
+        return {
+           'success': True,
+           'answer': direct_answer,
+           'confidence': 0.95,
+           'response_time': response_time,
+           'method': 'Direct Extraction',
+           'retrieved_docs': len(retrieved_docs),
+           'context_tokens': 0,
+           'generated_tokens': 0,
+           'preprocessing': preprocessed,
+           'retrieval_details': retrieved_docs,
+            'stats': self.get_statistics()
+          }
+
+    def _check_answer_cache(self, queries: List[str], namespace: str = "") -> Dict[int, Dict]:
+        """Exact normalized matches in the answer cache, by position; needs no model call"""
+        if self.answer_cache is None or not queries:
+            return {}
+        hits = {}
+        with span("answer_cache", queries=len(queries), match="exact"):
+            for j, query in enumerate(queries):
+                cached = self.answer_cache.get(query, namespace)
+                if cached is not None:
+                    hits[j] = cached
+        return hits
+
+    def _check_similar_answers(self, queries: List[str],
+                               namespace: str = "") -> Tuple[Dict[int, Dict], Dict[int, np.ndarray]]:
+        """
+        Look queries up in the answer cache by embedding similarity (one encode
+        call for the batch). The cleaned query is embedded, the text stage 1
+        searches with, so a miss hands its embedding on to retrieval instead of
+        being encoded twice. Returns cached results and the embeddings of the
+        misses, both by position.
+        """
+        if self.answer_cache is None or not queries:
+            return {}, {}
+        hits, embeddings = {}, {}
+        with span("answer_cache", queries=len(queries), match="similar"):
+            vectors = self.retriever.encode_queries([self.preprocessor.clean_query(query) for query in queries])
+            for j, embedding in enumerate(vectors):
+                cached = self.answer_cache.get_similar(queries[j], embedding, namespace)
+                if cached is not None:
+                    hits[j] = cached
+                else:
+                    embeddings[j] = embedding
+        return hits, embeddings
+
+    def _cached_result(self, cached: Dict, start_time: float) -> Dict:
+        response_time = time.time() - start_time
+        self._record_success(response_time)
+        return {
+            **cached,
+            'method': f"{cached['method']} (cached)",
+            'response_time': response_time,
+            'cached': True,
+            'stats': self.get_statistics()
+        }
+
+    def _cache_answer(self, user_query: str, embedding: Optional[np.ndarray], result: Optional[Dict],
+                      namespace: str = "", version: Optional[Tuple[int, int]] = None):
+        # An answer computed before the corpus changed is dropped by the version check
+        if self.answer_cache is not None and embedding is not None and result and result.get('success'):
+            self.answer_cache.put(user_query, embedding, result, namespace, version)
+
+    def _fact_lookup_result(self, user_query: str, preprocessed: Dict, start_time: float,
+                            gen: IndexGeneration) -> Optional[Dict]:
+        """Answer from the financial fact index, or None to fall back to retrieval"""
+        if not self.config.enable_fact_index:
+            return None
+        # In-place add/remove change the fact dicts under the write lock
+        with gen.lock.read():
+            with span("extraction", source="fact_index"):
+                fact = gen.fact_index.lookup(user_query)
+            if fact is None:
+                return None
+            logger.debug("Fact index answer: %s", fact)
+
+            chunk_id = fact['chunk_id']
+            source_doc = {
+                'final_rank': 1,
+                'score': 1.0,
+                'text': gen.chunks.text(chunk_id),
+                'metadata': gen.chunks.metadata(chunk_id),
+                'fact': fact
+            }
+        response_time = time.time() - start_time
+        self._record_success(response_time)
+        return {
+            'success': True,
+            'answer': fact['value'],
+            'confidence': 0.95,
+            'response_time': response_time,
+            'method': 'Fact Index Lookup',
+            'retrieved_docs': 1,
+            'context_tokens': 0,
+            'generated_tokens': 0,
+            'preprocessing': preprocessed,
+            'retrieval_details': [source_doc],
+            'stats': self.get_statistics()
+        }
+
+    def _generation_result(self, user_query: str, preprocessed: Dict, retrieved_docs: List[Dict],
+                           generation_result: Dict, start_time: float) -> Dict:
+        """Apply output guardrails to a generated answer and build the query() result"""
+        if self.config.enable_output_guardrails:
+            with span("guardrails", check="output"):
                 output_validation = self.guardrails.validate_output(
                     generation_result['answer'],
                     user_query
                 )
-                if not output_validation['is_valid']:
-                    self.stats['guardrail_violations'] += 1
-                    modified_answer = f"{generation_result['answer']}\n\n[Guardrail flags: {', '.join(output_validation['issues'])}]"
-                    confidence = output_validation['confidence']
-                else:
-                    modified_answer = generation_result['answer']
-                    confidence = output_validation['confidence']
+            if not output_validation['is_valid']:
+                self._count('guardrail_violations')
+                modified_answer = f"{generation_result['answer']}\n\n[Guardrail flags: {', '.join(output_validation['issues'])}]"
+                confidence = output_validation['confidence']
             else:
                 modified_answer = generation_result['answer']
-                confidence = 0.8
+                confidence = output_validation['confidence']
+        else:
+            modified_answer = generation_result['answer']
+            confidence = 0.8
 
-            response_time = time.time() - start_time
-            self.stats['avg_response_time'] = (
-                self.stats['avg_response_time'] * (self.stats['total_queries'] - 1) + response_time
-            ) / self.stats['total_queries']
-            self.stats['successful_queries'] += 1
+        response_time = time.time() - start_time
+        self._record_success(response_time)
 
-            result = {
-                'success': True,
-                'answer': modified_answer,
-                'confidence': confidence,
-                'response_time': response_time,
-                'method': 'Multi-Stage Retrieval (Hybrid + Cross-Encoder)',
-                'retrieved_docs': len(retrieved_docs),
-                'context_tokens': generation_result.get('prompt_tokens', 0),
-                'generated_tokens': generation_result.get('generated_tokens', 0),
-                'preprocessing': preprocessed,
-                'retrieval_details': retrieved_docs,
-                'stats': self.get_statistics()
-            }
-            return result
+        return {
+            'success': True,
+            'answer': modified_answer,
+            'confidence': confidence,
+            'response_time': response_time,
+            'method': 'Multi-Stage Retrieval (Hybrid + Cross-Encoder)',
+            'retrieved_docs': len(retrieved_docs),
+            'context_tokens': generation_result.get('prompt_tokens', 0),
+            'generated_tokens': generation_result.get('generated_tokens', 0),
+            'preprocessing': preprocessed,
+            'retrieval_details': retrieved_docs,
+            'stats': self.get_statistics()
+        }
 
-        except Exception as e:
-            print(f"Pipeline error: {e}")
-            return {
-                'success': False,
-                'error': f"Pipeline error: {str(e)}",
-                'answer': '',
-                'confidence': 0.0,
-                'response_time': time.time() - start_time
-            }
+    def _count(self, key: str, n: int = 1):
+        with self._stats_lock:
+            self.stats[key] += n
+
+    def _record_success(self, response_time: float):
+        """Count a successful query and fold its latency into the running average"""
+        with self._stats_lock:
+            self.stats['successful_queries'] += 1
+            self.stats['avg_response_time'] = (
+                self.stats['avg_response_time'] * (self.stats['successful_queries'] - 1) + response_time
+            ) / self.stats['successful_queries']
 
     def get_statistics(self) -> Dict:
+        with self._stats_lock:
+            stats = dict(self.stats)
+        with self.retriever._stats_lock:
+            cascade_stats = dict(self.retriever.cascade_stats)
+        gen = self.retriever.generation
+        with gen.lock.read():
+            financial_facts = len(gen.fact_index)
         return {
-            **self.stats,
-            'success_rate': self.stats['successful_queries'] / max(self.stats['total_queries'], 1),
-            'guardrail_violation_rate': self.stats['guardrail_violations'] / max(self.stats['total_queries'], 1)
+            **stats,
+            'success_rate': stats['successful_queries'] / max(stats['total_queries'], 1),
+            'guardrail_violation_rate': stats['guardrail_violations'] / max(stats['total_queries'], 1),
+            'embedding_cache': self.retriever.embedding_cache.stats() if self.retriever.embedding_cache else None,
+            'financial_facts': financial_facts,
+            'answer_cache': self.answer_cache.stats() if self.answer_cache else None,
+            'query_embedding_memo': self.retriever.query_embedding_memo.stats(),
+            'rerank_memo': self.retriever.rerank_memo.stats(),
+            'rerank_cascade': cascade_stats,
+            'index_registry': self.indexes.stats(),
+            'models': self.model_status()
         }
 
 
@@ -0,0 +1,314 @@
+"""
+Local HTTP/JSON service for the RAG pipeline with dynamic micro-batching.
+
+Concurrent requests are queued and handed to CompleteRAGPipeline.query_batch
+together, so query encoding, cross-encoder scoring and generation run once per
+micro-batch instead of once per request. A batch closes when it reaches
+--max-batch-size or --max-wait-ms after its first request. The queue holds at
+most --max-queue-depth waiting requests; beyond that requests are rejected
+with 503 and a Retry-After header instead of piling up.
+
+    python rag_server.py --index-dir .rag_index --port 8000
+    curl -s localhost:8000/query -d '{"query": "What was revenue in 2023?"}'
+    curl -s localhost:8000/query -d '{"query": "...", "index": "acme"}'
+
+Endpoints:
+    POST /query    {"query": "...", "index": optional name} -> pipeline result
+    GET  /health   readiness, model load states and queue depth
+    GET  /stats    pipeline and batching statistics
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from convai_group_111_rag_vs_ft import INDEX_MANIFEST_FILE, CompleteRAGPipeline, RAGConfig
+
+logger = logging.getLogger("convai_rag.server")
+
+MAX_BODY_BYTES = 64 * 1024
+
+
+class QueueFull(Exception):
+    """The micro-batch queue is at its depth limit"""
+
+
+class MicroBatcher:
+    """
+    Collects concurrent queries into pipeline.query_batch calls, one call per
+    index named in the batch. The pipeline runs on a single worker thread, so
+    the event loop keeps accepting (and queueing) requests while a batch is
+    being processed.
+    """
+
+    def __init__(self, pipeline: CompleteRAGPipeline, max_batch_size: int = 16, max_wait_ms: float = 10.0,
+                 max_queue_depth: int = 256):
+        self.pipeline = pipeline
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue_depth)
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rag-batch")
+        self.stats = {'batches': 0, 'queries': 0, 'rejected': 0, 'max_batch_size_seen': 0}
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self.executor.shutdown(wait=True)
+
+    @property
+    def depth(self) -> int:
+        return self.queue.qsize()
+
+    async def submit(self, query: str, index: Optional[str] = None) -> Dict:
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((query, index, future))
+        except asyncio.QueueFull:
+            self.stats['rejected'] += 1
+            raise QueueFull()
+        return await future
+
+    async def _collect(self) -> List[Tuple[str, Optional[str], asyncio.Future]]:
+        """Wait for one request, then gather more until the batch is full or max_wait has passed"""
+        batch = [await self.queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        # Requests whose client gave up are not worth computing
+        return [request for request in batch if not request[2].done()]
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            if not batch:
+                continue
+            self.stats['batches'] += 1
+            self.stats['queries'] += len(batch)
+            self.stats['max_batch_size_seen'] = max(self.stats['max_batch_size_seen'], len(batch))
+            by_index: Dict[Optional[str], List[Tuple[str, asyncio.Future]]] = {}
+            for query, index, future in batch:
+                by_index.setdefault(index, []).append((query, future))
+            for index, requests in by_index.items():
+                queries = [query for query, _ in requests]
+                try:
+                    results = await loop.run_in_executor(self.executor, self.pipeline.query_batch, queries, index)
+                except Exception as e:
+                    logger.exception("Batch of %d queries failed", len(requests))
+                    for _, future in requests:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+                for (_, future), result in zip(requests, results):
+                    if not future.done():
+                        future.set_result(result)
+
+    def statistics(self) -> Dict:
+        return {
+            **self.stats,
+            'mean_batch_size': self.stats['queries'] / self.stats['batches'] if self.stats['batches'] else 0.0,
+            'queue_depth': self.depth,
+            'max_queue_depth': self.queue.maxsize,
+        }
+
+
+class RAGServer:
+    """Minimal HTTP/1.1 (keep-alive) JSON server in front of a MicroBatcher"""
+
+    def __init__(self, pipeline: CompleteRAGPipeline, max_batch_size: int = 16, max_wait_ms: float = 10.0,
+                 max_queue_depth: int = 256, request_timeout_s: float = 60.0):
+        self.pipeline = pipeline
+        self.batcher = MicroBatcher(pipeline, max_batch_size, max_wait_ms, max_queue_depth)
+        self.request_timeout_s = request_timeout_s
+        self.started_at = time.time()
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8000) -> int:
+        """Start listening; returns the bound port (useful with port=0)"""
+        self.batcher.start()
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self):
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        await self.batcher.close()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, version = request_line.decode("latin-1").split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get("content-length", 0))
+                if length > MAX_BODY_BYTES:
+                    await self._respond(writer, HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                                        {'error': f"Body larger than {MAX_BODY_BYTES} bytes"}, keep_alive=False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+
+                status, payload, extra_headers = await self._dispatch(method, target.split("?")[0], body)
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                await self._respond(writer, status, payload, keep_alive, extra_headers)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, method: str, path: str, body: bytes) -> Tuple[HTTPStatus, Dict, Dict]:
+        if path == "/query":
+            if method != "POST":
+                return HTTPStatus.METHOD_NOT_ALLOWED, {'error': "Use POST"}, {'Allow': "POST"}
+            return await self._query(body)
+        if path == "/health":
+            return HTTPStatus.OK, {
+                'status': "ok" if self.pipeline.is_initialized else "not_initialized",
+                'models': {name: s['state'] for name, s in self.pipeline.model_status().items()},
+                'queue_depth': self.batcher.depth,
+                'uptime_s': time.time() - self.started_at,
+            }, {}
+        if path == "/stats":
+            # Off the event loop: it waits for the index read lock while an update holds it
+            pipeline_stats = await asyncio.get_running_loop().run_in_executor(None, self.pipeline.get_statistics)
+            return HTTPStatus.OK, {'pipeline': pipeline_stats, 'batching': self.batcher.statistics()}, {}
+        return HTTPStatus.NOT_FOUND, {'error': f"No route for {path}"}, {}
+
+    async def _query(self, body: bytes) -> Tuple[HTTPStatus, Dict, Dict]:
+        try:
+            request = json.loads(body or b"{}")
+            query, index = request.get("query"), request.get("index")
+        except (ValueError, AttributeError):
+            query = index = None
+        if not isinstance(query, str) or not query.strip():
+            return HTTPStatus.BAD_REQUEST, {'error': 'Expected a JSON body like {"query": "..."}'}, {}
+        if index is not None and not isinstance(index, str):
+            return HTTPStatus.BAD_REQUEST, {'error': '"index" must be a string'}, {}
+
+        try:
+            result = await asyncio.wait_for(self.batcher.submit(query, index or None), self.request_timeout_s)
+        except QueueFull:
+            return HTTPStatus.SERVICE_UNAVAILABLE, {'error': "Server busy, retry later"}, {'Retry-After': "1"}
+        except asyncio.TimeoutError:
+            return HTTPStatus.GATEWAY_TIMEOUT, {'error': f"No answer within {self.request_timeout_s} s"}, {}
+        except Exception as e:
+            return HTTPStatus.INTERNAL_SERVER_ERROR, {'error': str(e)}, {}
+        return HTTPStatus.OK, result, {}
+
+    @staticmethod
+    async def _respond(writer: asyncio.StreamWriter, status: HTTPStatus, payload: Dict, keep_alive: bool,
+                       extra_headers: Optional[Dict] = None):
+        body = json.dumps(payload, default=str).encode("utf-8")
+        headers = {
+            'Content-Type': "application/json",
+            'Content-Length': str(len(body)),
+            'Connection': "keep-alive" if keep_alive else "close",
+            **(extra_headers or {}),
+        }
+        head = f"HTTP/1.1 {status.value} {status.phrase}\r\n" + "".join(f"{k}: {v}\r\n" for k, v in headers.items())
+        writer.write(head.encode("latin-1") + b"\r\n" + body)
+        await writer.drain()
+
+
+def build_pipeline(index_dir: str, files: List[str], chunk_size: int, chunk_overlap: int) -> CompleteRAGPipeline:
+    """Pipeline configured like rag_ui, serving the snapshot in index_dir or indexing files at startup"""
+    quantized = set(os.environ.get("RAG_QUANTIZE_INT8", "").split(","))
+    cfg = RAGConfig(
+        index_snapshot_dir=index_dir,
+        index_registry_dir=os.environ.get("RAG_INDEX_REGISTRY_DIR", ".rag_indexes"),
+        index_memory_budget_mb=float(os.environ["RAG_INDEX_MEMORY_BUDGET_MB"])
+        if os.environ.get("RAG_INDEX_MEMORY_BUDGET_MB") else None,
+        embedding_cache_dir=os.environ.get("RAG_EMBEDDING_CACHE_DIR", ".rag_cache"),
+        log_level=os.environ.get("RAG_LOG_LEVEL"),
+        trace_path=os.environ.get("RAG_TRACE_PATH"),
+        quantize_embedding_model="embedding" in quantized,
+        quantize_cross_encoder="cross_encoder" in quantized,
+        quantize_generator="generator" in quantized,
+        inference_backend=os.environ.get("RAG_INFERENCE_BACKEND", "torch"),
+        fusion_strategy=os.environ.get("RAG_FUSION_STRATEGY", "linear"),
+    )
+    pipeline = CompleteRAGPipeline(cfg)
+    # Warm every model before serving; they load concurrently
+    pipeline.preload_models()
+    if files:
+        pipeline.run_indexing([Path(f) for f in files], chunk_size, chunk_overlap)
+    elif (Path(index_dir) / INDEX_MANIFEST_FILE).exists():
+        pipeline.load_index()
+    else:
+        print(f"No index snapshot in {index_dir}; /query answers 'not initialized' until one exists")
+    return pipeline
+
+
+async def serve(pipeline: CompleteRAGPipeline, args):
+    server = RAGServer(pipeline, args.max_batch_size, args.max_wait_ms, args.max_queue_depth, args.timeout)
+    port = await server.start(args.host, args.port)
+    print(f"Serving on http://{args.host}:{port}")
+    try:
+        await server.serve_forever()
+    finally:
+        await server.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--index-dir", default=os.environ.get("RAG_INDEX_DIR", ".rag_index"))
+    parser.add_argument("--files", nargs="*", default=[], help="index these files at startup instead")
+    parser.add_argument("--chunk-size", type=int, default=RAGConfig.chunk_size)
+    parser.add_argument("--chunk-overlap", type=int, default=RAGConfig.chunk_overlap)
+    parser.add_argument("--max-batch-size", type=int, default=16)
+    parser.add_argument("--max-wait-ms", type=float, default=10.0)
+    parser.add_argument("--max-queue-depth", type=int, default=256)
+    parser.add_argument("--timeout", type=float, default=60.0, help="seconds before a queued request gets 504")
+    args = parser.parse_args()
+
+    pipeline = build_pipeline(args.index_dir, args.files, args.chunk_size, args.chunk_overlap)
+    try:
+        asyncio.run(serve(pipeline, args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
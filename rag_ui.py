@@ -1,4 +1,6 @@
 import streamlit as st
+import os
+import shutil
 import time
 from convai_group_111_rag_vs_ft import RAGConfig, CompleteRAGPipeline
 from pathlib import Path
@@ -9,8 +11,85 @@ import tempfile
 def load_pipeline():
     """Loads and initializes the RAG pipeline."""
     # The RAGConfig now comes from your backend file
-    cfg = RAGConfig()
-    return CompleteRAGPipeline(cfg)
+    quantized = set(os.environ.get("RAG_QUANTIZE_INT8", "").split(","))
+    cfg = RAGConfig(
+        index_snapshot_dir=os.environ.get("RAG_INDEX_DIR", ".rag_index"),
+        # Named indexes (one per team or customer) and the memory they may share
+        index_registry_dir=os.environ.get("RAG_INDEX_REGISTRY_DIR", ".rag_indexes"),
+        index_memory_budget_mb=float(os.environ["RAG_INDEX_MEMORY_BUDGET_MB"])
+        if os.environ.get("RAG_INDEX_MEMORY_BUDGET_MB") else None,
+        embedding_cache_dir=os.environ.get("RAG_EMBEDDING_CACHE_DIR", ".rag_cache"),
+        log_level=os.environ.get("RAG_LOG_LEVEL"),
+        trace_path=os.environ.get("RAG_TRACE_PATH"),
+        # Components to load INT8-quantized, e.g. RAG_QUANTIZE_INT8=embedding,cross_encoder,generator
+        quantize_embedding_model="embedding" in quantized,
+        quantize_cross_encoder="cross_encoder" in quantized,
+        quantize_generator="generator" in quantized,
+        inference_backend=os.environ.get("RAG_INFERENCE_BACKEND", "torch"),
+        fusion_strategy=os.environ.get("RAG_FUSION_STRATEGY", "linear"),
+        # Load the models in the background while the page renders (RAG_PRELOAD_MODELS=0: on first use)
+        preload_models=os.environ.get("RAG_PRELOAD_MODELS", "1") != "0",
+    )
+    pipeline = CompleteRAGPipeline(cfg)
+
+    # Warm restart: reuse the last index snapshot instead of re-indexing
+    if (Path(cfg.index_snapshot_dir) / "manifest.json").exists():
+        try:
+            pipeline.load_index()
+        except Exception as e:
+            print(f"Could not load index snapshot: {e}")
+    return pipeline
+
+@st.fragment(run_every=1.0)
+def indexing_progress(pipeline):
+    """Poll the background indexing job; only this fragment reruns while it is in progress"""
+    # Progress and Cancel belong to the session that started the job; others only see that one is running
+    job = st.session_state.get('indexing_job')
+    running = pipeline.indexing_job
+    if running is not None and running is not job and not running.done:
+        st.info("Another session is indexing documents; you can index once it has finished.")
+    if job is None:
+        return
+    progress = job.progress()
+    if not job.done:
+        eta = progress['eta_seconds']
+        st.progress(progress['fraction'], text=(
+            f"Indexing: {progress['files_parsed']}/{progress['total_files']} files parsed, "
+            f"{progress['chunks_embedded']} chunks embedded"
+            + (f", about {eta:.0f}s left" if eta is not None else "")
+        ))
+        if st.button("Cancel Indexing"):
+            job.cancel()
+        return
+
+    # Report a finished job once per session, then refresh the whole page
+    if st.session_state.get('reported_job') is not job:
+        st.session_state.reported_job = job
+        if job.state == "succeeded":
+            st.session_state.indexing_message = ("success", job.result['message'])
+        elif job.state == "cancelled":
+            st.session_state.indexing_message = ("warning", "Indexing cancelled; the previous index is still in use.")
+        else:
+            st.session_state.indexing_message = ("error", f"An error occurred during indexing: {job.error}")
+        st.rerun(scope="app")
+    if 'indexing_message' in st.session_state:
+        level, message = st.session_state.indexing_message
+        getattr(st, level)(message)
+
+MODEL_STATE_ICONS = {"warm": "🟢", "loading": "🟡", "cold": "⚪", "failed": "🔴"}
+
+@st.fragment(run_every=2.0)
+def model_readiness(pipeline):
+    """Which models are loaded; models still cold load on the first query that needs them"""
+    status = pipeline.model_status()
+    st.caption("Models: " + "  ".join(
+        f"{MODEL_STATE_ICONS[s['state']]} {name}"
+        + (f" ({s['load_seconds']:.1f}s)" if s['state'] == "warm" and s['load_seconds'] else "")
+        for name, s in status.items()
+    ))
+    for name, s in status.items():
+        if s['state'] == "failed":
+            st.error(f"Loading {name} failed: {s['error']}")
 
 def run():
     # --- Page Configuration ---
@@ -20,12 +99,18 @@ def run():
 
     # --- Load Pipeline & Initialize Session State ---
     pipeline = load_pipeline()
-    if 'indexing_info' not in st.session_state:
-        st.session_state.indexing_info = None
+    model_readiness(pipeline)
 
     # --- 1. Index Documents ---
     with st.container():
         st.subheader("Index Documents")
+        index_name = st.text_input(
+            "Index name", key="index_name",
+            help="Leave empty to use the shared default index. Named indexes are kept apart, "
+                 "including their cached answers.",
+            placeholder="default"
+        ).strip() or None
+        indexing_info = pipeline.get_indexing_info(index_name) if pipeline.is_ready(index_name) else None
         uploaded_files = st.file_uploader(
             "Upload .txt or .docx or .pdf files  or Zip file with csv",
             accept_multiple_files=True,
@@ -34,49 +119,64 @@ def run():
         
         col1, col2 = st.columns(2)
         with col1:
-            chunk_size = st.text_input("Chunk Size (words)", value="300")
+            chunk_size = st.text_input("Chunk Size (tokens)", value="300")
         with col2:
-            chunk_overlap = st.text_input("Chunk Overlap (words)", value="50")
+            chunk_overlap = st.text_input("Chunk Overlap (tokens)", value="50")
         
         # This checkbox is for display; the actual logic is in your backend
         guardrails_enabled = st.checkbox("Enable Guardrails", value=True)
+        append_to_index = st.checkbox(
+            "Add to existing index", value=False,
+            help="Embed only the uploaded files and append them instead of rebuilding the whole index."
+        )
 
         if st.button("Index Documents"):
-            if uploaded_files:
-                with st.spinner("Processing and indexing documents... This may take a moment."):
-                    # Use a temporary directory that is automatically cleaned up
-                    with tempfile.TemporaryDirectory() as temp_dir:
-                        file_paths = []
-                        for uploaded_file in uploaded_files:
-                            temp_path = Path(temp_dir) / uploaded_file.name
-                            with open(temp_path, "wb") as f:
-                                f.write(uploaded_file.getbuffer())
-                            file_paths.append(temp_path)
-                        
+            if pipeline.indexing_job is not None and not pipeline.indexing_job.done:
+                st.warning("An indexing job is already running.")
+            elif uploaded_files:
+                # The job outlives this script run, so the uploads go to a directory it removes when done
+                temp_dir = tempfile.mkdtemp(prefix="rag_upload_")
+                file_paths = []
+                for uploaded_file in uploaded_files:
+                    temp_path = Path(temp_dir) / uploaded_file.name
+                    with open(temp_path, "wb") as f:
+                        f.write(uploaded_file.getbuffer())
+                    file_paths.append(temp_path)
+
+                def finish(job):
+                    shutil.rmtree(temp_dir, ignore_errors=True)
+                    if job.state == "succeeded":
+                        # Persist a snapshot so the next restart skips re-indexing
                         try:
-                            # Call the new run_indexing method directly
-                            indexing_result = pipeline.run_indexing(
-                                file_paths, int(chunk_size), int(chunk_overlap)
-                            )
-                            # Store the results in the session state
-                            st.session_state.indexing_info = indexing_result
-                            st.success(st.session_state.indexing_info['message'])
+                            pipeline.save_index(index=index_name)
                         except Exception as e:
-                            st.error(f"An error occurred during indexing: {e}")
+                            print(f"Could not save index snapshot: {e}")
+
+                try:
+                    # Queries keep being answered from the current index while the job runs
+                    st.session_state.indexing_job = pipeline.start_indexing(
+                        file_paths, int(chunk_size), int(chunk_overlap),
+                        append=append_to_index, on_finish=finish, index=index_name
+                    )
+                except Exception as e:
+                    shutil.rmtree(temp_dir, ignore_errors=True)
+                    st.error(f"An error occurred during indexing: {e}")
             else:
                 st.warning("Please upload files to index.")
 
+        indexing_progress(pipeline)
+
         # --- DYNAMIC Indexing Status Expander ---
-        if st.session_state.indexing_info:
+        if indexing_info:
             with st.expander("Indexing Status", expanded=True):
-                info = st.session_state.indexing_info
+                info = indexing_info
                 col1, col2 = st.columns(2)
                 col1.metric("Files Indexed", info.get('files_indexed', 0))
                 col2.metric("Chunks Created", info.get('chunks_created', 0))
 
     # --- 2. Ask a Question ---
     # This section now only appears AFTER documents have been indexed successfully
-    if st.session_state.indexing_info:
+    if indexing_info:
         with st.container():
             st.subheader("Ask a Question")
             q_col1, q_col2 = st.columns([3, 1])
@@ -89,22 +189,33 @@ def run():
 
             if st.button("Ask"):
                 if user_question:
+                    st.markdown("#### Answer")
+                    answer_box = st.empty()
+                    response = {}
+                    partial_answer = ""
                     with st.spinner("Retrieving and answering..."):
-                        # Call the pipeline's query method to get a real answer
-                        response = pipeline.query(user_question)
-
-                        if response.get('success'):
-                            st.markdown("#### Answer")
-                            st.info(response.get('answer', 'No answer could be generated.'))
-
-                            res_col1, res_col2, res_col3 = st.columns(3)
-                            res_col1.metric("Confidence", f"{response.get('confidence', 0.0):.2f}")
-                            res_col2.metric("Method Used", response.get('method', 'RAG'))
-                            res_col3.metric("Response Time", f"{response.get('response_time', 0.0):.2f}s")
-
-                            with st.expander("Detailed Information & Retrieved Documents"):
-                                st.json(response.get('retrieval_details', {}))
-                        else:
-                            st.error(f"Failed to get an answer: {response.get('error', 'Unknown error')}")
+                        # Stream the answer so the first tokens show up while generation continues
+                        for event in pipeline.query_stream(user_question, index=index_name):
+                            if event['type'] == 'token':
+                                partial_answer += event['text']
+                                answer_box.info(partial_answer + " ▌")
+                            else:
+                                response = event['result']
+
+                    if response.get('success'):
+                        answer_box.info(response.get('answer') or 'No answer could be generated.')
+
+                        res_col1, res_col2, res_col3, res_col4 = st.columns(4)
+                        res_col1.metric("Confidence", f"{response.get('confidence', 0.0):.2f}")
+                        res_col2.metric("Method Used", response.get('method', 'RAG'))
+                        res_col3.metric("Response Time", f"{response.get('response_time', 0.0):.2f}s")
+                        ttft = response.get('time_to_first_token')
+                        res_col4.metric("First Token", f"{ttft:.2f}s" if ttft is not None else "-")
+
+                        with st.expander("Detailed Information & Retrieved Documents"):
+                            st.json(response.get('retrieval_details', {}))
+                    else:
+                        answer_box.empty()
+                        st.error(f"Failed to get an answer: {response.get('error', 'Unknown error')}")
                 else:
                     st.warning("Please enter a question.")